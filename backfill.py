@@ -0,0 +1,208 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# HubSpot caps one search query at 10,000 results (after + limit); past that
+# the query is restarted from the last hs_createdate seen
+SEARCH_RESULT_LIMIT = 10000
+
+def parse_time(value):
+    """
+    Epoch milliseconds from a millisecond timestamp or an ISO 8601 date or
+    datetime (UTC unless it carries an offset).
+    """
+    value = str(value).strip()
+    if value.isdigit():
+        return int(value)
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp() * 1000)
+
+def created_ms(note):
+    return parse_time(note["properties"]["hs_createdate"])
+
+def note_event(note, portal_id=None):
+    """
+    Webhook-shaped 'note created' event for a search result. The note key
+    is shared with live events, so notes the webhook already handled are
+    skipped as duplicates (given a persistent IDEMPOTENCY_BACKEND).
+    """
+    note_id = note["id"]
+    event = {
+        "eventId": f"backfill-{note_id}",
+        "subscriptionType": "object.creation",
+        "occurredAt": created_ms(note),
+        "objectId": int(note_id) if str(note_id).isdigit() else note_id,
+        "objectTypeId": "0-4",
+        "changeSource": "BACKFILL"
+    }
+    if portal_id is not None:
+        event["portalId"] = int(portal_id) if str(portal_id).isdigit() else portal_id
+    return event
+
+def load_checkpoint(path, start_ms, end_ms, dry_run, restart=False, portal_id=None):
+    """
+    Load the checkpoint at `path`, or start a new one for the window. A
+    checkpoint for a different window, mode or portal is refused unless `restart`.
+    """
+    if os.path.exists(path) and not restart:
+        with open(path) as f:
+            checkpoint = json.load(f)
+        if (checkpoint["start_ms"], checkpoint["end_ms"], checkpoint["dry_run"], checkpoint.get("portal_id")) != \
+                (start_ms, end_ms, dry_run, portal_id):
+            raise ValueError(
+                f"Checkpoint {path} is for window {checkpoint['start_ms']}..{checkpoint['end_ms']} "
+                f"(dry_run={checkpoint['dry_run']}, portal {checkpoint.get('portal_id') or 'default'}); "
+                f"pass the same arguments, --restart or another --checkpoint"
+            )
+        return checkpoint
+    return {
+        "start_ms": start_ms,
+        "end_ms": end_ms,
+        "dry_run": dry_run,
+        "portal_id": portal_id,
+        "cursor_ms": start_ms,
+        "after": None,
+        "boundary_ids": [],
+        "max_ms": start_ms,
+        "max_ids": [],
+        "done": False,
+        "pages": 0,
+        "counts": {}
+    }
+
+def save_checkpoint(path, checkpoint):
+    # Replace atomically so an interruption never leaves a half-written checkpoint
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp_path, path)
+
+def next_position(checkpoint, response, page_size):
+    """
+    Search position after `response`: {"cursor_ms", "after", "boundary_ids",
+    "max_ms", "max_ids"}, or None when the window is exhausted.
+
+    Within a query, HubSpot's paging cursor is followed, while "max_ms" /
+    "max_ids" track the latest hs_createdate seen and every note at it,
+    across the query's pages. When the next page would pass the
+    10,000-result cap, the query restarts at that hs_createdate, skipping
+    those notes ("boundary_ids").
+    """
+    max_ms = checkpoint.get("max_ms", checkpoint["cursor_ms"])
+    max_ids = list(checkpoint.get("max_ids", checkpoint["boundary_ids"]))
+    for note in response.get("results", []):
+        note_ms = created_ms(note)
+        if note_ms > max_ms:
+            max_ms, max_ids = note_ms, [note["id"]]
+        elif note_ms == max_ms and note["id"] not in max_ids:
+            max_ids.append(note["id"])
+
+    after = ((response.get("paging") or {}).get("next") or {}).get("after")
+    if not after:
+        return None
+    if int(after) + page_size <= SEARCH_RESULT_LIMIT:
+        return {"cursor_ms": checkpoint["cursor_ms"], "after": after, "boundary_ids": checkpoint["boundary_ids"],
+                "max_ms": max_ms, "max_ids": max_ids}
+    return {"cursor_ms": max_ms, "after": None, "boundary_ids": max_ids, "max_ms": max_ms, "max_ids": max_ids}
+
+def run_backfill(args):
+    """
+    Page through the notes created in the window and run each page through
+    the webhook pipeline, checkpointing after every page.
+
+    Only one page is held in memory; the next page is fetched while the
+    current one is processed. Pages are processed at least once: a page
+    interrupted mid-way is processed again on resume, and the idempotency
+    store skips notes it already triggered for.
+    """
+    # Imported here so --help works without HubSpot configuration
+    import main
+    from hubspot_client import get_portal_client, portal_key
+    import metrics
+
+    start_ms = parse_time(args.start)
+    end_ms = parse_time(args.end) if args.end else int(time.time() * 1000)
+    checkpoint = load_checkpoint(args.checkpoint, start_ms, end_ms, args.dry_run, args.restart, args.portal_id)
+    if checkpoint["done"]:
+        logger.info(f"Backfill already complete per {args.checkpoint}: {checkpoint['counts']}")
+        return checkpoint
+
+    client = get_portal_client(portal_key(args.portal_id))
+    page_size = min(args.page_size, 200)
+
+    def search(position):
+        return client.search_notes_created(position["cursor_ms"], end_ms, after=position["after"], limit=page_size)
+
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="backfill-search") as prefetch:
+        pending = prefetch.submit(search, checkpoint)
+        while True:
+            response = pending.result()
+            position = next_position(checkpoint, response, page_size)
+            if position is not None:
+                # Fetch the next page while this one is processed
+                pending = prefetch.submit(search, position)
+
+            boundary_ids = set(checkpoint["boundary_ids"])
+            notes = [note for note in response.get("results", []) if note["id"] not in boundary_ids]
+            if notes:
+                events = [note_event(note, args.portal_id) for note in notes]
+                with metrics.delivery("backfill_page", events=len(events), dry_run=args.dry_run):
+                    outcomes = main.process_events(client, events, dry_run=args.dry_run)
+                counts = Counter(outcome["status"] for outcome in outcomes)
+                for status, count in counts.items():
+                    checkpoint["counts"][status] = checkpoint["counts"].get(status, 0) + count
+                if args.dry_run:
+                    for outcome in outcomes:
+                        if outcome["status"] == "would_trigger":
+                            print(json.dumps(outcome, default=str), flush=True)
+                logger.info(
+                    f"Page {checkpoint['pages'] + 1}: {len(notes)} notes up to "
+                    f"{notes[-1]['properties']['hs_createdate']} ({dict(counts)}), total {response.get('total')}"
+                )
+
+            checkpoint["pages"] += 1
+            if position is None:
+                checkpoint["done"] = True
+            else:
+                checkpoint.update(position)
+            save_checkpoint(args.checkpoint, checkpoint)
+            if checkpoint["done"]:
+                break
+
+    logger.info(f"Backfill complete: {checkpoint['counts']}")
+    return checkpoint
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Reprocess notes created in a time window through the webhook pipeline (e.g. after an outage)."
+    )
+    parser.add_argument("--start", required=True, help="Window start: ISO 8601 date/datetime (UTC by default) or epoch ms")
+    parser.add_argument("--end", help="Window end, inclusive (default: now)")
+    parser.add_argument("--dry-run", action="store_true", help="Only report the triggers that would fire (JSON lines on stdout)")
+    parser.add_argument("--checkpoint", help="Resume file, updated after every page "
+                                              "(default: backfill_checkpoint.json, or backfill_checkpoint.dry_run.json)")
+    parser.add_argument("--restart", action="store_true", help="Ignore an existing checkpoint and start the window over")
+    parser.add_argument("--portal-id", help="Portal to backfill: a portalId from PORTAL_CONFIG (default: the default portal)")
+    parser.add_argument("--page-size", type=int, default=100, help="Notes per search page (HubSpot maximum 200)")
+    args = parser.parse_args()
+    if not args.checkpoint:
+        args.checkpoint = "backfill_checkpoint.dry_run.json" if args.dry_run else "backfill_checkpoint.json"
+
+    try:
+        result = run_backfill(args)
+    except ValueError as e:
+        logger.error(str(e))
+        sys.exit(2)
+    sys.exit(0 if not result["counts"].get("dead_lettered") else 1)
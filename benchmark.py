@@ -0,0 +1,196 @@
+import argparse
+import json
+import logging
+import os
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from fake_hubspot import FakeHubSpot, EPISODE_TYPE
+
+# Configure logging
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+def percentile(values, pct):
+    """
+    Nearest-rank percentile of a non-empty list.
+    """
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+def make_event(event_id, note_id, occurred_at=None):
+    return {
+        "eventId": event_id,
+        "subscriptionId": 1,
+        "portalId": 46446185,
+        "occurredAt": occurred_at or int(time.time() * 1000),
+        "subscriptionType": "object.creation",
+        "attemptNumber": 0,
+        "objectId": note_id,
+        "objectTypeId": "0-4",
+        "changeSource": "CRM_UI"
+    }
+
+def synthetic_deliveries(fake, deliveries, events_per_delivery):
+    """
+    Seed the fake with one note per event and return the event batches.
+    """
+    note_ids = fake.seed_synthetic(deliveries * events_per_delivery)
+    return [
+        [make_event(note_id, note_id) for note_id in note_ids[i:i + events_per_delivery]]
+        for i in range(0, len(note_ids), events_per_delivery)
+    ]
+
+def _event_from_record(fake, record, index):
+    """
+    Turn a recorded item into a webhook event. Workflow-payload shaped items
+    (test_payloads.json: noteId/objectId/objectType/authorUserId) also seed the
+    fake with the note and its record; webhook events are used as-is.
+    """
+    if "noteId" in record:
+        note_id = record["noteId"]
+        object_type = record.get("objectType", EPISODE_TYPE)
+        fake.add_object(object_type, record["objectId"], owner_id=None, name=record.get("objectname"))
+        fake.add_note(note_id, record.get("authorUserId", 1), object_type, record["objectId"])
+        return make_event(index, note_id)
+    return record
+
+def load_deliveries(fake, path):
+    """
+    Load recorded deliveries. A .jsonl file holds one delivery per line (a
+    list of events, or a single event); a .json file holds one delivery
+    (a list) or a mapping of named items, each replayed as its own event.
+    """
+    deliveries = []
+    index = 1
+    with open(path) as f:
+        if path.endswith(".jsonl"):
+            chunks = [json.loads(line) for line in f if line.strip()]
+        else:
+            data = json.load(f)
+            chunks = [data] if isinstance(data, list) else [list(data.values())]
+    for chunk in chunks:
+        records = chunk if isinstance(chunk, list) else [chunk]
+        delivery = []
+        for record in records:
+            delivery.append(_event_from_record(fake, record, index))
+            index += 1
+        deliveries.append(delivery)
+    return deliveries
+
+def run_benchmark(args):
+    fake = FakeHubSpot(
+        latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000,
+        rate_429=args.rate_429, error_rate=args.error_rate, seed=args.seed
+    ).start()
+
+    if args.payload:
+        deliveries = load_deliveries(fake, args.payload) * args.repeat
+    else:
+        deliveries = synthetic_deliveries(fake, args.deliveries, args.events_per_delivery)
+
+    # Point the function at the fake before config is imported
+    os.environ.update({
+        "HUBSPOT_ACCESS_TOKEN": "benchmark-token",
+        "HUBSPOT_API_BASE_URL": fake.base_url,
+        "WORKFLOW_WEBHOOK_URL": fake.webhook_url("auth"),
+        "WORKFLOW_WEBHOOK_URL_EPISODE": fake.webhook_url("episode"),
+        "HUBSPOT_RATE_LIMIT_PER_SECOND": str(args.rate_limit),
+        "HUBSPOT_RATE_LIMIT_BURST": str(args.rate_limit),
+        "LOG_LEVEL": "WARNING",
+    })
+    # Keep dead-lettered events out of the real store
+    os.environ["DEAD_LETTER_BACKEND"] = "file"
+    os.environ["DEAD_LETTER_PATH"] = os.path.join(tempfile.mkdtemp(prefix="benchmark-"), "dead_letters.jsonl")
+    if not args.keep_dedup:
+        # Replays reuse event IDs; do not let the idempotency store skip them
+        os.environ["IDEMPOTENCY_MAX_ENTRIES"] = "0"
+        os.environ["IDEMPOTENCY_BACKEND"] = "memory"
+
+    from flask import Flask
+    import main
+    # Per-delivery metric summaries would drown the report
+    logging.getLogger("noteifications.metrics").setLevel(logging.WARNING)
+
+    app = Flask("benchmark")
+
+    def deliver(events):
+        with app.test_request_context("/", method="POST", json=events):
+            from flask import request
+            started = time.perf_counter()
+            response = main.handle_webhook(request)
+            elapsed = time.perf_counter() - started
+        status = response[1] if isinstance(response, tuple) else 200
+        failed_events = response[0].get_json().get("failed", 0) if status == 200 else 0
+        return elapsed, status, failed_events
+
+    if args.warmup:
+        # Cold start (owner directory load, client creation) is not part of steady state
+        deliver(deliveries[0])
+        fake.reset_counters()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        outcomes = list(pool.map(deliver, deliveries))
+    wall = time.perf_counter() - started
+    fake.stop()
+
+    latencies = [elapsed for elapsed, _, _ in outcomes]
+    total_events = sum(len(d) for d in deliveries)
+    report = {
+        "deliveries": len(deliveries),
+        "events": total_events,
+        "failed_deliveries": sum(1 for _, status, _ in outcomes if status != 200),
+        "dead_lettered_events": sum(failed for _, _, failed in outcomes),
+        "wall_seconds": round(wall, 3),
+        "events_per_second": round(total_events / wall, 1) if wall else None,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 1),
+            "p95": round(percentile(latencies, 95) * 1000, 1),
+            "p99": round(percentile(latencies, 99) * 1000, 1),
+            "mean": round(statistics.mean(latencies) * 1000, 1),
+        },
+        "api_calls": fake.api_calls(),
+        "api_calls_per_event": round(fake.api_calls() / total_events, 3) if total_events else None,
+        "workflow_triggers": len(fake.triggers),
+        "calls_by_endpoint": dict(fake.calls),
+    }
+    return report
+
+def print_report(report):
+    print(f"Deliveries:          {report['deliveries']} ({report['failed_deliveries']} failed)")
+    print(f"Events:              {report['events']} ({report['dead_lettered_events']} dead-lettered)")
+    print(f"Wall time:           {report['wall_seconds']} s")
+    print(f"Throughput:          {report['events_per_second']} events/s")
+    latency = report["latency_ms"]
+    print(f"Delivery latency:    p50 {latency['p50']} ms | p95 {latency['p95']} ms | p99 {latency['p99']} ms | mean {latency['mean']} ms")
+    print(f"HubSpot API calls:   {report['api_calls']} ({report['api_calls_per_event']} per event)")
+    print(f"Workflow triggers:   {report['workflow_triggers']}")
+    for endpoint, count in sorted(report["calls_by_endpoint"].items()):
+        print(f"  {count:6d}  {endpoint}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark handle_webhook against a local fake HubSpot.")
+    parser.add_argument("--deliveries", type=int, default=20, help="Synthetic deliveries to send")
+    parser.add_argument("--events-per-delivery", type=int, default=50)
+    parser.add_argument("--payload", help="Replay recorded deliveries from a .json or .jsonl file instead")
+    parser.add_argument("--repeat", type=int, default=1, help="Replay the recorded deliveries this many times")
+    parser.add_argument("--concurrency", type=int, default=1, help="Deliveries in flight at once")
+    parser.add_argument("--latency-ms", type=float, default=20, help="Latency added to every fake HubSpot request")
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--rate-429", type=float, default=0, help="Probability of an injected 429 per request")
+    parser.add_argument("--error-rate", type=float, default=0, help="Probability of an injected 500 per request")
+    parser.add_argument("--rate-limit", type=float, default=1000, help="Client-side HubSpot requests/second")
+    parser.add_argument("--keep-dedup", action="store_true", help="Leave the idempotency store enabled")
+    parser.add_argument("--no-warmup", dest="warmup", action="store_false", help="Include the cold first delivery")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    report = run_benchmark(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
@@ -0,0 +1,83 @@
+import logging
+import threading
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def trigger_key(trigger):
+    """
+    Triggers for the same record (in the same portal) are coalesced together.
+    """
+    return (trigger.get("portal_id"), trigger["object_type"], str(trigger["object_id"]))
+
+def merge_triggers(current, new):
+    """
+    Merge two triggers for the same record. The most recent note (by the
+    event's occurredAt, falling back to arrival order) supplies the note ID
+    and author; every note ID and event is kept.
+    """
+    current_at = current.get("occurred_at") or 0
+    new_at = new.get("occurred_at") or 0
+    merged = dict(new if new_at >= current_at else current)
+    merged["note_ids"] = current["note_ids"] + [note_id for note_id in new["note_ids"] if note_id not in current["note_ids"]]
+    merged["events"] = current["events"] + new["events"]
+    return merged
+
+def coalesce_triggers(triggers):
+    """
+    Collapse a list of triggers to one per (portal, object type, object ID),
+    in order of each record's first trigger.
+    """
+    coalesced = {}
+    for trigger in triggers:
+        key = trigger_key(trigger)
+        coalesced[key] = merge_triggers(coalesced[key], trigger) if key in coalesced else trigger
+    return list(coalesced.values())
+
+class TriggerCoalescer:
+    """
+    Holds triggers for `window_seconds` after the first trigger for a record,
+    merging any further triggers for that record, then sends one trigger
+    through `send(trigger)`.
+
+    Pending triggers live in process memory, so this needs an instance that
+    keeps CPU allocated after responding (e.g. Cloud Run "CPU always allocated"),
+    and flush_all before it shuts down.
+    """
+
+    def __init__(self, window_seconds, send):
+        self.window_seconds = window_seconds
+        self.send = send
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def add(self, trigger):
+        key = trigger_key(trigger)
+        with self._lock:
+            if key in self._pending:
+                self._pending[key] = merge_triggers(self._pending[key], trigger)
+                return
+            self._pending[key] = trigger
+        timer = threading.Timer(self.window_seconds, self._flush, args=(key,))
+        timer.daemon = True
+        timer.start()
+
+    def _flush(self, key):
+        with self._lock:
+            trigger = self._pending.pop(key, None)
+        if trigger is None:
+            return
+        try:
+            self.send(trigger)
+        except Exception as e:
+            logger.error(f"Failed to send coalesced trigger for {key[1]} {key[2]} (notes {trigger['note_ids']}): {e}")
+
+    def flush_all(self):
+        """
+        Send every pending trigger now (e.g. before shutdown).
+        """
+        with self._lock:
+            keys = list(self._pending.keys())
+        for key in keys:
+            self._flush(key)
@@ -1,5 +1,24 @@
+import json
 import os
-from google.cloud import secretmanager
+import threading
+import time
+
+# Secret Manager client, created once per process on first use
+_secret_client = None
+_secret_client_lock = threading.Lock()
+
+def get_secret_client():
+    """
+    Return the process-wide Secret Manager client, creating it on first use.
+    """
+    global _secret_client
+    with _secret_client_lock:
+        if _secret_client is None:
+            # Imported lazily: the generated client is slow to import and is
+            # only needed when HUBSPOT_ACCESS_TOKEN is not set
+            from google.cloud import secretmanager
+            _secret_client = secretmanager.SecretManagerServiceClient()
+        return _secret_client
 
 def get_secret(secret_name, project_id):
     """
@@ -10,7 +29,7 @@ def get_secret(secret_name, project_id):
         return None
 
     try:
-        client = secretmanager.SecretManagerServiceClient()
+        client = get_secret_client()
         name = f"projects/{project_id}/secrets/{secret_name}/versions/latest"
         response = client.access_secret_version(request={"name": name})
         return response.payload.data.decode("UTF-8")
@@ -19,22 +38,187 @@ def get_secret(secret_name, project_id):
         raise e
 
 # Configuration
+# Root log level; set to WARNING in production to skip per-event INFO logging
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# Set on Cloud Functions / Cloud Run, where /tmp is in-memory and private to one instance
+RUNNING_ON_CLOUD = bool(os.environ.get("K_SERVICE"))
 PROJECT_ID = os.environ.get("GCP_PROJECT", "lumininternal")
 HUBSPOT_SECRET_NAME = os.environ.get("HUBSPOT_SECRET_NAME", "Lumin-OS-Hubspot-API")
+HUBSPOT_API_BASE_URL = os.environ.get("HUBSPOT_API_BASE_URL", "https://api.hubapi.com")
 # Default URLs (can be overridden by environment variables)
-# Auth Workflow (2-54811911)
+# Insurance Authorization Workflow (2-56205178; also the default for contacts)
 WORKFLOW_WEBHOOK_URL_AUTH = os.environ.get("WORKFLOW_WEBHOOK_URL", "https://api-na1.hubapi.com/automation/v4/webhook-triggers/46446185/BfJsN4l")
 # Treatment Episode Workflow (2-56205176)
 WORKFLOW_WEBHOOK_URL_EPISODE = os.environ.get("WORKFLOW_WEBHOOK_URL_EPISODE", "https://api-na1.hubapi.com/automation/v4/webhook-triggers/46446185/TrAycxB")
+# How long the in-process owner directory is served before a background refresh
+OWNER_CACHE_TTL_SECONDS = int(os.environ.get("OWNER_CACHE_TTL_SECONDS", "900"))
+# Maximum number of webhook events processed in parallel per instance
+EVENT_CONCURRENCY = max(1, int(os.environ.get("EVENT_CONCURRENCY", "8")))
+# Acknowledge-fast mode: enqueue events and return, a worker drains the queue later
+ACK_FAST_MODE = os.environ.get("ACK_FAST_MODE", "false").lower() == "true"
+# Queue backend for acknowledge-fast mode: "pubsub" (the default on Cloud Functions / Cloud Run) or "sqlite" (local runs)
+EVENT_QUEUE_BACKEND = os.environ.get("EVENT_QUEUE_BACKEND", "pubsub" if RUNNING_ON_CLOUD else "sqlite")
+EVENT_QUEUE_PATH = os.environ.get("EVENT_QUEUE_PATH", "/tmp/noteifications_queue.db")
+EVENT_QUEUE_LEASE_SECONDS = int(os.environ.get("EVENT_QUEUE_LEASE_SECONDS", "300"))
+EVENT_QUEUE_TOPIC = os.environ.get("EVENT_QUEUE_TOPIC", "hubspot-note-events")
+EVENT_QUEUE_SUBSCRIPTION = os.environ.get("EVENT_QUEUE_SUBSCRIPTION", "hubspot-note-events-worker")
+# Events pulled per batch by the queue worker
+EVENT_QUEUE_BATCH_SIZE = int(os.environ.get("EVENT_QUEUE_BATCH_SIZE", "100"))
+# Dedup of HubSpot redeliveries, keyed on eventId and note ID
+# "memory" and "sqlite" only dedupe within one instance; "redis" is shared by every instance
+IDEMPOTENCY_BACKEND = os.environ.get("IDEMPOTENCY_BACKEND", "memory") # "memory", "sqlite" or "redis"
+IDEMPOTENCY_DB_PATH = os.environ.get("IDEMPOTENCY_DB_PATH", "/tmp/noteifications_idempotency.db")
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_MAX_ENTRIES = int(os.environ.get("IDEMPOTENCY_MAX_ENTRIES", "10000"))
+# Outbound HTTP: timeouts, connection pool and retry with jittered backoff
+HTTP_CONNECT_TIMEOUT_SECONDS = float(os.environ.get("HTTP_CONNECT_TIMEOUT_SECONDS", "5"))
+HTTP_READ_TIMEOUT_SECONDS = float(os.environ.get("HTTP_READ_TIMEOUT_SECONDS", "30"))
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", "20"))
+HTTP_MAX_RETRIES = int(os.environ.get("HTTP_MAX_RETRIES", "3"))
+HTTP_BACKOFF_BASE_SECONDS = float(os.environ.get("HTTP_BACKOFF_BASE_SECONDS", "0.5"))
+HTTP_BACKOFF_MAX_SECONDS = float(os.environ.get("HTTP_BACKOFF_MAX_SECONDS", "30"))
+# Total time one request may spend waiting between retries; kept below HubSpot's webhook timeout
+HTTP_RETRY_BUDGET_SECONDS = float(os.environ.get("HTTP_RETRY_BUDGET_SECONDS", "3"))
+# Token bucket shared by all outbound HubSpot calls (HubSpot enforces a per-10-second limit)
+HUBSPOT_RATE_LIMIT_PER_SECOND = float(os.environ.get("HUBSPOT_RATE_LIMIT_PER_SECOND", "10"))
+HUBSPOT_RATE_LIMIT_BURST = float(os.environ.get("HUBSPOT_RATE_LIMIT_BURST", "10"))
+# Send one workflow trigger per record when several notes on it trigger together
+TRIGGER_COALESCING = os.environ.get("TRIGGER_COALESCING", "false").lower() == "true"
+# Optionally also hold triggers this long to coalesce across deliveries (0 = within a delivery only)
+TRIGGER_COALESCE_WINDOW_SECONDS = float(os.environ.get("TRIGGER_COALESCE_WINDOW_SECONDS", "0"))
+# Object-ID-to-owner index fed by hubspot_owner_id propertyChange webhooks
+# Only "redis" is shared by every instance; on Cloud Functions / Cloud Run the index is off ("none") unless it is set
+OWNER_INDEX_BACKEND = os.environ.get("OWNER_INDEX_BACKEND", "none" if RUNNING_ON_CLOUD else "memory") # "none", "memory", "sqlite" or "redis"
+OWNER_INDEX_DB_PATH = os.environ.get("OWNER_INDEX_DB_PATH", "/tmp/noteifications_owner_index.db")
+# Indexed owners older than this are re-read from the API (bounds staleness if a change webhook is lost)
+OWNER_INDEX_TTL_SECONDS = int(os.environ.get("OWNER_INDEX_TTL_SECONDS", "3600"))
+# Most entries the in-process ("memory") owner index keeps; the least recently used are evicted
+OWNER_INDEX_MAX_ENTRIES = int(os.environ.get("OWNER_INDEX_MAX_ENTRIES", "100000"))
+# Two-level cache (in-process LRU + shared tier) for owners, object names and schemas
+CACHE_BACKEND = os.environ.get("CACHE_BACKEND", "memory") # "memory" (in-process only), "sqlite" or "redis"
+CACHE_DB_PATH = os.environ.get("CACHE_DB_PATH", "/tmp/noteifications_cache.db")
+CACHE_REDIS_URL = os.environ.get("CACHE_REDIS_URL", "redis://localhost:6379/0")
+CACHE_KEY_PREFIX = os.environ.get("CACHE_KEY_PREFIX", "noteifications:")
+# Redis server of the "redis" idempotency backend
+IDEMPOTENCY_REDIS_URL = os.environ.get("IDEMPOTENCY_REDIS_URL", CACHE_REDIS_URL)
+# Redis server of the "redis" owner index backend
+OWNER_INDEX_REDIS_URL = os.environ.get("OWNER_INDEX_REDIS_URL", CACHE_REDIS_URL)
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", "10000"))
+# Cross-instance single flight (redis backend): how long a load lock is held at most, and how long
+# other instances wait for the lock holder's result before loading the key themselves
+CACHE_LOAD_LOCK_SECONDS = float(os.environ.get("CACHE_LOAD_LOCK_SECONDS", "10"))
+CACHE_LOAD_WAIT_SECONDS = float(os.environ.get("CACHE_LOAD_WAIT_SECONDS", "2"))
+# How long "not found" answers (404s) are cached
+CACHE_NEGATIVE_TTL_SECONDS = int(os.environ.get("CACHE_NEGATIVE_TTL_SECONDS", "300"))
+OBJECT_NAME_CACHE_TTL_SECONDS = int(os.environ.get("OBJECT_NAME_CACHE_TTL_SECONDS", "3600"))
+# Per-event failure handling: in-process retries, then the dead-letter store
+EVENT_MAX_RETRIES = int(os.environ.get("EVENT_MAX_RETRIES", "2"))
+# Most time a delivery spends waiting between event retries
+EVENT_RETRY_BUDGET_SECONDS = float(os.environ.get("EVENT_RETRY_BUDGET_SECONDS", "3"))
+# "redis" (shared), or "sqlite" / "file" (JSON Lines), which are local to one instance
+DEAD_LETTER_BACKEND = os.environ.get("DEAD_LETTER_BACKEND", "sqlite")
+DEAD_LETTER_PATH = os.environ.get(
+    "DEAD_LETTER_PATH",
+    "/tmp/noteifications_dead_letters.jsonl" if DEAD_LETTER_BACKEND == "file" else "/tmp/noteifications_dead_letters.db"
+)
+DEAD_LETTER_REDIS_URL = os.environ.get("DEAD_LETTER_REDIS_URL", CACHE_REDIS_URL)
+# Dead-lettered events replayed per redrive invocation
+DEAD_LETTER_REDRIVE_BATCH_SIZE = int(os.environ.get("DEAD_LETTER_REDRIVE_BATCH_SIZE", "500"))
+# Object types notes are routed to, highest priority first. Each entry names the object by
+# objectTypeId, name or fully qualified name, with its workflow webhook URL and optional
+# "display_name" / "name_property" overrides (defaults come from the portal's CRM schemas)
+NOTE_ROUTES = json.loads(os.environ.get("NOTE_ROUTES") or "null") or [
+    {"object": "contacts", "display_name": "Contact", "webhook_url": WORKFLOW_WEBHOOK_URL_AUTH},
+    {"object": "2-56205176", "display_name": "Treatment Episode", "webhook_url": WORKFLOW_WEBHOOK_URL_EPISODE},
+    {"object": "2-56205178", "display_name": "Insurance Authorization", "webhook_url": WORKFLOW_WEBHOOK_URL_AUTH}
+]
+# How long the portal's custom object schemas are cached
+SCHEMA_CACHE_TTL_SECONDS = int(os.environ.get("SCHEMA_CACHE_TTL_SECONDS", "86400"))
+# Additional HubSpot portals served by this deployment, keyed by portalId. Each entry may set
+# "secret_name" (Secret Manager secret holding the portal's token), "access_token_env" (env var
+# holding it, for local runs), "routes" (NOTE_ROUTES for the portal) and "rate_limit_per_second" /
+# "rate_limit_burst". Events from portals not listed here use the default token and NOTE_ROUTES.
+PORTAL_CONFIG = {str(portal_id): settings for portal_id, settings in json.loads(os.environ.get("PORTAL_CONFIG") or "{}").items()}
+# Per-portal clients kept warm at most, and how long an unused one is kept
+PORTAL_CLIENT_POOL_SIZE = max(1, int(os.environ.get("PORTAL_CLIENT_POOL_SIZE", "8")))
+PORTAL_CLIENT_IDLE_SECONDS = int(os.environ.get("PORTAL_CLIENT_IDLE_SECONDS", "1800"))
+# HubSpot app client secret used to verify the X-HubSpot-Signature-v3 of webhook requests,
+# from HUBSPOT_CLIENT_SECRET or the Secret Manager secret HUBSPOT_CLIENT_SECRET_NAME (verification
+# is off when neither is set). Portals in PORTAL_CONFIG may add "client_secret_name" / "client_secret_env".
+HUBSPOT_CLIENT_SECRET_NAME = os.environ.get("HUBSPOT_CLIENT_SECRET_NAME", "")
+# Signed requests older than this are rejected as replays
+SIGNATURE_MAX_AGE_SECONDS = int(os.environ.get("SIGNATURE_MAX_AGE_SECONDS", "300"))
+# Public URL HubSpot calls (the signed URI). Required on Cloud Functions / Cloud Run when signatures are
+# verified: the function sees an internal URL there, and the function name may be stripped from the path
+WEBHOOK_PUBLIC_URL = os.environ.get("WEBHOOK_PUBLIC_URL", "")
+# Event pre-filtering: subscription types handled, and the portals accepted (empty = any portal)
+HANDLED_SUBSCRIPTION_TYPES = {
+    t.strip() for t in os.environ.get(
+        "HANDLED_SUBSCRIPTION_TYPES",
+        "object.creation,object.propertyChange,contact.propertyChange,company.propertyChange,deal.propertyChange"
+    ).split(",") if t.strip()
+}
+ALLOWED_PORTAL_IDS = {p.strip() for p in os.environ.get("ALLOWED_PORTAL_IDS", "").split(",") if p.strip()}
+# How long a token fetched from Secret Manager is reused before it is fetched again
+HUBSPOT_TOKEN_TTL_SECONDS = int(os.environ.get("HUBSPOT_TOKEN_TTL_SECONDS", "3600"))
+
+# Cached secrets shared by every invocation on a warm instance: secret name -> (value, fetched_at)
+_tokens = {}
+_token_lock = threading.Lock()
 
-def get_hubspot_access_token():
+def get_cached_secret(secret_name, env_var=None, force_refresh=False):
+    """
+    Return the value of environment variable `env_var` if set, otherwise
+    `secret_name` from Secret Manager, cached for HUBSPOT_TOKEN_TTL_SECONDS.
+    """
+    local_value = os.environ.get(env_var) if env_var else None
+    if local_value:
+        return local_value
+    if not secret_name:
+        return None
+
+    with _token_lock:
+        token, fetched_at = _tokens.get(secret_name, (None, None))
+        expired = fetched_at is None or time.monotonic() - fetched_at >= HUBSPOT_TOKEN_TTL_SECONDS
+        if force_refresh or expired or not token:
+            token = get_secret(secret_name, PROJECT_ID)
+            _tokens[secret_name] = (token, time.monotonic())
+        return token
+
+def get_hubspot_access_token(force_refresh=False, secret_name=HUBSPOT_SECRET_NAME, env_var="HUBSPOT_ACCESS_TOKEN"):
     """
     Returns the HubSpot Access Token.
-    Favor environment variable HUBSPOT_ACCESS_TOKEN if set (for local testing),
-    otherwise fetch from Secret Manager.
-    """
-    local_token = os.environ.get("HUBSPOT_ACCESS_TOKEN")
-    if local_token:
-        return local_token
-    
-    return get_secret(HUBSPOT_SECRET_NAME, PROJECT_ID)
+    Favor environment variable `env_var` (HUBSPOT_ACCESS_TOKEN by default) if
+    set (for local testing), otherwise fetch `secret_name` from Secret Manager.
+    The fetched token is cached for HUBSPOT_TOKEN_TTL_SECONDS; pass
+    force_refresh=True after a 401.
+    """
+    return get_cached_secret(secret_name, env_var, force_refresh)
+
+def client_secret_sources():
+    """
+    The (scope, secret_name, env_var) triples a client secret is configured
+    in: the default one (scope None) and any set per portal in PORTAL_CONFIG
+    (scope: the portal ID). Nothing is fetched.
+    """
+    sources = [(None, HUBSPOT_CLIENT_SECRET_NAME, "HUBSPOT_CLIENT_SECRET")]
+    sources += [
+        (portal_id, settings.get("client_secret_name"), settings.get("client_secret_env"))
+        for portal_id, settings in PORTAL_CONFIG.items()
+    ]
+    return [(scope, secret_name, env_var) for scope, secret_name, env_var in sources
+            if secret_name or (env_var and os.environ.get(env_var))]
+
+def get_client_secrets():
+    """
+    Returns the HubSpot app client secrets webhook signatures are checked
+    against (see client_secret_sources), as {secret: scopes}: the portals
+    whose events the secret may sign (None for portals without their own
+    secret). Empty when signature verification is not configured.
+    """
+    secrets = {}
+    for scope, secret_name, env_var in client_secret_sources():
+        secret = get_cached_secret(secret_name, env_var)
+        if secret:
+            secrets.setdefault(secret, set()).add(scope)
+    return secrets
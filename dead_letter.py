@@ -0,0 +1,241 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import closing
+from redis_client import get_redis_client
+from config import DEAD_LETTER_BACKEND, DEAD_LETTER_PATH, DEAD_LETTER_REDIS_URL, CACHE_KEY_PREFIX, RUNNING_ON_CLOUD
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class DeadLetterStore(ABC):
+    """
+    Events that failed permanently, or still failed after their in-process retries.
+
+    Each entry is a dict with "id", "event", "error", "attempts" (how many
+    times it was dead-lettered) and "failed_at". Entries stay until
+    `remove` is called with their IDs, normally after a successful redrive.
+    """
+
+    @abstractmethod
+    def add(self, failures):
+        """
+        Store (event, error) pairs as new entries.
+        """
+
+    @abstractmethod
+    def list(self, limit):
+        """
+        Return up to `limit` entries, oldest first.
+        """
+
+    @abstractmethod
+    def remove(self, entry_ids):
+        """
+        Delete entries by ID.
+        """
+
+    @abstractmethod
+    def record_failure(self, entry_id, error):
+        """
+        Note another failed redrive of an entry.
+        """
+
+class SQLiteDeadLetterStore(DeadLetterStore):
+    """
+    SQLite-backed dead-letter store.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS dead_letters ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "payload TEXT NOT NULL, "
+                "error TEXT, "
+                "attempts INTEGER NOT NULL DEFAULT 1, "
+                "failed_at REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        return closing(sqlite3.connect(self.path, timeout=30, isolation_level=None))
+
+    def add(self, failures):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT INTO dead_letters (payload, error, failed_at) VALUES (?, ?, ?)",
+                [(json.dumps(event), str(error), now) for event, error in failures]
+            )
+            conn.execute("COMMIT")
+
+    def list(self, limit):
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id, payload, error, attempts, failed_at FROM dead_letters ORDER BY id LIMIT ?", (limit,)
+            ).fetchall()
+        return [
+            {"id": str(entry_id), "event": json.loads(payload), "error": error, "attempts": attempts, "failed_at": failed_at}
+            for entry_id, payload, error, attempts, failed_at in rows
+        ]
+
+    def remove(self, entry_ids):
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany("DELETE FROM dead_letters WHERE id = ?", [(int(entry_id),) for entry_id in entry_ids])
+            conn.execute("COMMIT")
+
+    def record_failure(self, entry_id, error):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE dead_letters SET error = ?, attempts = attempts + 1, failed_at = ? WHERE id = ?",
+                (str(error), time.time(), int(entry_id))
+            )
+
+class FileDeadLetterStore(DeadLetterStore):
+    """
+    JSON Lines file, one entry per line. Readable with any text tool; fine
+    for low volumes on a single instance.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def _write(self, entries):
+        # Replace atomically so a crash mid-write cannot truncate the file
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + "\n")
+        os.replace(tmp_path, self.path)
+
+    def add(self, failures):
+        now = time.time()
+        with self._lock, open(self.path, "a") as f:
+            for event, error in failures:
+                entry = {"id": uuid.uuid4().hex, "event": event, "error": str(error), "attempts": 1, "failed_at": now}
+                f.write(json.dumps(entry) + "\n")
+
+    def list(self, limit):
+        with self._lock:
+            return self._read()[:limit]
+
+    def remove(self, entry_ids):
+        entry_ids = set(entry_ids)
+        with self._lock:
+            self._write([entry for entry in self._read() if entry["id"] not in entry_ids])
+
+    def record_failure(self, entry_id, error):
+        with self._lock:
+            entries = self._read()
+            for entry in entries:
+                if entry["id"] == entry_id:
+                    entry.update(error=str(error), attempts=entry["attempts"] + 1, failed_at=time.time())
+            self._write(entries)
+
+class RedisDeadLetterStore(DeadLetterStore):
+    """
+    Redis (or Memorystore) dead-letter store shared by every instance:
+    entries are JSON values in a hash keyed by ID, ordered by a sorted set.
+    """
+
+    def __init__(self, url, prefix=CACHE_KEY_PREFIX):
+        self.client = get_redis_client(url)
+        self.entries_key = f"{prefix}dead_letters"
+        self.order_key = f"{prefix}dead_letters:order"
+        self.next_id_key = f"{prefix}dead_letters:next_id"
+
+    def add(self, failures):
+        if not failures:
+            return
+        now = time.time()
+        first_id = self.client.incrby(self.next_id_key, len(failures)) - len(failures) + 1
+        pipeline = self.client.pipeline()
+        for entry_id, (event, error) in enumerate(failures, start=first_id):
+            entry = {"id": str(entry_id), "event": event, "error": str(error), "attempts": 1, "failed_at": now}
+            pipeline.hset(self.entries_key, str(entry_id), json.dumps(entry))
+            pipeline.zadd(self.order_key, {str(entry_id): entry_id})
+        pipeline.execute()
+
+    def list(self, limit):
+        entry_ids = self.client.zrange(self.order_key, 0, limit - 1)
+        if not entry_ids:
+            return []
+        return [json.loads(value) for value in self.client.hmget(self.entries_key, entry_ids) if value is not None]
+
+    def remove(self, entry_ids):
+        entry_ids = list(entry_ids)
+        if not entry_ids:
+            return
+        pipeline = self.client.pipeline()
+        pipeline.zrem(self.order_key, *entry_ids)
+        pipeline.hdel(self.entries_key, *entry_ids)
+        pipeline.execute()
+
+    def record_failure(self, entry_id, error):
+        value = self.client.hget(self.entries_key, entry_id)
+        if value is None:
+            return
+        entry = json.loads(value)
+        entry.update(error=str(error), attempts=entry["attempts"] + 1, failed_at=time.time())
+        self.client.hset(self.entries_key, entry_id, json.dumps(entry))
+
+def dead_letter_store_is_local():
+    """
+    True when DEAD_LETTER_BACKEND is a sqlite or file store under /tmp on
+    Cloud Functions / Cloud Run: it lives in one instance's memory, so its
+    entries would be lost with the instance and never seen by a redrive
+    running elsewhere.
+    """
+    return DEAD_LETTER_BACKEND in ("sqlite", "file") and RUNNING_ON_CLOUD and DEAD_LETTER_PATH.startswith("/tmp/")
+
+def check_dead_letter_config():
+    """
+    Warn once, at cold start, when no shared dead-letter store is configured.
+    """
+    if dead_letter_store_is_local():
+        logger.warning(
+            f"DEAD_LETTER_BACKEND={DEAD_LETTER_BACKEND} at {DEAD_LETTER_PATH} is local to this instance; "
+            "failed events are only logged. Set DEAD_LETTER_BACKEND=redis (or a DEAD_LETTER_PATH on shared storage)"
+        )
+
+# Store shared across warm invocations
+_dead_letter_store = None
+_dead_letter_store_lock = threading.Lock()
+
+def get_dead_letter_store():
+    """
+    Return the process-wide dead-letter store for the configured DEAD_LETTER_BACKEND,
+    or None when the store would be local to this instance on Cloud
+    Functions / Cloud Run (see dead_letter_store_is_local). Callers then
+    log failed events instead.
+    """
+    global _dead_letter_store
+    if dead_letter_store_is_local():
+        return None
+    with _dead_letter_store_lock:
+        if _dead_letter_store is None:
+            if DEAD_LETTER_BACKEND == "redis":
+                _dead_letter_store = RedisDeadLetterStore(DEAD_LETTER_REDIS_URL)
+            elif DEAD_LETTER_BACKEND == "sqlite":
+                _dead_letter_store = SQLiteDeadLetterStore(DEAD_LETTER_PATH)
+            elif DEAD_LETTER_BACKEND == "file":
+                _dead_letter_store = FileDeadLetterStore(DEAD_LETTER_PATH)
+            else:
+                raise ValueError(f"Unknown DEAD_LETTER_BACKEND: {DEAD_LETTER_BACKEND}")
+        return _dead_letter_store
@@ -0,0 +1,157 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import closing
+from config import (
+    EVENT_QUEUE_BACKEND, EVENT_QUEUE_PATH, EVENT_QUEUE_LEASE_SECONDS,
+    EVENT_QUEUE_TOPIC, EVENT_QUEUE_SUBSCRIPTION, PROJECT_ID, RUNNING_ON_CLOUD
+)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class EventQueue(ABC):
+    """
+    Durable queue of webhook events for acknowledge-fast mode.
+
+    `dequeue` hands out (receipt, event) pairs. An event stays in the queue
+    until its receipt is passed to `ack`; unacknowledged events become
+    visible again once the backend's lease or ack deadline expires.
+    """
+
+    @abstractmethod
+    def enqueue(self, events):
+        """
+        Durably store events; raises if they could not be stored.
+        """
+
+    @abstractmethod
+    def dequeue(self, max_events):
+        """
+        Lease up to `max_events` events, returned as (receipt, event) pairs.
+        """
+
+    @abstractmethod
+    def ack(self, receipts):
+        """
+        Remove handled events by receipt.
+        """
+
+class SQLiteEventQueue(EventQueue):
+    """
+    Local SQLite-backed queue. Stands in for Pub/Sub in local runs and tests;
+    refused on Cloud Functions / Cloud Run, where each instance has its own /tmp.
+    """
+
+    def __init__(self, path, lease_seconds=300):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS events ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "payload TEXT NOT NULL, "
+                "enqueued_at REAL NOT NULL, "
+                "leased_until REAL)"
+            )
+
+    def _connect(self):
+        # Autocommit mode; multi-statement writes use explicit BEGIN IMMEDIATE / COMMIT
+        return closing(sqlite3.connect(self.path, timeout=30, isolation_level=None))
+
+    def enqueue(self, events):
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT INTO events (payload, enqueued_at) VALUES (?, ?)",
+                [(json.dumps(event), now) for event in events]
+            )
+            conn.execute("COMMIT")
+
+    def dequeue(self, max_events):
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            # Lease the oldest visible events so concurrent workers do not pick them up
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                "SELECT id, payload FROM events WHERE leased_until IS NULL OR leased_until < ? "
+                "ORDER BY id LIMIT ?",
+                (now, max_events)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE events SET leased_until = ? WHERE id = ?",
+                [(now + self.lease_seconds, row[0]) for row in rows]
+            )
+            conn.execute("COMMIT")
+        return [(row[0], json.loads(row[1])) for row in rows]
+
+    def ack(self, receipts):
+        with self._lock, self._connect() as conn:
+            conn.executemany("DELETE FROM events WHERE id = ?", [(receipt,) for receipt in receipts])
+
+class PubSubEventQueue(EventQueue):
+    """
+    Google Cloud Pub/Sub backed queue: events are published to `topic` and
+    pulled from `subscription`. The Pub/Sub client is imported on first use.
+    """
+
+    def __init__(self, project_id, topic, subscription):
+        from google.cloud import pubsub_v1
+
+        self.publisher = pubsub_v1.PublisherClient()
+        self.subscriber = pubsub_v1.SubscriberClient()
+        self.topic_path = self.publisher.topic_path(project_id, topic)
+        self.subscription_path = self.subscriber.subscription_path(project_id, subscription)
+
+    def enqueue(self, events):
+        futures = [self.publisher.publish(self.topic_path, json.dumps(event).encode("utf-8")) for event in events]
+        # Only report success once every event is durably stored
+        for future in futures:
+            future.result()
+
+    def dequeue(self, max_events):
+        response = self.subscriber.pull(
+            request={"subscription": self.subscription_path, "max_messages": max_events},
+            timeout=30
+        )
+        return [
+            (received.ack_id, json.loads(received.message.data.decode("utf-8")))
+            for received in response.received_messages
+        ]
+
+    def ack(self, receipts):
+        if receipts:
+            self.subscriber.acknowledge(request={"subscription": self.subscription_path, "ack_ids": list(receipts)})
+
+# Queue shared across warm invocations
+_event_queue = None
+_event_queue_lock = threading.Lock()
+
+def get_event_queue():
+    """
+    Return the process-wide event queue for the configured EVENT_QUEUE_BACKEND.
+    Raises for the sqlite backend under /tmp on Cloud Functions / Cloud Run:
+    events acknowledged there would only be visible to the instance that
+    queued them, and lost with it.
+    """
+    global _event_queue
+    with _event_queue_lock:
+        if _event_queue is None:
+            if EVENT_QUEUE_BACKEND == "pubsub":
+                _event_queue = PubSubEventQueue(PROJECT_ID, EVENT_QUEUE_TOPIC, EVENT_QUEUE_SUBSCRIPTION)
+            elif EVENT_QUEUE_BACKEND == "sqlite":
+                if RUNNING_ON_CLOUD and EVENT_QUEUE_PATH.startswith("/tmp/"):
+                    raise ValueError(
+                        f"EVENT_QUEUE_BACKEND=sqlite at {EVENT_QUEUE_PATH} is local to this instance; "
+                        "use EVENT_QUEUE_BACKEND=pubsub"
+                    )
+                _event_queue = SQLiteEventQueue(EVENT_QUEUE_PATH, EVENT_QUEUE_LEASE_SECONDS)
+            else:
+                raise ValueError(f"Unknown EVENT_QUEUE_BACKEND: {EVENT_QUEUE_BACKEND}")
+        return _event_queue
@@ -0,0 +1,315 @@
+import argparse
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from flask import Flask, jsonify, request
+from werkzeug.serving import make_server
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Object types used by the synthetic data set
+EPISODE_TYPE = "2-56205176"
+AUTH_TYPE = "2-56205178"
+
+# Custom object schemas served by /crm/v3/schemas
+SCHEMAS = [
+    {"objectTypeId": EPISODE_TYPE, "name": "treatment_episodes", "fullyQualifiedName": "p46446185_treatment_episodes",
+     "labels": {"singular": "Treatment Episode", "plural": "Treatment Episodes"}, "primaryDisplayProperty": "name"},
+    {"objectTypeId": AUTH_TYPE, "name": "insurance_authorizations", "fullyQualifiedName": "p46446185_insurance_authorizations",
+     "labels": {"singular": "Insurance Authorization", "plural": "Insurance Authorizations"}, "primaryDisplayProperty": "name"}
+]
+
+# Synthetic notes are created one minute apart from this instant
+SYNTHETIC_EPOCH = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+# HubSpot caps a search query at 10,000 results (after + limit)
+SEARCH_RESULT_LIMIT = 10000
+
+def to_millis(value):
+    """
+    Epoch milliseconds from a HubSpot datetime: ISO 8601 string or millisecond number.
+    """
+    if isinstance(value, (int, float)) or str(value).isdigit():
+        return int(value)
+    return int(datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp() * 1000)
+
+class FakeHubSpot:
+    """
+    Local stand-in for the HubSpot endpoints this function calls: notes and
+    object reads, notes search by hs_createdate, v4 note associations, owners,
+    custom object schemas and workflow webhook triggers.
+
+    `latency` (seconds, plus up to `jitter` extra) is added to every request.
+    `rate_429` and `error_rate` are the probabilities of answering a request
+    with a 429 (with Retry-After) or a 500. Requests are counted per endpoint.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, rate_429=0.0, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.notes = {}
+        self.associations = {}
+        self.objects = {}
+        self.owners = {}
+        self.triggers = []
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self._server = None
+        self.app = self._build_app()
+
+    # --- Data ---
+
+    def add_owner(self, owner_id, user_id, first_name="", last_name="", email=None):
+        self.owners[str(owner_id)] = {
+            "id": str(owner_id), "userId": int(user_id), "firstName": first_name,
+            "lastName": last_name, "email": email or f"owner{owner_id}@example.com"
+        }
+
+    def add_object(self, object_type, object_id, owner_id=None, name=None):
+        self.objects[(object_type, str(object_id))] = {
+            "hubspot_owner_id": str(owner_id) if owner_id else None,
+            "name": name or f"Record {object_id}"
+        }
+
+    def add_note(self, note_id, author_user_id, object_type, object_id, created_at=None):
+        self.notes[str(note_id)] = {
+            "hs_created_by_user_id": str(author_user_id),
+            "hs_createdate": created_at or "2026-01-01T00:00:00Z"
+        }
+        self.associations[str(note_id)] = {object_type: [str(object_id)]}
+
+    def seed_synthetic(self, num_notes, num_objects=50, num_owners=20, first_note_id=1):
+        """
+        Populate owners, Treatment Episodes / Insurance Authorizations and
+        notes. Roughly a third of the notes are written by the record owner.
+        """
+        for i in range(1, num_owners + 1):
+            self.add_owner(1000 + i, 5000 + i, f"Owner{i}", "Test")
+        object_refs = []
+        for i in range(1, num_objects + 1):
+            object_type = EPISODE_TYPE if i % 2 else AUTH_TYPE
+            owner_id = None if i % 10 == 0 else 1000 + self.random.randint(1, num_owners)
+            self.add_object(object_type, 900000 + i, owner_id)
+            object_refs.append((object_type, str(900000 + i), owner_id))
+        note_ids = []
+        for n in range(first_note_id, first_note_id + num_notes):
+            object_type, object_id, owner_id = self.random.choice(object_refs)
+            if owner_id and self.random.random() < 0.33:
+                author = self.owners[str(owner_id)]["userId"]
+            else:
+                author = 5000 + self.random.randint(1, num_owners)
+            created_at = (SYNTHETIC_EPOCH + timedelta(minutes=n)).isoformat().replace("+00:00", "Z")
+            self.add_note(n, author, object_type, object_id, created_at)
+            note_ids.append(n)
+        return note_ids
+
+    # --- Server ---
+
+    def _build_app(self):
+        app = Flask("fake_hubspot")
+
+        @app.before_request
+        def simulate_network():
+            endpoint = request.url_rule.rule if request.url_rule else request.path
+            with self._lock:
+                self.calls[endpoint] += 1
+            delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+            if delay:
+                time.sleep(delay)
+            roll = self.random.random()
+            if roll < self.rate_429:
+                return jsonify({"status": "error", "category": "RATE_LIMITS"}), 429, {"Retry-After": "1"}
+            if roll < self.rate_429 + self.error_rate:
+                return jsonify({"status": "error", "message": "Injected failure"}), 500
+
+        @app.post("/crm/v3/objects/<object_type>/batch/read")
+        def batch_read(object_type):
+            body = request.get_json()
+            properties = body.get("properties") or []
+            results = []
+            errors = []
+            for item in body.get("inputs", []):
+                record = self._record(object_type, item["id"])
+                if record is None:
+                    errors.append({"status": "error", "message": "Not found", "context": {"ids": [item["id"]]}})
+                    continue
+                results.append({"id": item["id"], "properties": {p: record.get(p) for p in properties}})
+            response = {"status": "COMPLETE", "results": results}
+            if errors:
+                response["errors"] = errors
+                response["numErrors"] = len(errors)
+            return jsonify(response), 207 if errors else 200
+
+        @app.post("/crm/v3/objects/<object_type>/search")
+        def search(object_type):
+            body = request.get_json()
+            if object_type in ("notes", "0-4"):
+                ids = list(self.notes)
+            else:
+                ids = [object_id for t, object_id in self.objects if t == object_type]
+            groups = body.get("filterGroups") or [{"filters": []}]
+            records = []
+            for object_id in ids:
+                record = self._record(object_type, object_id)
+                if any(all(self._matches(record, f) for f in group.get("filters", [])) for group in groups):
+                    records.append((object_id, record))
+            for sort in reversed(body.get("sorts") or []):
+                records.sort(key=lambda item: self._sort_value(item[1], sort["propertyName"]),
+                             reverse=sort.get("direction") == "DESCENDING")
+            start = int(body.get("after") or 0)
+            limit = min(int(body.get("limit", 10)), 200)
+            if start + limit > SEARCH_RESULT_LIMIT:
+                return jsonify({"status": "error", "message": "Search results are capped at 10,000"}), 400
+            properties = body.get("properties") or []
+            page = records[start:start + limit]
+            response = {"total": len(records), "results": [
+                {"id": object_id, "properties": {p: record.get(p) for p in properties}} for object_id, record in page
+            ]}
+            if start + limit < len(records):
+                response["paging"] = {"next": {"after": str(start + limit)}}
+            return jsonify(response)
+
+        @app.get("/crm/v3/objects/<object_type>/<object_id>")
+        def get_object(object_type, object_id):
+            record = self._record(object_type, object_id)
+            if record is None:
+                return jsonify({"status": "error", "message": "Not found"}), 404
+            properties = [p for p in request.args.get("properties", "").split(",") if p]
+            return jsonify({"id": object_id, "properties": {p: record.get(p) for p in properties}})
+
+        @app.post("/crm/v4/associations/<from_type>/<to_type>/batch/read")
+        def batch_associations(from_type, to_type):
+            results = []
+            for item in request.get_json().get("inputs", []):
+                ids = self.associations.get(item["id"], {}).get(to_type, [])
+                if ids:
+                    results.append({
+                        "from": {"id": item["id"]},
+                        "to": [{"toObjectId": int(i), "associationTypes": []} for i in ids]
+                    })
+            return jsonify({"status": "COMPLETE", "results": results})
+
+        @app.get("/crm/v3/schemas")
+        def list_schemas():
+            return jsonify({"results": SCHEMAS})
+
+        @app.get("/crm/v3/owners")
+        @app.get("/crm/v3/owners/")
+        def list_owners():
+            owners = list(self.owners.values())
+            limit = int(request.args.get("limit", 100))
+            start = int(request.args.get("after", 0))
+            response = {"results": owners[start:start + limit]}
+            if start + limit < len(owners):
+                response["paging"] = {"next": {"after": str(start + limit)}}
+            return jsonify(response)
+
+        @app.get("/crm/v3/owners/<owner_id>")
+        def get_owner(owner_id):
+            if request.args.get("idProperty") == "userId":
+                owner = next((o for o in self.owners.values() if str(o["userId"]) == owner_id), None)
+            else:
+                owner = self.owners.get(owner_id)
+            if owner is None:
+                return jsonify({"status": "error", "message": "Not found"}), 404
+            return jsonify(owner)
+
+        @app.post("/automation/v4/webhook-triggers/<portal_id>/<key>")
+        def webhook_trigger(portal_id, key):
+            with self._lock:
+                self.triggers.append((key, request.get_json()))
+            return jsonify({"status": "accepted"})
+
+        return app
+
+    @staticmethod
+    def _sort_value(record, property_name):
+        value = record.get(property_name)
+        if property_name.endswith("date"):
+            return to_millis(value or 0)
+        return str(value or "")
+
+    @staticmethod
+    def _matches(record, search_filter):
+        value = record.get(search_filter["propertyName"])
+        if value is None:
+            return search_filter["operator"] == "NOT_HAS_PROPERTY"
+        operator = search_filter["operator"]
+        if operator == "HAS_PROPERTY":
+            return True
+        if search_filter["propertyName"].endswith("date"):
+            value = to_millis(value)
+            low = to_millis(search_filter["value"])
+            high = to_millis(search_filter["highValue"]) if "highValue" in search_filter else None
+        else:
+            low, high = search_filter.get("value"), search_filter.get("highValue")
+        return {
+            "EQ": lambda: value == low, "NEQ": lambda: value != low,
+            "GT": lambda: value > low, "GTE": lambda: value >= low,
+            "LT": lambda: value < low, "LTE": lambda: value <= low,
+            "BETWEEN": lambda: low <= value <= high
+        }[operator]()
+
+    def _record(self, object_type, object_id):
+        if object_type in ("notes", "0-4"):
+            return self.notes.get(str(object_id))
+        return self.objects.get((object_type, str(object_id)))
+
+    def start(self, host="127.0.0.1", port=0):
+        self._server = make_server(host, port, self.app, threaded=True)
+        threading.Thread(target=self._server.serve_forever, name="fake-hubspot", daemon=True).start()
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server = None
+
+    @property
+    def base_url(self):
+        return f"http://{self._server.host}:{self._server.port}"
+
+    def webhook_url(self, key):
+        return f"{self.base_url}/automation/v4/webhook-triggers/46446185/{key}"
+
+    def api_calls(self):
+        """
+        Number of CRM API requests served (workflow webhook triggers excluded).
+        """
+        return sum(count for endpoint, count in self.calls.items() if not endpoint.startswith("/automation/"))
+
+    def reset_counters(self):
+        with self._lock:
+            self.calls.clear()
+            self.triggers.clear()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local HubSpot stand-in server with synthetic data.")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--notes", type=int, default=1000, help="Synthetic notes to create (IDs 1..N)")
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--rate-429", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    args = parser.parse_args()
+
+    fake = FakeHubSpot(latency=args.latency_ms / 1000, rate_429=args.rate_429, error_rate=args.error_rate, seed=1)
+    fake.seed_synthetic(args.notes)
+    fake.start(port=args.port)
+    print(f"Fake HubSpot listening on {fake.base_url}")
+    print(f"  HUBSPOT_API_BASE_URL={fake.base_url}")
+    print(f"  WORKFLOW_WEBHOOK_URL={fake.webhook_url('auth')}")
+    print(f"  WORKFLOW_WEBHOOK_URL_EPISODE={fake.webhook_url('episode')}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
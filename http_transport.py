@@ -0,0 +1,185 @@
+import email.utils
+import logging
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError
+import metrics
+from config import (
+    HTTP_CONNECT_TIMEOUT_SECONDS, HTTP_READ_TIMEOUT_SECONDS, HTTP_POOL_SIZE,
+    HTTP_MAX_RETRIES, HTTP_BACKOFF_BASE_SECONDS, HTTP_BACKOFF_MAX_SECONDS, HTTP_RETRY_BUDGET_SECONDS,
+    HUBSPOT_RATE_LIMIT_PER_SECOND, HUBSPOT_RATE_LIMIT_BURST
+)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Responses worth retrying: rate limited or a transient server-side failure
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+# Responses a non-idempotent request can safely be retried on: the request was not acted on
+NON_IDEMPOTENT_RETRYABLE_STATUSES = {429}
+
+# Methods that are not retried once the request may have reached the server, unless the caller says otherwise
+NON_IDEMPOTENT_METHODS = {"POST", "PATCH"}
+
+# (connect, read) timeout applied to every outbound request
+DEFAULT_TIMEOUT = (HTTP_CONNECT_TIMEOUT_SECONDS, HTTP_READ_TIMEOUT_SECONDS)
+
+class TokenBucket:
+    """
+    Token-bucket rate limiter: `rate` tokens per second, at most `capacity`
+    banked for bursts. `acquire` blocks until a token is available.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+def parse_retry_after(value):
+    """
+    Parse a Retry-After header (delta-seconds or HTTP-date) into seconds.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def retry_delay(attempt, retry_after=None):
+    """
+    Seconds to wait before retry number `attempt` (0-based).
+    Honors Retry-After when given, otherwise full-jitter exponential backoff.
+    """
+    if retry_after is not None:
+        return min(retry_after, HTTP_BACKOFF_MAX_SECONDS)
+    return random.uniform(0, min(HTTP_BACKOFF_MAX_SECONDS, HTTP_BACKOFF_BASE_SECONDS * (2 ** attempt)))
+
+def is_connect_error(error):
+    """
+    True when the request never reached the server: the connection could
+    not be opened (refused, DNS failure, connect timeout).
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    if not isinstance(error, requests.ConnectionError) or isinstance(error, requests.Timeout):
+        return False
+    reason = getattr(error.args[0], "reason", error.args[0]) if error.args else None
+    return isinstance(reason, ConnectTimeoutError)
+
+def is_retryable_error(error, idempotent=True):
+    """
+    True when a failed call may succeed if made again: a 429, a 5xx, or a
+    connection error or timeout. For a non-idempotent call only failures it
+    cannot have been acted on count: a 429 or a connection that was never
+    opened. Follows the error's __cause__ chain; anything else (other 4xx
+    responses, missing records) is permanent.
+    """
+    while error is not None:
+        status = getattr(error, "status", None)
+        response = getattr(error, "response", None)
+        if status is None and response is not None:
+            status = response.status_code
+        if isinstance(status, int):
+            return status in (RETRYABLE_STATUSES if idempotent else NON_IDEMPOTENT_RETRYABLE_STATUSES)
+        if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+            return idempotent or is_connect_error(error)
+        error = error.__cause__
+    return False
+
+# Session and rate limiter shared by every outbound HubSpot call in the process
+_session = None
+_session_lock = threading.Lock()
+_rate_limiter = TokenBucket(HUBSPOT_RATE_LIMIT_PER_SECOND, HUBSPOT_RATE_LIMIT_BURST)
+
+def get_rate_limiter():
+    """
+    Return the process-wide HubSpot rate limiter.
+    """
+    return _rate_limiter
+
+def get_session():
+    """
+    Return the process-wide keep-alive session with a pooled HTTPS adapter.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+def request_with_retry(method, url, rate_limiter=None, idempotent=None, **kwargs):
+    """
+    Send a rate-limited request on the shared session. `rate_limiter`
+    defaults to the process-wide one (per-portal clients pass their own).
+
+    Idempotent requests are retried on 429 and 5xx responses, connection
+    errors and timeouts. Non-idempotent ones (POST and PATCH unless
+    `idempotent=True`) are only retried when the server cannot have acted on
+    them: a connection that could not be opened, or a 429. Up to
+    HTTP_MAX_RETRIES retries with jittered backoff, honoring Retry-After,
+    and no retry that would take the total wait past HTTP_RETRY_BUDGET_SECONDS.
+    The last response is returned as-is; callers decide how to treat it.
+    """
+    kwargs.setdefault("timeout", DEFAULT_TIMEOUT)
+    if idempotent is None:
+        idempotent = method.upper() not in NON_IDEMPOTENT_METHODS
+    retryable_statuses = RETRYABLE_STATUSES if idempotent else NON_IDEMPOTENT_RETRYABLE_STATUSES
+    session = get_session()
+    rate_limiter = rate_limiter or _rate_limiter
+    attempt = 0
+    waited = 0.0
+    while True:
+        rate_limiter.acquire()
+        metrics.count("api_call")
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            delay = retry_delay(attempt)
+            if attempt >= HTTP_MAX_RETRIES or waited + delay > HTTP_RETRY_BUDGET_SECONDS or not (idempotent or is_connect_error(e)):
+                metrics.count("http_error")
+                raise
+            logger.warning(f"{method} {url} failed ({e}), retrying in {delay:.2f}s")
+        else:
+            if response.status_code not in retryable_statuses or attempt >= HTTP_MAX_RETRIES:
+                if response.status_code >= 400:
+                    metrics.count("http_error")
+                return response
+            if response.status_code == 429:
+                metrics.count("rate_limited")
+            delay = retry_delay(attempt, parse_retry_after(response.headers.get("Retry-After")))
+            if waited + delay > HTTP_RETRY_BUDGET_SECONDS:
+                logger.warning(f"{method} {url} returned {response.status_code}; retry budget exhausted")
+                metrics.count("http_error")
+                return response
+            logger.warning(f"{method} {url} returned {response.status_code}, retrying in {delay:.2f}s")
+        metrics.count("retry")
+        time.sleep(delay)
+        waited += delay
+        attempt += 1
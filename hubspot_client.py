@@ -1,20 +1,176 @@
 import logging
-from hubspot import HubSpot
-import os
+import threading
+import time
+from collections import OrderedDict
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-from config import get_hubspot_access_token
+from config import (
+    get_hubspot_access_token, OWNER_CACHE_TTL_SECONDS, OBJECT_NAME_CACHE_TTL_SECONDS, CACHE_NEGATIVE_TTL_SECONDS,
+    NOTE_ROUTES, SCHEMA_CACHE_TTL_SECONDS, HUBSPOT_SECRET_NAME, HUBSPOT_RATE_LIMIT_PER_SECOND, HUBSPOT_RATE_LIMIT_BURST,
+    PORTAL_CONFIG, PORTAL_CLIENT_POOL_SIZE, PORTAL_CLIENT_IDLE_SECONDS
+)
+from owner_directory import OwnerDirectory
+from owner_index import get_owner_index
+from shared_cache import get_shared_cache
+from routing import RoutingTable
+from http_transport import TokenBucket, get_rate_limiter, request_with_retry
+from hubspot_rest import HubSpotApiError, HubSpotRestClient, Owner
+import metrics
+from metrics import instrumented
+
+# Properties requested for every note (association types come from the routing table)
+NOTE_PROPERTIES = ["hs_created_by_user_id", "hubspot_owner_id", "hs_note_body"]
+
+# HubSpot per-call input limits for the batch endpoints
+OBJECT_BATCH_READ_LIMIT = 100
+ASSOCIATION_BATCH_READ_LIMIT = 1000
+OWNERS_PAGE_LIMIT = 100
+SEARCH_PAGE_LIMIT = 200
+
+def chunked(items, size):
+    """
+    Yield successive slices of `items` of at most `size` elements.
+    """
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+class RecordReadError(Exception):
+    """
+    Why a record in a batch read could not be read. Chained (__cause__) to
+    the failed API call, if there was one; a missing record has none.
+    """
+
+    def __init__(self, reason, cause=None):
+        super().__init__(reason)
+        self.__cause__ = cause
 
 class HubSpotClient:
-    def __init__(self):
-        self.access_token = get_hubspot_access_token()
+    """
+    HubSpot access for one portal.
+
+    Without a `portal_id` this is the default portal: the token from
+    HUBSPOT_ACCESS_TOKEN / HUBSPOT_SECRET_NAME, NOTE_ROUTES, and the
+    process-wide rate limiter, cache and owner index. A portal listed in
+    PORTAL_CONFIG gets its own token, routes and rate limiter, and its own
+    namespace in the cache and owner index.
+    """
+
+    def __init__(self, portal_id=None):
+        settings = PORTAL_CONFIG.get(str(portal_id), {}) if portal_id is not None else {}
+        self.portal_id = str(portal_id) if portal_id is not None else None
+        self.secret_name = settings.get("secret_name", HUBSPOT_SECRET_NAME)
+        self.token_env = settings.get("access_token_env", "HUBSPOT_ACCESS_TOKEN")
+        self.routes = settings.get("routes", NOTE_ROUTES)
+        self._token_lock = threading.Lock()
+        self.access_token = get_hubspot_access_token(secret_name=self.secret_name, env_var=self.token_env)
         if not self.access_token:
-            raise ValueError("HUBSPOT_ACCESS_TOKEN not found.")
-        self.client = HubSpot(access_token=self.access_token)
-        
+            raise ValueError(f"HubSpot access token not found{f' for portal {portal_id}' if portal_id else ''}.")
+        if self.portal_id is None:
+            self.rate_limiter = get_rate_limiter()
+            self.cache = get_shared_cache()
+            self.owner_index = get_owner_index()
+        else:
+            self.rate_limiter = TokenBucket(
+                settings.get("rate_limit_per_second", HUBSPOT_RATE_LIMIT_PER_SECOND),
+                settings.get("rate_limit_burst", HUBSPOT_RATE_LIMIT_BURST)
+            )
+            self.cache = get_shared_cache().for_portal(self.portal_id)
+            self.owner_index = get_owner_index().for_portal(self.portal_id)
+        self.client = HubSpotRestClient(self.access_token, rate_limiter=self.rate_limiter)
+        self.owners = OwnerDirectory(self._fetch_owners_page, self._fetch_owner, OWNER_CACHE_TTL_SECONDS)
+        self._routing = None
+        self._routing_expires_at = 0
+        self._routing_lock = threading.Lock()
+
+    def refresh_access_token(self, failed_token=None):
+        """
+        Re-read the access token and rebuild the REST client if it changed.
+
+        With `failed_token` (the token a request was rejected with), the
+        token is force-refreshed from Secret Manager unless another thread
+        has already replaced it.
+        """
+        with self._token_lock:
+            if failed_token is not None and failed_token != self.access_token:
+                return
+            token = get_hubspot_access_token(
+                force_refresh=failed_token is not None, secret_name=self.secret_name, env_var=self.token_env
+            )
+            if not token:
+                raise ValueError("HubSpot access token not found.")
+            if token != self.access_token:
+                logger.info("HubSpot access token changed, rebuilding client")
+                self.access_token = token
+                self.client = HubSpotRestClient(token, rate_limiter=self.rate_limiter)
+
+    def _call(self, request):
+        """
+        Run `request(rest_client)`, refreshing the token and retrying once on a 401.
+        Rate limiting and 429/5xx retries happen in the shared transport.
+        """
+        token = self.access_token
+        try:
+            return request(self.client)
+        except HubSpotApiError as e:
+            if e.status != 401:
+                raise
+            logger.warning("HubSpot rejected the access token (401), refreshing")
+            self.refresh_access_token(failed_token=token)
+            return request(self.client)
+
+    @property
+    def routing(self):
+        """
+        The note routing table, built once from the portal's routes
+        (NOTE_ROUTES by default) and object schemas. If the schemas cannot be
+        read it is built from the routes alone and rebuilt after
+        CACHE_NEGATIVE_TTL_SECONDS.
+        """
+        with self._routing_lock:
+            if self._routing is None or time.time() >= self._routing_expires_at:
+                try:
+                    # Schemas go through the shared cache so a new instance need not re-read them
+                    schemas = self.cache.get(
+                        "schemas",
+                        lambda: self._call(lambda api: api.get_schemas()).get("results", []),
+                        SCHEMA_CACHE_TTL_SECONDS, CACHE_NEGATIVE_TTL_SECONDS
+                    ) or []
+                    self._routing_expires_at = float("inf")
+                except Exception as e:
+                    logger.error(f"Error reading CRM object schemas, routing from the configured routes alone: {e}")
+                    schemas = []
+                    self._routing_expires_at = time.time() + CACHE_NEGATIVE_TTL_SECONDS
+                self._routing = RoutingTable.build(self.routes, schemas)
+                logger.info(f"Routing notes{f' for portal {self.portal_id}' if self.portal_id else ''} on: {', '.join(f'{r.display_name} ({r.object_type})' for r in self._routing.routes)}")
+            return self._routing
+
+    def _fetch_owners_page(self, after):
+        # Pages go through the shared cache so a new instance need not re-page HubSpot
+        response = self.cache.get(
+            f"owners:page:{after or ''}",
+            lambda: self._call(lambda api: api.get_owners_page(after=after, limit=OWNERS_PAGE_LIMIT)),
+            OWNER_CACHE_TTL_SECONDS, CACHE_NEGATIVE_TTL_SECONDS
+        ) or {}
+        return {
+            "results": [Owner.from_dict(owner) for owner in response.get("results", [])],
+            "paging": response.get("paging")
+        }
+
+    def _fetch_owner(self, owner_id, id_property):
+        def load():
+            try:
+                return self._call(lambda api: api.get_owner(owner_id, id_property=id_property))
+            except HubSpotApiError as e:
+                if e.status == 404:
+                    return None
+                raise
+        owner = self.cache.get(f"owner:{id_property}:{owner_id}", load, OWNER_CACHE_TTL_SECONDS, CACHE_NEGATIVE_TTL_SECONDS)
+        return Owner.from_dict(owner) if owner else None
+
+    @instrumented
     def get_note_details(self, note_id):
         """
         Fetch note details including the author ID and associated objects.
@@ -22,115 +178,348 @@ class HubSpotClient:
         try:
             # Using 'hubspot_owner_id' for the note usually represents the assignee, 
             # but 'hs_created_by_user_id' is the actual author.
-            properties = ["hs_created_by_user_id", "hubspot_owner_id", "hs_note_body"]
-            associations = ["contacts", "companies", "deals", "2-56205176", "2-56205178"] # Production Custom Objects (Episodes, Auths)
-            
             # Using generic object retrieval for Note (object type 'notes' or '0-4')
-            response = self.client.crm.objects.notes.basic_api.get_by_id(
-                note_id=note_id,
-                properties=properties,
-                associations=associations
-            )
+            response = self._call(lambda api: api.get_object("notes", note_id, NOTE_PROPERTIES, self.routing.association_types))
             return response
         except Exception as e:
             logger.error(f"Error fetching note {note_id}: {e}")
             raise e
 
+    @instrumented
+    def get_notes_batch(self, note_ids):
+        """
+        Fetch many notes at once using the batch-read endpoints.
+
+        Properties come from the notes batch read and associations from the
+        v4 associations batch read, both chunked at HubSpot's per-call limit.
+
+        Returns a tuple (notes, errors):
+            notes:  {note_id: {"properties": {...}, "associations": {object_type: [object_id, ...]}}}
+            errors: {note_id: RecordReadError} for notes that failed or came back missing.
+        """
+        note_ids = list(dict.fromkeys(str(note_id) for note_id in note_ids))
+        notes = {}
+        errors = {}
+
+        # 1. Note properties
+        for chunk in chunked(note_ids, OBJECT_BATCH_READ_LIMIT):
+            try:
+                response = self._call(lambda api: api.batch_read_objects("notes", chunk, NOTE_PROPERTIES))
+            except Exception as e:
+                logger.error(f"Error batch fetching {len(chunk)} notes: {e}")
+                for note_id in chunk:
+                    errors[note_id] = RecordReadError(f"Batch read failed: {e}", e)
+                continue
+
+            for result in response.get("results", []):
+                notes[str(result["id"])] = {"properties": result.get("properties") or {}, "associations": {}}
+
+            for note_id in chunk:
+                if note_id not in notes:
+                    errors[note_id] = RecordReadError("Note not found")
+
+        # 2. Associations, one batch call per routed object type
+        found_ids = list(notes.keys())
+        for to_object_type in (self.routing.association_types if found_ids else []):
+            for chunk in chunked(found_ids, ASSOCIATION_BATCH_READ_LIMIT):
+                try:
+                    response = self._call(lambda api: api.batch_read_associations("notes", to_object_type, chunk))
+                except Exception as e:
+                    logger.error(f"Error batch fetching note associations to {to_object_type}: {e}")
+                    for note_id in chunk:
+                        notes.pop(note_id, None)
+                        errors[note_id] = RecordReadError(f"Association read failed: {e}", e)
+                    continue
+
+                for result in response.get("results", []):
+                    note = notes.get(str(result["from"]["id"]))
+                    if note is None:
+                        continue
+                    object_ids = [str(to["toObjectId"]) for to in result.get("to", [])]
+                    if object_ids:
+                        note["associations"][to_object_type] = object_ids
+
+        return notes, errors
+
+    @instrumented
     def get_object_owner(self, object_type, object_id):
         """
         Fetch the 'hubspot_owner_id' for a given object.
         """
         try:
             properties = ["hubspot_owner_id"]
-            response = self.client.crm.objects.basic_api.get_by_id(
-                object_type=object_type,
-                object_id=object_id,
-                properties=properties
-            )
-            return response.properties.get("hubspot_owner_id")
+            response = self._call(lambda api: api.get_object(object_type, object_id, properties))
+            return response.get("properties", {}).get("hubspot_owner_id")
         except Exception as e:
             logger.error(f"Error fetching owner for {object_type}/{object_id}: {e}")
             raise e
 
+    @instrumented
     def get_owner_details(self, owner_id):
         """
         Resolve a HubSpot Owner ID (or User ID) to an Owner object (with name/email).
+        Served from the in-process owner directory.
         """
         if not owner_id:
             return None
-        try:
-            # The owners API often accepts User ID as Owner ID in many contexts
-            response = self.client.crm.owners.owners_api.get_by_id(owner_id=owner_id)
-            return response
-        except Exception as e:
-            logger.error(f"Error fetching owner details {owner_id}: {e}")
-            return None
+        return self.owners.find(owner_id)
 
+    @instrumented
     def get_owner_user_id(self, owner_id):
         """
         Resolve a HubSpot Owner ID to a User ID for comparison.
         """
         if not owner_id:
             return None
-        try:
-            response = self.client.crm.owners.owners_api.get_by_id(owner_id=owner_id)
-            # The owner object typically has 'userId' (integer)
-            return str(response.user_id) if response.user_id else None
-        except Exception as e:
-            logger.error(f"Error fetching owner details {owner_id}: {e}")
-            # If we can't find the owner, we can't compare. Return None?
-            return None
+        owner = self.owners.get_owner(owner_id)
+        # The owner object typically has 'userId' (integer)
+        # If we can't find the owner, we can't compare.
+        return str(owner.user_id) if owner and owner.user_id else None
 
+    @instrumented
     def get_object_name(self, object_type, object_id):
         """
         Fetch the display name of the object.
         """
+        return self.get_object_names([(object_type, object_id)])[(object_type, str(object_id))]
+
+    @instrumented
+    def get_object_names(self, object_refs):
+        """
+        Display names for many objects, served from the shared cache. Misses
+        are batch-read, one call per object type and OBJECT_BATCH_READ_LIMIT IDs.
+
+        Returns {(object_type, object_id): name}; objects that are missing or
+        could not be read are named "Unknown Object".
+        """
+        refs = {f"name:{object_type}:{object_id}": (object_type, str(object_id)) for object_type, object_id in object_refs}
+
+        def load(keys):
+            by_type = {}
+            for key in keys:
+                object_type, object_id = refs[key]
+                by_type.setdefault(object_type, []).append(object_id)
+            names = {}
+            for object_type, ids in by_type.items():
+                route = self.routing.route_for(object_type)
+                for chunk in chunked(ids, OBJECT_BATCH_READ_LIMIT):
+                    response = self._call(lambda api: api.batch_read_objects(object_type, chunk, route.name_properties))
+                    for result in response.get("results", []):
+                        name = route.format_name(result.get("properties"), result["id"])
+                        names[f"name:{object_type}:{result['id']}"] = name
+            return names
+
         try:
-            # Determine properties to fetch based on type
-            # Standard mappings
-            props = ["name"] # Default for custom objects/companies
-            
-            if object_type == "contacts" or object_type == "0-1":
-                props = ["firstname", "lastname", "email"]
-            elif object_type == "deals" or object_type == "0-3":
-                props = ["dealname"]
-            elif object_type == "tickets" or object_type == "0-5":
-                props = ["subject"]
-            
-            response = self.client.crm.objects.basic_api.get_by_id(
-                object_type=object_type,
-                object_id=object_id,
-                properties=props
-            )
-            
-            p = response.properties
-            if object_type == "contacts" or object_type == "0-1":
-                 fn = p.get("firstname") or ""
-                 ln = p.get("lastname") or ""
-                 return f"{fn} {ln}".strip() or p.get("email") or "Unnamed Contact"
-            elif object_type == "deals" or object_type == "0-3":
-                return p.get("dealname") or "Unnamed Deal"
-            elif object_type == "tickets" or object_type == "0-5":
-                return p.get("subject") or "Unnamed Ticket"
-            
-            return p.get("name") or str(object_id)
-            
+            names = self.cache.get_many(refs, load, OBJECT_NAME_CACHE_TTL_SECONDS, CACHE_NEGATIVE_TTL_SECONDS)
         except Exception as e:
-            logger.error(f"Error fetching name for {object_type}/{object_id}: {e}")
-            return "Unknown Object"
+            logger.error(f"Error fetching names for {len(refs)} objects: {e}")
+            names = {}
+        return {ref: names.get(key) or "Unknown Object" for key, ref in refs.items()}
 
+    @instrumented
+    def get_objects_batch(self, object_refs):
+        """
+        Resolve owner and display name for many objects at once.
+
+        `object_refs` is an iterable of (object_type, object_id) pairs. Objects
+        are grouped by type and each group is read with one batch call per
+        OBJECT_BATCH_READ_LIMIT IDs, requesting 'hubspot_owner_id' together
+        with the name properties of the type's route.
+
+        Returns a tuple (objects, errors):
+            objects: {(object_type, object_id): {"owner_id": ..., "name": ...}}
+            errors:  {(object_type, object_id): RecordReadError}
+        """
+        by_type = {}
+        for object_type, object_id in object_refs:
+            by_type.setdefault(object_type, {})[str(object_id)] = None
+
+        objects = {}
+        errors = {}
+        for object_type, ids in by_type.items():
+            route = self.routing.route_for(object_type)
+            properties = ["hubspot_owner_id"] + route.name_properties
+            for chunk in chunked(list(ids), OBJECT_BATCH_READ_LIMIT):
+                try:
+                    response = self._call(lambda api: api.batch_read_objects(object_type, chunk, properties))
+                except Exception as e:
+                    logger.error(f"Error batch fetching {len(chunk)} objects of type {object_type}: {e}")
+                    for object_id in chunk:
+                        errors[(object_type, object_id)] = RecordReadError(f"Batch read failed: {e}", e)
+                    continue
+
+                for result in response.get("results", []):
+                    p = result.get("properties") or {}
+                    objects[(object_type, str(result["id"]))] = {
+                        "owner_id": p.get("hubspot_owner_id"),
+                        "name": route.format_name(p, result["id"])
+                    }
+
+                for object_id in chunk:
+                    if (object_type, object_id) not in objects:
+                        errors[(object_type, object_id)] = RecordReadError("Object not found")
+
+        return objects, errors
+
+    @instrumented
+    def search_notes_created(self, start_ms, end_ms, after=None, limit=SEARCH_PAGE_LIMIT):
+        """
+        One page of the notes created between `start_ms` and `end_ms`
+        (inclusive, epoch milliseconds), oldest first.
+
+        Returns the raw search response: "results" (id and hs_createdate per
+        note), "total" and, when there are more results, paging.next.after.
+        """
+        filters = [{"propertyName": "hs_createdate", "operator": "BETWEEN", "value": str(start_ms), "highValue": str(end_ms)}]
+        return self._call(lambda api: api.search_objects(
+            "notes", [{"filters": filters}],
+            sorts=[{"propertyName": "hs_createdate", "direction": "ASCENDING"}],
+            properties=["hs_createdate"], limit=limit, after=after
+        ))
+
+    @instrumented
+    def get_object_owners(self, object_refs):
+        """
+        Resolve the owner of many objects, from the object-to-owner index
+        where possible.
+
+        Objects missing from the index are read with get_objects_batch and
+        added to it, and their names to the shared cache. Index hits take
+        their name from the cache when it is there; otherwise "name" is None
+        and callers read it (get_object_names) only for records that trigger.
+
+        Returns a tuple (objects, errors) shaped like get_objects_batch.
+        """
+        object_refs = {(object_type, str(object_id)) for object_type, object_id in object_refs}
+        indexed = self.owner_index.lookup(object_refs)
+        metrics.count("owner_index_hit", len(indexed))
+        names = self.cache.peek_many([f"name:{object_type}:{object_id}" for object_type, object_id in indexed])
+        objects = {
+            (object_type, object_id): {"owner_id": owner_id, "name": names.get(f"name:{object_type}:{object_id}")}
+            for (object_type, object_id), owner_id in indexed.items()
+        }
+
+        missing = object_refs - indexed.keys()
+        if not missing:
+            return objects, {}
+        metrics.count("owner_index_miss", len(missing))
+        # Versioned before the read, so a change that lands during it still wins
+        version = int(time.time() * 1000)
+        fetched, errors = self.get_objects_batch(missing)
+        self.owner_index.update([
+            (object_type, object_id, target["owner_id"] or None, version)
+            for (object_type, object_id), target in fetched.items()
+        ])
+        self.cache.set_many(
+            {f"name:{object_type}:{object_id}": target["name"] for (object_type, object_id), target in fetched.items()},
+            OBJECT_NAME_CACHE_TTL_SECONDS
+        )
+        objects.update(fetched)
+        return objects, errors
+
+    @instrumented
     def trigger_workflow_via_webhook(self, webhook_url, payload):
         """
         Triggers a HubSpot workflow via a webhook URL using a POST request.
+        Sent on the shared keep-alive session and rate-limited. The POST is not
+        idempotent, so it is only retried when HubSpot cannot have received it
+        (connection not established, or 429).
         """
-        import requests
         try:
-            logger.info(f"Triggering workflow via webhook: {webhook_url}")
+            verbose = logger.isEnabledFor(logging.INFO)
+            if verbose:
+                logger.info(f"Triggering workflow via webhook: {webhook_url}")
             # Webhook triggers usually require POST
-            response = requests.post(webhook_url, json=payload, headers={'Content-Type': 'application/json'})
+            response = request_with_retry(
+                "POST", webhook_url, rate_limiter=self.rate_limiter, idempotent=False,
+                json=payload, headers={'Content-Type': 'application/json'}
+            )
             response.raise_for_status()
-            logger.info(f"Successfully triggered workflow via webhook for {payload.get('objectId')}")
+            if verbose:
+                logger.info(f"Successfully triggered workflow via webhook for {payload.get('objectId')}")
             return response.json()
         except Exception as e:
              logger.error(f"Error triggering workflow via webhook: {e}")
              raise e
+
+
+# Process-wide client reused across warm invocations
+_shared_client = None
+_shared_client_lock = threading.Lock()
+
+def get_shared_client():
+    """
+    Return the process-wide HubSpotClient, creating it lazily on first use.
+    The access token is re-checked on every call (a cheap cached read) so a
+    token rotated in Secret Manager is picked up once its TTL expires.
+    """
+    global _shared_client
+    with _shared_client_lock:
+        if _shared_client is None:
+            _shared_client = HubSpotClient()
+            return _shared_client
+    _shared_client.refresh_access_token()
+    return _shared_client
+
+def portal_key(portal_id):
+    """
+    The client pool key for an event's portalId: the portal ID if it is
+    listed in PORTAL_CONFIG, otherwise None (the default portal).
+    """
+    if portal_id is not None and str(portal_id) in PORTAL_CONFIG:
+        return str(portal_id)
+    return None
+
+class ClientPool:
+    """
+    Lazily created per-portal clients, at most `max_clients` of them. The
+    least recently used client is dropped when the pool is full, and any
+    client unused for `idle_seconds` is dropped on the next lookup.
+    """
+
+    def __init__(self, max_clients, idle_seconds, factory=HubSpotClient):
+        self.max_clients = max_clients
+        self.idle_seconds = idle_seconds
+        self.factory = factory
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, portal_id):
+        now = time.monotonic()
+        with self._lock:
+            while self._clients:
+                oldest_id, (_, last_used) = next(iter(self._clients.items()))
+                if now - last_used < self.idle_seconds:
+                    break
+                logger.info(f"Dropping HubSpot client for portal {oldest_id} (idle)")
+                del self._clients[oldest_id]
+            entry = self._clients.get(portal_id)
+            if entry is None:
+                client = self.factory(portal_id)
+                while len(self._clients) >= self.max_clients:
+                    evicted_id, _ = self._clients.popitem(last=False)
+                    logger.info(f"Dropping HubSpot client for portal {evicted_id} (pool full)")
+            else:
+                client = entry[0]
+            self._clients[portal_id] = (client, now)
+            self._clients.move_to_end(portal_id)
+        if entry is not None:
+            client.refresh_access_token()
+        return client
+
+# Per-portal clients reused across warm invocations
+_client_pool = None
+_client_pool_lock = threading.Lock()
+
+def get_portal_client(portal_id):
+    """
+    Return the client for a portal pool key (see portal_key): the shared
+    client for None, otherwise the portal's client from the process-wide pool.
+    """
+    global _client_pool
+    if portal_id is None:
+        return get_shared_client()
+    with _client_pool_lock:
+        if _client_pool is None:
+            _client_pool = ClientPool(PORTAL_CLIENT_POOL_SIZE, PORTAL_CLIENT_IDLE_SECONDS)
+    return _client_pool.get(portal_id)
@@ -0,0 +1,121 @@
+import logging
+from config import HUBSPOT_API_BASE_URL
+from http_transport import request_with_retry
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class HubSpotApiError(Exception):
+    """
+    Non-2xx response from the HubSpot API.
+    """
+
+    def __init__(self, status, reason, headers=None, body=None):
+        super().__init__(f"({status}) {reason}: {body}")
+        self.status = status
+        self.reason = reason
+        self.headers = headers or {}
+        self.body = body
+
+class Owner:
+    """
+    Compact HubSpot owner record.
+    """
+    __slots__ = ("id", "user_id", "email", "first_name", "last_name")
+
+    def __init__(self, id=None, user_id=None, email=None, first_name=None, last_name=None):
+        self.id = id
+        self.user_id = user_id
+        self.email = email
+        self.first_name = first_name
+        self.last_name = last_name
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            id=data.get("id"),
+            user_id=data.get("userId"),
+            email=data.get("email"),
+            first_name=data.get("firstName"),
+            last_name=data.get("lastName")
+        )
+
+class HubSpotRestClient:
+    """
+    Minimal HubSpot REST client covering only the CRM endpoints this function
+    calls. Responses are returned as plain dicts.
+
+    Requests go through the shared keep-alive session, rate limiter and
+    retry policy in http_transport. Every call is a read (batch reads and
+    searches are POSTs), so all of them are retried as idempotent.
+    """
+
+    def __init__(self, access_token, base_url=HUBSPOT_API_BASE_URL, rate_limiter=None):
+        self.base_url = base_url.rstrip("/")
+        self.headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
+        self.rate_limiter = rate_limiter
+
+    def _request(self, method, path, params=None, json=None):
+        response = request_with_retry(
+            method, f"{self.base_url}{path}", rate_limiter=self.rate_limiter, idempotent=True,
+            params=params, json=json, headers=self.headers
+        )
+        if response.status_code >= 400:
+            raise HubSpotApiError(response.status_code, response.reason, response.headers, response.text)
+        if not response.content:
+            return {}
+        return response.json()
+
+    def get_object(self, object_type, object_id, properties, associations=None):
+        """
+        GET /crm/v3/objects/{objectType}/{objectId}
+        """
+        params = {"properties": ",".join(properties)}
+        if associations:
+            params["associations"] = ",".join(associations)
+        return self._request("GET", f"/crm/v3/objects/{object_type}/{object_id}", params=params)
+
+    def batch_read_objects(self, object_type, object_ids, properties):
+        """
+        POST /crm/v3/objects/{objectType}/batch/read
+        """
+        body = {"inputs": [{"id": str(object_id)} for object_id in object_ids], "properties": properties}
+        return self._request("POST", f"/crm/v3/objects/{object_type}/batch/read", json=body)
+
+    def batch_read_associations(self, from_object_type, to_object_type, object_ids):
+        """
+        POST /crm/v4/associations/{fromObjectType}/{toObjectType}/batch/read
+        """
+        body = {"inputs": [{"id": str(object_id)} for object_id in object_ids]}
+        return self._request("POST", f"/crm/v4/associations/{from_object_type}/{to_object_type}/batch/read", json=body)
+
+    def search_objects(self, object_type, filter_groups, sorts=None, properties=None, limit=100, after=None):
+        """
+        POST /crm/v3/objects/{objectType}/search
+        """
+        body = {"filterGroups": filter_groups, "sorts": sorts or [], "properties": properties or [], "limit": limit}
+        if after:
+            body["after"] = after
+        return self._request("POST", f"/crm/v3/objects/{object_type}/search", json=body)
+
+    def get_schemas(self):
+        """
+        GET /crm/v3/schemas
+        """
+        return self._request("GET", "/crm/v3/schemas")
+
+    def get_owners_page(self, after=None, limit=100):
+        """
+        GET /crm/v3/owners
+        """
+        params = {"limit": limit}
+        if after:
+            params["after"] = after
+        return self._request("GET", "/crm/v3/owners", params=params)
+
+    def get_owner(self, owner_id, id_property="id"):
+        """
+        GET /crm/v3/owners/{ownerId}
+        """
+        return self._request("GET", f"/crm/v3/owners/{owner_id}", params={"idProperty": id_property})
@@ -0,0 +1,194 @@
+import logging
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import closing
+from redis_client import get_redis_client
+from config import (
+    IDEMPOTENCY_BACKEND, IDEMPOTENCY_DB_PATH, IDEMPOTENCY_REDIS_URL, IDEMPOTENCY_TTL_SECONDS, IDEMPOTENCY_MAX_ENTRIES,
+    CACHE_KEY_PREFIX, PORTAL_CONFIG
+)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def event_keys(event):
+    """
+    Dedup keys for a webhook event: its eventId and the note it refers to.
+    Notes of the portals in PORTAL_CONFIG are keyed by portal too.
+    """
+    keys = []
+    if event.get('eventId') is not None:
+        keys.append(f"event:{event['eventId']}")
+    if event.get('objectId') is not None:
+        portal_id = str(event.get('portalId'))
+        if portal_id in PORTAL_CONFIG:
+            keys.append(f"note:{portal_id}:{event['objectId']}")
+        else:
+            keys.append(f"note:{event['objectId']}")
+    return keys
+
+class IdempotencyBackend(ABC):
+    """
+    Persistent store of processed keys, behind the in-process LRU.
+    """
+
+    @abstractmethod
+    def seen(self, keys, now):
+        """
+        Return the subset of `keys` recorded and not yet expired at `now`.
+        """
+
+    @abstractmethod
+    def mark(self, keys, expires_at):
+        """
+        Record `keys` as processed until `expires_at` (a time.time() timestamp).
+        """
+
+class SQLiteIdempotencyBackend(IdempotencyBackend):
+    """
+    SQLite-backed processed-key store. Only dedupes within one instance
+    unless the file is on storage every instance shares.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS processed (key TEXT PRIMARY KEY, expires_at REAL NOT NULL)")
+
+    def _connect(self):
+        return closing(sqlite3.connect(self.path, timeout=30, isolation_level=None))
+
+    def seen(self, keys, now):
+        if not keys:
+            return set()
+        placeholders = ",".join("?" for _ in keys)
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT key FROM processed WHERE expires_at > ? AND key IN ({placeholders})",
+                [now] + list(keys)
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def mark(self, keys, expires_at):
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT OR REPLACE INTO processed (key, expires_at) VALUES (?, ?)",
+                [(key, expires_at) for key in keys]
+            )
+            # Opportunistically drop expired rows so the table stays bounded
+            conn.execute("DELETE FROM processed WHERE expires_at <= ?", (time.time(),))
+            conn.execute("COMMIT")
+
+class RedisIdempotencyBackend(IdempotencyBackend):
+    """
+    Redis (or Memorystore) processed-key store shared by every instance.
+    Keys expire through Redis TTLs.
+    """
+
+    def __init__(self, url, prefix=CACHE_KEY_PREFIX):
+        self.client = get_redis_client(url)
+        self.prefix = f"{prefix}processed:"
+
+    def seen(self, keys, now):
+        if not keys:
+            return set()
+        pipeline = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipeline.exists(self.prefix + key)
+        return {key for key, exists in zip(keys, pipeline.execute()) if exists}
+
+    def mark(self, keys, expires_at):
+        ttl_ms = max(1, int((expires_at - time.time()) * 1000))
+        pipeline = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipeline.set(self.prefix + key, 1, px=ttl_ms)
+        pipeline.execute()
+
+class IdempotencyStore:
+    """
+    Remembers which events were already handled so HubSpot retries are dropped.
+
+    An in-process LRU of at most `max_entries` keys (each expiring after
+    `ttl_seconds`) sits in front of an optional persistent backend. Without
+    a shared backend, a redelivery handled by another instance is not
+    recognised.
+    """
+
+    def __init__(self, ttl_seconds, max_entries, backend=None):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.backend = backend
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def is_processed(self, event):
+        keys = event_keys(event)
+        if not keys:
+            return False
+        now = time.time()
+        missing = []
+        with self._lock:
+            for key in keys:
+                expires_at = self._entries.get(key)
+                if expires_at is None:
+                    missing.append(key)
+                elif expires_at <= now:
+                    del self._entries[key]
+                    missing.append(key)
+                else:
+                    self._entries.move_to_end(key)
+                    return True
+
+        if self.backend is None:
+            return False
+        try:
+            return bool(self.backend.seen(missing, now))
+        except Exception as e:
+            # Fail open: reprocessing beats dropping a notification
+            logger.error(f"Error reading idempotency backend: {e}")
+            return False
+
+    def mark_processed(self, event):
+        keys = event_keys(event)
+        if not keys:
+            return
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            for key in keys:
+                self._entries[key] = expires_at
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+        if self.backend is not None:
+            try:
+                self.backend.mark(keys, expires_at)
+            except Exception as e:
+                logger.error(f"Error writing idempotency backend: {e}")
+
+# Store shared across warm invocations
+_idempotency_store = None
+_idempotency_store_lock = threading.Lock()
+
+def get_idempotency_store():
+    """
+    Return the process-wide idempotency store for the configured IDEMPOTENCY_BACKEND.
+    """
+    global _idempotency_store
+    with _idempotency_store_lock:
+        if _idempotency_store is None:
+            if IDEMPOTENCY_BACKEND == "redis":
+                backend = RedisIdempotencyBackend(IDEMPOTENCY_REDIS_URL)
+            elif IDEMPOTENCY_BACKEND == "sqlite":
+                backend = SQLiteIdempotencyBackend(IDEMPOTENCY_DB_PATH)
+            elif IDEMPOTENCY_BACKEND == "memory":
+                backend = None
+            else:
+                raise ValueError(f"Unknown IDEMPOTENCY_BACKEND: {IDEMPOTENCY_BACKEND}")
+            _idempotency_store = IdempotencyStore(IDEMPOTENCY_TTL_SECONDS, IDEMPOTENCY_MAX_ENTRIES, backend)
+        return _idempotency_store
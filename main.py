@@ -1,182 +1,693 @@
+import atexit
 import logging
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import functions_framework
 from flask import jsonify
-from hubspot_client import HubSpotClient
-from config import WORKFLOW_WEBHOOK_URL_AUTH # Optional generic import if needed, but we import dynamically now
+from hubspot_client import RecordReadError, get_portal_client, portal_key
+from event_queue import get_event_queue
+from idempotency import get_idempotency_store
+from coalescing import TriggerCoalescer, coalesce_triggers, trigger_key
+from owner_index import owner_change
+from dead_letter import check_dead_letter_config, get_dead_letter_store
+from http_transport import is_retryable_error, retry_delay
+from prefilter import check_signature_config, prefilter_events, verify_signature
+import metrics
+from config import (
+    EVENT_CONCURRENCY, ACK_FAST_MODE, EVENT_QUEUE_BATCH_SIZE,
+    TRIGGER_COALESCING, TRIGGER_COALESCE_WINDOW_SECONDS, LOG_LEVEL, EVENT_MAX_RETRIES,
+    EVENT_RETRY_BUDGET_SECONDS, DEAD_LETTER_REDRIVE_BATCH_SIZE
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
+logging.getLogger().setLevel(LOG_LEVEL)
 logger = logging.getLogger(__name__)
 
+# Fail the cold start, rather than every signed delivery, on a configuration that cannot verify signatures
+check_signature_config()
+# Warn, without failing, when failed events can only be logged
+check_dead_letter_config()
+
+# Worker pool for per-event processing, shared across warm invocations
+_event_executor = None
+_event_executor_lock = threading.Lock()
+
+def get_event_executor():
+    """
+    Return the process-wide event worker pool (at most EVENT_CONCURRENCY events in flight).
+    """
+    global _event_executor
+    with _event_executor_lock:
+        if _event_executor is None:
+            _event_executor = ThreadPoolExecutor(max_workers=EVENT_CONCURRENCY, thread_name_prefix="event-worker")
+        return _event_executor
+
+def decide_event(client, event, notes, note_errors, objects, object_errors):
+    """
+    Run the author/owner decision for a single note event.
+    Returns (trigger, status, detail): the workflow trigger to send (or
+    None), and the event's status and result line when it is not triggered.
+    Raises when the note or its record could not be read, chained to the
+    read's RecordReadError.
+    """
+    # Per-event INFO logging is skipped entirely (no formatting) above INFO
+    verbose = logger.isEnabledFor(logging.INFO)
+    object_id = event.get('objectId')
+    
+    # Note ID is the 'objectId' in the webhook for a note event
+    note_id = object_id
+    
+    if not note_id:
+        logger.warning(f"Skipping event {event.get('eventId')}: No objectId (Note ID) found.")
+        return None, "skipped", "No objectId (Note ID) found"
+
+    if verbose:
+        logger.info(f"Processing Note ID: {note_id}")
+
+    note = notes.get(str(note_id))
+    if note is None:
+        error = note_errors.get(str(note_id)) or RecordReadError("Note not found")
+        logger.error(f"Failed to fetch note {note_id}: {error}")
+        raise RuntimeError(f"Failed to fetch note {note_id}: {error}") from error
+
+    properties = note["properties"]
+    author_user_id = properties.get("hs_created_by_user_id")
+    
+    # Identify Associated Object (highest priority routed type)
+    if verbose and note["associations"]:
+        logger.info(f"Available associations keys: {list(note['associations'].keys())}")
+    route, target_object_id = client.routing.find_target(note["associations"])
+    
+    if not target_object_id:
+        logger.warning(f"Note {note_id} has no associated contact/object. Skipping.")
+        return None, "skipped", f"Note {note_id} has no associated contact/object"
+
+    # 3. Get Object Owner (resolved for the whole delivery up front)
+    target_object_type = route.object_type
+    target = objects.get((target_object_type, target_object_id))
+    if target is None:
+        error = object_errors.get((target_object_type, target_object_id)) or RecordReadError("Object not found")
+        logger.error(f"Error fetching owner for {target_object_type}/{target_object_id}: {error}")
+        raise RuntimeError(f"Failed to fetch {target_object_type}/{target_object_id}: {error}") from error
+    owner_id = target["owner_id"]
+    
+    # 4. Compare & Trigger
+    # Get Owner's User ID for comparison
+    owner_user_id = client.get_owner_user_id(owner_id) if owner_id else None
+
+    if verbose:
+        logger.info(f"Note {note_id}: Author={author_user_id}, Owner={owner_id} (User={owner_user_id})")
+
+    should_trigger = False
+    
+    if owner_user_id is None:
+        # User Rule #6: "no owner assigned should trigger the workflow anyways"
+        should_trigger = True
+        if verbose:
+            logger.info("Triggering: Object has no owner.")
+    elif str(author_user_id) != str(owner_user_id):
+        should_trigger = True
+        if verbose:
+            logger.info(f"Triggering: Mismatch (Author {author_user_id} != Owner {owner_user_id})")
+    elif verbose:
+        logger.info("No Trigger: Author is Owner.")
+
+    if not should_trigger:
+        return None, "not_triggered", f"Note {note_id}: author is the owner of {target_object_type} {target_object_id}"
+
+    # Webhook URL of the object type's route
+    webhook_url = route.webhook_url
+
+    if not webhook_url:
+        logger.warning(f"No Webhook URL configured for object type {target_object_type}.")
+        return None, "skipped", "Skipped trigger: Missing Webhook URL"
+
+    trigger = {
+        "object_type": target_object_type,
+        "object_id": target_object_id,
+        "object_name": target["name"],
+        "object_type_name": route.display_name,
+        "webhook_url": webhook_url,
+        "portal_id": client.portal_id,
+        "note_id": note_id,
+        "author_user_id": author_user_id,
+        "occurred_at": event.get('occurredAt'),
+        "note_ids": [note_id],
+        "events": [event]
+    }
+    return trigger, "triggered", None
+
+def build_trigger_payload(client, trigger):
+    """
+    Resolve the author name and build the workflow payload for a trigger.
+    """
+    target_object_type = trigger["object_type"]
+    target_object_id = trigger["object_id"]
+    author_user_id = trigger["author_user_id"]
+
+    # 5. Get Note Author Name
+    author_name = "Unknown"
+    if author_user_id:
+        author_details = client.get_owner_details(author_user_id)
+        if author_details:
+            # Combine firstName and lastName if available
+            fn = getattr(author_details, "first_name", "") or ""
+            ln = getattr(author_details, "last_name", "") or ""
+            full_name = f"{fn} {ln}".strip()
+            if full_name:
+                author_name = full_name
+            elif getattr(author_details, "email", None):
+                author_name = author_details.email
+    
+    # 6. Get Object Name
+    object_name = trigger["object_name"]
+    
+    # 7. Get Object Type Name (from the routing table)
+    object_type_name = trigger["object_type_name"]
+    
+    # Construct payload for the webhook
+    trigger_payload = {
+        "objectId": target_object_id,
+        "recordId": target_object_id,
+        "objectType": target_object_type,
+        "objectname": object_name,
+        "objecttypename": object_type_name,
+        "noteId": trigger["note_id"],
+        "authorUserId": author_user_id,
+        "authorname": author_name
+    }
+    if TRIGGER_COALESCING:
+        trigger_payload["coalescedNoteIds"] = trigger["note_ids"]
+        trigger_payload["coalescedCount"] = len(trigger["note_ids"])
+    return trigger_payload
+
+def send_trigger(client, trigger):
+    """
+    Build the workflow payload for a trigger and fire the workflow webhook.
+    Returns the result line.
+    """
+    target_object_type = trigger["object_type"]
+    target_object_id = trigger["object_id"]
+    trigger_payload = build_trigger_payload(client, trigger)
+    client.trigger_workflow_via_webhook(trigger["webhook_url"], trigger_payload)
+    result = f"Triggered workflow for {target_object_type} {target_object_id} (Author: {trigger_payload['authorname']})"
+    if len(trigger["note_ids"]) > 1:
+        result += f" coalescing {len(trigger['note_ids'])} notes"
+    return result
+
+def send_coalesced_trigger(trigger):
+    """
+    Send a trigger released by the coalescing window and record its events
+    as processed. The send is retried like a failed event, but only while
+    the workflow cannot have received it (see is_retryable_error); if it
+    still fails, the trigger's events are dead-lettered.
+    """
+    client = get_portal_client(trigger["portal_id"])
+    error = None
+    for attempt in range(EVENT_MAX_RETRIES + 1):
+        if attempt:
+            time.sleep(retry_delay(attempt - 1))
+        try:
+            logger.info(send_trigger(client, trigger))
+            error = None
+            break
+        except Exception as e:
+            error = e
+            if not is_retryable_error(e, idempotent=False):
+                break
+    if error is not None:
+        if not dead_letter_events(trigger["events"], [error] * len(trigger["events"])):
+            for event in trigger["events"]:
+                logger.error(f"Failed event {event.get('eventId')} (Note {event.get('objectId')}), not dead-lettered: {error}")
+        raise error
+    idempotency = get_idempotency_store()
+    for event in trigger["events"]:
+        idempotency.mark_processed(event)
+
+# Cross-delivery coalescing window, created on first use
+_trigger_coalescer = None
+_trigger_coalescer_lock = threading.Lock()
+
+# Time pending triggers get to be sent after SIGTERM (Cloud Run allows 10 seconds before SIGKILL)
+SHUTDOWN_FLUSH_SECONDS = 8
+
+def get_trigger_coalescer():
+    """
+    Return the process-wide trigger coalescer (TRIGGER_COALESCE_WINDOW_SECONDS window).
+    Its pending triggers are sent when the interpreter exits.
+    """
+    global _trigger_coalescer
+    with _trigger_coalescer_lock:
+        if _trigger_coalescer is None:
+            _trigger_coalescer = TriggerCoalescer(TRIGGER_COALESCE_WINDOW_SECONDS, send_coalesced_trigger)
+            atexit.register(_trigger_coalescer.flush_all)
+        return _trigger_coalescer
+
+def flush_triggers_on_sigterm():
+    """
+    Send pending coalesced triggers when the instance is told to shut down,
+    for up to SHUTDOWN_FLUSH_SECONDS, then hand SIGTERM to the previous
+    handler (e.g. the server's graceful shutdown). A trigger whose send
+    fails is dead-lettered by send_coalesced_trigger; one still unsent
+    when the time is up is lost.
+    Only installs from the main thread, and only with a coalescing window.
+    """
+    if not (TRIGGER_COALESCING and TRIGGER_COALESCE_WINDOW_SECONDS > 0):
+        return
+    if threading.current_thread() is not threading.main_thread():
+        return
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def handle_sigterm(signum, frame):
+        coalescer = _trigger_coalescer
+        if coalescer is not None:
+            flusher = threading.Thread(target=coalescer.flush_all, name="trigger-flush", daemon=True)
+            flusher.start()
+            flusher.join(SHUTDOWN_FLUSH_SECONDS)
+            if flusher.is_alive():
+                logger.error(f"Coalesced triggers still unsent after {SHUTDOWN_FLUSH_SECONDS}s of shutdown; they are lost")
+        if callable(previous):
+            previous(signum, frame)
+        elif previous == signal.SIG_DFL:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            os.kill(os.getpid(), signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
+
+# Pending coalesced triggers are already acknowledged to HubSpot: send them before the instance goes away
+flush_triggers_on_sigterm()
+
+def event_outcome(event, status, detail=None, **fields):
+    """
+    Per-event entry of the response.
+    """
+    return dict(eventId=event.get('eventId'), objectId=event.get('objectId'), status=status, detail=detail, **fields)
+
+def failed_outcome(event, error, idempotent=True):
+    """
+    Outcome of an event that failed with `error`. "retryable" tells whether
+    running the event again may succeed (see is_retryable_error); a failed
+    workflow trigger is not idempotent.
+    """
+    return event_outcome(event, "failed", str(error), retryable=is_retryable_error(error, idempotent))
+
+def run_pipeline(client, events, dry_run=False):
+    """
+    One pass of the pipeline over a list of webhook events: owner changes
+    are applied to the owner index, then note events go through a batch
+    note read, owner resolution (owner index, batch object read on a miss),
+    per-event decisions on the worker pool, optional coalescing per record,
+    then the workflow triggers.
+
+    Returns one outcome per event, in event order. A failure only fails the
+    events it concerns (status "failed", see failed_outcome); the others are
+    unaffected.
+    Events already handled are skipped; successfully handled events are
+    recorded so retries of them are skipped too.
+
+    With `dry_run`, everything is read and decided but no workflow is
+    triggered and nothing is recorded as processed: triggering events get
+    the status "would_trigger" and the payload that would have been sent.
+    """
+    outcomes = [None] * len(events)
+
+    # hubspot_owner_id changes only feed the owner index. Applying one twice is
+    # harmless (older versions never overwrite newer ones), so they skip dedup.
+    with metrics.stage("owner_index"):
+        pending = []
+        changes = []
+        for i, event in enumerate(events):
+            change = owner_change(event)
+            if change is None:
+                pending.append(i)
+                continue
+            changes.append(change)
+            object_type, object_id, owner_id, _ = change
+            outcomes[i] = event_outcome(event, "owner_change", f"Owner change for {object_type} {object_id}: {owner_id or 'no owner'}")
+        client.owner_index.update(changes)
+        metrics.count("owner_change", len(changes))
+
+    # Drop HubSpot redeliveries of events that were already handled, before any API call
+    idempotency = get_idempotency_store()
+    with metrics.stage("dedup"):
+        fresh = []
+        for i in pending:
+            event = events[i]
+            if idempotency.is_processed(event):
+                metrics.count("duplicate_skipped")
+                outcomes[i] = event_outcome(event, "duplicate", f"Skipped duplicate event {event.get('eventId')} (Note {event.get('objectId')})")
+            else:
+                fresh.append(i)
+        pending = fresh
+
+    # Batch-fetch every note up front (Author & Associated Object)
+    with metrics.stage("note_read"):
+        note_ids = [events[i].get('objectId') for i in pending if events[i].get('objectId')]
+        notes, note_errors = client.get_notes_batch(note_ids)
+
+    # Resolve the owner of every target object: owner index first, one batch read per object type for the rest
+    with metrics.stage("object_read"):
+        object_refs = set()
+        for note in notes.values():
+            route, target_object_id = client.routing.find_target(note["associations"])
+            if target_object_id:
+                object_refs.add((route.object_type, target_object_id))
+        objects, object_errors = client.get_object_owners(object_refs)
+
+    # Decide concurrently (owner resolution + comparison)
+    executor = get_event_executor()
+    triggers = []
+    with metrics.stage("decide"):
+        futures = [
+            (i, metrics.submit(executor, decide_event, client, events[i], notes, note_errors, objects, object_errors))
+            for i in pending
+        ]
+        for i, future in futures:
+            event = events[i]
+            try:
+                trigger, status, detail = future.result()
+            except Exception as e:
+                outcomes[i] = failed_outcome(event, e)
+                continue
+            if trigger:
+                trigger["event_indexes"] = [i]
+                triggers.append(trigger)
+                continue
+            if not dry_run:
+                idempotency.mark_processed(event)
+            outcomes[i] = event_outcome(event, status, detail)
+    metrics.count("trigger_decision", len(triggers))
+
+    # Owners served by the owner index may come without a name; read names only for records that trigger
+    unnamed = {(trigger["object_type"], trigger["object_id"]) for trigger in triggers if trigger["object_name"] is None}
+    if unnamed:
+        with metrics.stage("name_read"):
+            names = client.get_object_names(unnamed)
+            for trigger in triggers:
+                if trigger["object_name"] is None:
+                    trigger["object_name"] = names[(trigger["object_type"], trigger["object_id"])]
+
+    # Collapse triggers for the same record into one carrying every note ID
+    if TRIGGER_COALESCING:
+        indexes_by_key = {}
+        for trigger in triggers:
+            indexes_by_key.setdefault(trigger_key(trigger), []).extend(trigger["event_indexes"])
+        coalesced = coalesce_triggers(triggers)
+        for trigger in coalesced:
+            trigger["event_indexes"] = indexes_by_key[trigger_key(trigger)]
+            for i in trigger["event_indexes"][1:]:
+                outcomes[i] = event_outcome(events[i], "coalesced", f"Coalesced note {events[i].get('objectId')} into trigger "
+                                                                    f"for {trigger['object_type']} {trigger['object_id']}")
+        triggers = coalesced
+
+    if dry_run:
+        # Build each payload (author name lookup) but send nothing
+        with metrics.stage("trigger"):
+            trigger_futures = [(trigger, metrics.submit(executor, build_trigger_payload, client, trigger)) for trigger in triggers]
+            for trigger, future in trigger_futures:
+                indexes = trigger["event_indexes"]
+                try:
+                    payload = future.result()
+                except Exception as e:
+                    for i in indexes:
+                        outcomes[i] = failed_outcome(events[i], e)
+                    continue
+                outcomes[indexes[0]] = event_outcome(
+                    events[indexes[0]], "would_trigger",
+                    f"Would trigger workflow for {trigger['object_type']} {trigger['object_id']} (Author: {payload['authorname']})",
+                    webhook_url=trigger["webhook_url"], payload=payload
+                )
+    elif TRIGGER_COALESCING and TRIGGER_COALESCE_WINDOW_SECONDS > 0:
+        # Hold triggers for the coalescing window; they are sent (and recorded) when it closes
+        coalescer = get_trigger_coalescer()
+        for trigger in triggers:
+            indexes = trigger.pop("event_indexes")
+            coalescer.add(trigger)
+            outcomes[indexes[0]] = event_outcome(events[indexes[0]], "queued",
+                                                 f"Queued trigger for {trigger['object_type']} {trigger['object_id']} "
+                                                 f"(coalescing window {TRIGGER_COALESCE_WINDOW_SECONDS}s)")
+    else:
+        # Fire workflow triggers concurrently (author name lookup + workflow POST)
+        with metrics.stage("trigger"):
+            trigger_futures = [(trigger, metrics.submit(executor, send_trigger, client, trigger)) for trigger in triggers]
+            for trigger, future in trigger_futures:
+                indexes = trigger["event_indexes"]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # Running these events again would resend a trigger the workflow may have received
+                    for i in indexes:
+                        outcomes[i] = failed_outcome(events[i], e, idempotent=False)
+                    continue
+                for event in trigger["events"]:
+                    idempotency.mark_processed(event)
+                outcomes[indexes[0]] = event_outcome(events[indexes[0]], "triggered", result)
+
+    return outcomes
+
+def process_events(client, events, dead_letter=True, dry_run=False):
+    """
+    Run the pipeline for a list of webhook events with per-event failure
+    isolation. Events that failed transiently (429, 5xx, connection errors;
+    see failed_outcome) are run again, alone, up to EVENT_MAX_RETRIES times
+    with jittered backoff, while the total wait stays within
+    EVENT_RETRY_BUDGET_SECONDS. Events still failing after that, and
+    permanent failures right away, are written to the dead-letter store
+    (unless `dead_letter` is False) and reported as "dead_lettered"; when
+    no store is available they are logged at ERROR and stay "failed".
+    `dry_run` is passed to run_pipeline (and implies no dead-lettering).
+    Returns one outcome per event, in event order.
+    """
+    outcomes = [None] * len(events)
+    pending = list(range(len(events)))
+    failed = []
+    waited = 0.0
+    for attempt in range(EVENT_MAX_RETRIES + 1):
+        if attempt:
+            delay = retry_delay(attempt - 1)
+            if waited + delay > EVENT_RETRY_BUDGET_SECONDS:
+                logger.warning(f"Not retrying {len(pending)} failed events: retry budget exhausted")
+                break
+            logger.warning(f"Retrying {len(pending)} failed events in {delay:.2f}s (retry {attempt} of {EVENT_MAX_RETRIES})")
+            metrics.count("event_retry", len(pending))
+            time.sleep(delay)
+            waited += delay
+        batch = [events[i] for i in pending]
+        try:
+            results = run_pipeline(client, batch, dry_run=dry_run)
+        except Exception as e:
+            # A stage failed outright; every event in this pass failed with it
+            logger.error(f"Pipeline failed for {len(batch)} events: {e}")
+            results = [failed_outcome(event, e) for event in batch]
+        retryable = []
+        for i, outcome in zip(pending, results):
+            outcomes[i] = outcome
+            if outcome["status"] != "failed":
+                continue
+            if outcome["retryable"] and attempt < EVENT_MAX_RETRIES:
+                retryable.append(i)
+            else:
+                failed.append(i)
+        pending = retryable
+        if not pending:
+            break
+    failed.extend(pending)
+
+    if failed and dead_letter and not dry_run:
+        # Never fails the delivery: a redelivery would re-run the events that succeeded
+        stored = dead_letter_events([events[i] for i in failed], [outcomes[i]["detail"] for i in failed])
+        for i in failed:
+            if stored:
+                logger.error(f"Dead-lettered event {events[i].get('eventId')} (Note {events[i].get('objectId')}): {outcomes[i]['detail']}")
+                outcomes[i]["status"] = "dead_lettered"
+            else:
+                logger.error(f"Failed event {events[i].get('eventId')} (Note {events[i].get('objectId')}), not dead-lettered: {outcomes[i]['detail']}")
+    return outcomes
+
+def dead_letter_events(events, errors):
+    """
+    Write failed events to the dead-letter store. Returns False, without
+    raising, when no store is configured (see get_dead_letter_store) or the
+    write failed; the caller then logs the events.
+    """
+    try:
+        store = get_dead_letter_store()
+        if store is None:
+            return False
+        store.add(list(zip(events, errors)))
+    except Exception as e:
+        logger.error(f"Could not dead-letter {len(events)} events: {e}")
+        return False
+    metrics.count("dead_lettered", len(events))
+    return True
+
+def process_by_portal(events, dead_letter=True, dry_run=False):
+    """
+    Run process_events for each portal's events with that portal's client
+    (see portal_key), so portals never share a token, rate limit or cache.
+    Returns one outcome per event, in event order. Raises if a portal's
+    client cannot be created.
+    """
+    groups = {}
+    for i, event in enumerate(events):
+        groups.setdefault(portal_key(event.get('portalId')), []).append(i)
+    outcomes = [None] * len(events)
+    for portal_id, indexes in groups.items():
+        client = get_portal_client(portal_id)
+        results = process_events(client, [events[i] for i in indexes], dead_letter=dead_letter, dry_run=dry_run)
+        for i, outcome in zip(indexes, results):
+            outcomes[i] = outcome
+    return outcomes
+
+def delivery_response(outcomes):
+    """
+    Response body for a processed delivery, with the status of every event.
+    """
+    failed = sum(1 for outcome in outcomes if outcome["status"] in ("failed", "dead_lettered"))
+    return {
+        "status": "partial" if failed else "success",
+        "processed": len(outcomes) - failed,
+        "failed": failed,
+        "details": [outcome["detail"] for outcome in outcomes if outcome["detail"]],
+        "events": outcomes
+    }
+
 @functions_framework.http
 def handle_webhook(request):
     """
     Entry point for the Cloud Function.
-    Handles 'Note Created' webhooks from HubSpot.
+    Handles 'Note Created' webhooks from HubSpot, and 'hubspot_owner_id'
+    propertyChange webhooks that keep the owner index current.
     """
     try:
         # 1. Parse Request
         if request.method != 'POST':
             return "Method Not Allowed", 405
 
+        # Reject forged or replayed requests before parsing the body or calling HubSpot
+        signature_ok, reason, signed_scopes = verify_signature(request)
+        if not signature_ok:
+            logger.warning(f"Rejected webhook request: {reason}")
+            metrics.count("signature_rejected")
+            return f"Unauthorized: {reason}", 401
+
         payload = request.get_json(silent=True)
         if not payload:
             return "Bad Request: No JSON payload", 400
 
-        logger.info(f"Received payload: {len(payload)} events")
+        # Validate, filter and de-duplicate the whole delivery before any API call;
+        # events of a portal whose own secret did not sign the request are dropped
+        events, dropped = prefilter_events(payload, signed_scopes)
+        for reason, count in dropped.items():
+            metrics.count(f"prefilter_{reason}", count)
 
-        # HubSpot webhooks often send a list of events
-        # We process each event.
-        client = HubSpotClient()
-        
-        results = []
-
-        for event in payload:
-            object_id = event.get('objectId')
-            
-            # Note ID is the 'objectId' in the webhook for a note event
-            note_id = object_id
-            
-            if not note_id:
-                logger.warning(f"Skipping event {event.get('eventId')}: No objectId (Note ID) found.")
-                continue
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(f"Received payload: {len(events) + sum(dropped.values())} events, {len(events)} after pre-filtering")
 
-            logger.info(f"Processing Note ID: {note_id}")
+        if ACK_FAST_MODE:
+            # Acknowledge fast: persist the events and let drain_event_queue process them
+            if events:
+                get_event_queue().enqueue(events)
+            logger.info(f"Queued {len(events)} events")
+            return jsonify({"status": "queued", "queued": len(events), "dropped": dropped}), 200
 
-            # 2. Get Note Details (Author & Associated Object)
-            try:
-                note = client.get_note_details(note_id)
-            except Exception as e:
-                logger.error(f"Failed to fetch note {note_id}: {e}")
-                continue
-
-            properties = note.properties or {}
-            author_user_id = properties.get("hs_created_by_user_id")
-            
-            # Identify Associated Object (Contact or Custom)
-            # We look for associations in the note data
-            associations = note.associations or {}
-            
-            # Prioritize standard objects, then custom?
-            target_object_id = None
-            target_object_type = None
-            
-            # Check Contacts
-            if associations:
-                logger.info(f"Available associations keys: {list(associations.keys())}")
-
-            if associations.get("contacts"):
-                 target_object_id = associations["contacts"].results[0].id
-                 target_object_type = "contacts"
-            # Check Treatment Episodes
-            # The key is dynamic e.g. 'p46446185_treatment_episodes'
-            elif associations.get("p46446185_treatment_episodes"):
-                 target_object_id = associations["p46446185_treatment_episodes"].results[0].id
-                 target_object_type = "2-56205176"
-            elif associations.get("2-56205176"):
-                 target_object_id = associations["2-56205176"].results[0].id
-                 target_object_type = "2-56205176"
-            # Check Insurance Authorizations
-            elif associations.get("p46446185_insurance_authorizations"):
-                 target_object_id = associations["p46446185_insurance_authorizations"].results[0].id
-                 target_object_type = "2-56205178"
-            elif associations.get("2-56205178"):
-                 target_object_id = associations["2-56205178"].results[0].id
-                 target_object_type = "2-56205178"
-            
-            if not target_object_id:
-                logger.warning(f"Note {note_id} has no associated contact/object. Skipping.")
-                continue
+        # HubSpot webhooks often send a list of events
+        # We process each event, with the client of its portal.
+        # Clients (and their access tokens) are shared across warm invocations.
+        # Event failures are isolated (retried, then dead-lettered); only an
+        # unexpected error fails the whole delivery
+        outcomes = []
+        if events:
+            with metrics.delivery("webhook", events=len(events)):
+                outcomes = process_by_portal(events)
 
-            # 3. Get Object Owner
-            owner_id = client.get_object_owner(target_object_type, target_object_id)
-            
-            # 4. Compare & Trigger
-            # Get Owner's User ID for comparison
-            owner_user_id = client.get_owner_user_id(owner_id) if owner_id else None
-
-            logger.info(f"Note {note_id}: Author={author_user_id}, Owner={owner_id} (User={owner_user_id})")
-
-            should_trigger = False
-            
-            if owner_user_id is None:
-                # User Rule #6: "no owner assigned should trigger the workflow anyways"
-                should_trigger = True
-                logger.info("Triggering: Object has no owner.")
-            elif str(author_user_id) != str(owner_user_id):
-                should_trigger = True
-                logger.info(f"Triggering: Mismatch (Author {author_user_id} != Owner {owner_user_id})")
-            else:
-                logger.info("No Trigger: Author is Owner.")
-
-            if should_trigger:
-                # Select correct Webhook URL
-                webhook_url = None
-                if target_object_type == "2-56205178": # Insurance Authorization
-                    from config import WORKFLOW_WEBHOOK_URL_AUTH
-                    webhook_url = WORKFLOW_WEBHOOK_URL_AUTH
-                elif target_object_type == "2-56205176": # Treatment Episode
-                    from config import WORKFLOW_WEBHOOK_URL_EPISODE
-                    webhook_url = WORKFLOW_WEBHOOK_URL_EPISODE
-                else:
-                    # Fallback for generic contacts etc if needed, or default to Auth? 
-                    # For now, only these two have specific workflows.
-                    logger.warning(f"No specific workflow URL for type {target_object_type}")
-                    # Optionally use one as default
-                    from config import WORKFLOW_WEBHOOK_URL_AUTH
-                    webhook_url = WORKFLOW_WEBHOOK_URL_AUTH
-
-                if webhook_url:
-                    # 5. Get Note Author Name
-                    author_name = "Unknown"
-                    if author_user_id:
-                        author_details = client.get_owner_details(author_user_id)
-                        if author_details:
-                            # Combine firstName and lastName if available
-                            fn = getattr(author_details, "first_name", "") or ""
-                            ln = getattr(author_details, "last_name", "") or ""
-                            full_name = f"{fn} {ln}".strip()
-                            if full_name:
-                                author_name = full_name
-                            elif getattr(author_details, "email", None):
-                                author_name = author_details.email
-                    
-                    # 6. Get Object Name
-                    object_name = client.get_object_name(target_object_type, target_object_id)
-                    
-                    # 7. Get Object Type Name (Simple mapping logic)
-                    object_type_name = target_object_type
-                    if target_object_type == "contacts" or target_object_type == "0-1":
-                        object_type_name = "Contact"
-                    elif target_object_type == "companies" or target_object_type == "0-2":
-                        object_type_name = "Company"
-                    elif target_object_type == "deals" or target_object_type == "0-3":
-                         object_type_name = "Deal"
-                    elif target_object_type == "2-56205176":
-                         object_type_name = "Treatment Episode"
-                    elif target_object_type == "2-56205178":
-                         object_type_name = "Insurance Authorization"
-                    
-                    # Construct payload for the webhook
-                    trigger_payload = {
-                        "objectId": target_object_id,
-                        "recordId": target_object_id,
-                        "objectType": target_object_type,
-                        "objectname": object_name,
-                        "objecttypename": object_type_name,
-                        "noteId": note_id,
-                        "authorUserId": author_user_id,
-                        "authorname": author_name
-                    }
-                    
-                    client.trigger_workflow_via_webhook(webhook_url, trigger_payload)
-                    results.append(f"Triggered workflow for {target_object_type} {target_object_id} (Author: {author_name})")
-                else:
-                    logger.warning("No Webhook URL configured for this object type.")
-                    results.append("Skipped trigger: Missing Webhook URL")
-
-        return jsonify({"status": "success", "processed": len(results), "details": results}), 200
+        response = delivery_response(outcomes)
+        response["dropped"] = dropped
+        return jsonify(response), 200
 
     except Exception as e:
         logger.error(f"Unhandled error: {e}")
         return f"Internal Server Error: {e}", 500
+
+@functions_framework.http
+def drain_event_queue(request):
+    """
+    Worker entry point for acknowledge-fast mode (e.g. invoked by Cloud Scheduler).
+    Drains the event queue in batches of EVENT_QUEUE_BATCH_SIZE. A batch is
+    acknowledged once every event in it is handled or dead-lettered; a batch
+    that could not be processed at all is left unacknowledged and redelivered
+    once its lease expires.
+    """
+    queue = get_event_queue()
+    processed = 0
+    failed_batches = 0
+    outcomes = []
+
+    while True:
+        batch = queue.dequeue(EVENT_QUEUE_BATCH_SIZE)
+        if not batch:
+            break
+
+        receipts = [receipt for receipt, _ in batch]
+        events = [event for _, event in batch]
+        try:
+            with metrics.delivery("queue_batch", events=len(events)):
+                outcomes.extend(process_by_portal(events))
+        except Exception as e:
+            logger.error(f"Failed to process queued batch of {len(events)} events: {e}")
+            failed_batches += 1
+            # Leave the batch leased; stop so it is not pulled again in this run
+            break
+
+        queue.ack(receipts)
+        processed += len(events)
+
+    response = delivery_response(outcomes)
+    if failed_batches:
+        response["status"] = "partial"
+    response["failed_batches"] = failed_batches
+    return jsonify(response), 200
+
+@functions_framework.http
+def redrive_dead_letters(request):
+    """
+    Replay dead-lettered events in bulk, e.g. once an outage is over.
+    Runs up to `?limit=` (default DEAD_LETTER_REDRIVE_BATCH_SIZE) entries,
+    oldest first, through the pipeline. Entries that succeed are removed;
+    the rest stay in the store with their attempt count bumped. Run one
+    redrive at a time.
+    """
+    store = get_dead_letter_store()
+    if store is None:
+        logger.warning("No shared dead-letter store is configured; nothing to redrive")
+        return jsonify({"status": "success", "redriven": 0, "failed": 0, "events": []}), 200
+    limit = request.args.get("limit", type=int) or DEAD_LETTER_REDRIVE_BATCH_SIZE
+    entries = store.list(limit)
+    if not entries:
+        return jsonify({"status": "success", "redriven": 0, "failed": 0, "events": []}), 200
+
+    with metrics.delivery("redrive", events=len(entries)):
+        outcomes = process_by_portal([entry["event"] for entry in entries], dead_letter=False)
+
+    redriven = []
+    failed = 0
+    for entry, outcome in zip(entries, outcomes):
+        if outcome["status"] == "failed":
+            store.record_failure(entry["id"], outcome["detail"])
+            failed += 1
+        else:
+            redriven.append(entry["id"])
+    store.remove(redriven)
+    logger.info(f"Redrove {len(redriven)} dead-lettered events, {failed} still failing")
+    return jsonify({"status": "partial" if failed else "success", "redriven": len(redriven), "failed": failed, "events": outcomes}), 200
+
+@functions_framework.http
+def handle_metrics(request):
+    """
+    Prometheus-style metrics for this instance (counters and latency histograms).
+    """
+    return metrics.render_prometheus(), 200, {"Content-Type": "text/plain; version=0.0.4"}
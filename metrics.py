@@ -0,0 +1,215 @@
+import contextvars
+import functools
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Per-delivery summaries are always emitted, whatever the root log level
+summary_logger = logging.getLogger("noteifications.metrics")
+summary_logger.setLevel(logging.INFO)
+
+# Latency buckets (seconds) shared by every histogram
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(key, extra=None):
+    items = list(key) + (extra or [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+class Counter:
+    """
+    Monotonic counter with optional labels (Prometheus semantics).
+    """
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+class Histogram:
+    """
+    Cumulative-bucket histogram with optional labels (Prometheus semantics).
+    """
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series["counts"]):
+                    lines.append(f"{self.name}_bucket{_format_labels(key, [('le', bound)])} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', '+Inf')])} {series['count']}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {series['sum']}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {series['count']}")
+        return lines
+
+# Process-wide metrics, exposed by render_prometheus()
+DELIVERIES = Counter("noteifications_deliveries_total", "Webhook deliveries processed.")
+EVENTS = Counter("noteifications_events_total", "Counted occurrences (API calls, cache hits, retries, errors...) by kind.")
+DELIVERY_SECONDS = Histogram("noteifications_delivery_duration_seconds", "End-to-end delivery processing time.")
+STAGE_SECONDS = Histogram("noteifications_stage_duration_seconds", "Time spent per pipeline stage.")
+METHOD_SECONDS = Histogram("noteifications_client_method_duration_seconds", "Time spent per HubSpotClient method.")
+_ALL_METRICS = (DELIVERIES, EVENTS, DELIVERY_SECONDS, STAGE_SECONDS, METHOD_SECONDS)
+
+def render_prometheus():
+    """
+    Render every process-wide metric in the Prometheus text exposition format.
+    """
+    lines = []
+    for metric in _ALL_METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+class DeliveryMetrics:
+    """
+    Timings and counts collected while processing one delivery.
+    """
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.started_at = time.perf_counter()
+        self.stages = {}
+        self.methods = {}
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def add_time(self, bucket, name, seconds):
+        with self._lock:
+            entry = bucket.setdefault(name, {"calls": 0, "seconds": 0.0})
+            entry["calls"] += 1
+            entry["seconds"] += seconds
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + amount
+
+    def summary(self, **fields):
+        def rounded(bucket):
+            return {name: {"calls": v["calls"], "ms": round(v["seconds"] * 1000, 1)} for name, v in bucket.items()}
+        with self._lock:
+            return dict(
+                fields,
+                kind=self.kind,
+                duration_ms=round((time.perf_counter() - self.started_at) * 1000, 1),
+                stages=rounded(self.stages),
+                methods=rounded(self.methods),
+                counts=dict(self.counts)
+            )
+
+_current_delivery = contextvars.ContextVar("noteifications_delivery", default=None)
+
+@contextmanager
+def delivery(kind, **fields):
+    """
+    Collect metrics for one delivery; on exit, emit one structured log record
+    and update the process-wide metrics. Yields the DeliveryMetrics so the
+    caller can add fields (e.g. event counts) to the summary.
+    """
+    metrics = DeliveryMetrics(kind)
+    token = _current_delivery.set(metrics)
+    outcome = "success"
+    try:
+        yield metrics
+    except Exception:
+        outcome = "error"
+        raise
+    finally:
+        _current_delivery.reset(token)
+        summary = metrics.summary(outcome=outcome, **fields)
+        DELIVERIES.inc(kind=kind, outcome=outcome)
+        DELIVERY_SECONDS.observe(summary["duration_ms"] / 1000, kind=kind)
+        summary_logger.info(json.dumps({"message": "delivery_metrics", **summary}, default=str))
+
+def count(name, amount=1):
+    """
+    Count an occurrence (api_call, retry, owner_cache_hit, ...) for the
+    current delivery and the process-wide counters.
+    """
+    EVENTS.inc(amount, kind=name)
+    metrics = _current_delivery.get()
+    if metrics is not None:
+        metrics.count(name, amount)
+
+@contextmanager
+def stage(name):
+    """
+    Time a pipeline stage.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        metrics = _current_delivery.get()
+        if metrics is not None:
+            metrics.add_time(metrics.stages, name, elapsed)
+
+def instrumented(method):
+    """
+    Decorator timing a HubSpotClient method and counting its errors.
+    """
+    name = method.__name__
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        except Exception:
+            count("client_error")
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            METHOD_SECONDS.observe(elapsed, method=name)
+            metrics = _current_delivery.get()
+            if metrics is not None:
+                metrics.add_time(metrics.methods, name, elapsed)
+    return wrapper
+
+def submit(executor, fn, *args):
+    """
+    Submit work to a thread pool, carrying over the current delivery context.
+    """
+    return executor.submit(contextvars.copy_context().run, fn, *args)
@@ -0,0 +1,142 @@
+import logging
+import threading
+import time
+import metrics
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class OwnerDirectory:
+    """
+    In-process directory of HubSpot owners, indexed by owner ID and by user ID.
+
+    The full owners list is paged in once and refreshed in a background thread
+    once it is older than `ttl_seconds`. IDs missing from the directory fall
+    back to a single-owner fetch whose result is inserted into the index.
+
+    `fetch_page(after)` returns one page of the owners list (a dict with
+    "results" and "paging") and `fetch_owner(owner_id, id_property)` returns
+    a single owner record, or None if HubSpot has no such owner.
+    """
+
+    def __init__(self, fetch_page, fetch_owner, ttl_seconds):
+        self.fetch_page = fetch_page
+        self.fetch_owner = fetch_owner
+        self.ttl_seconds = ttl_seconds
+        self._by_id = {}
+        self._by_user_id = {}
+        self._loaded_at = None
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self._initial_load_lock = threading.Lock()
+
+    def _index(self, owner, by_id, by_user_id):
+        if owner.id:
+            by_id[str(owner.id)] = owner
+        if owner.user_id:
+            by_user_id[str(owner.user_id)] = owner
+
+    def load(self):
+        """
+        Page through the owners list and swap in a freshly built index.
+        """
+        by_id = {}
+        by_user_id = {}
+        try:
+            after = None
+            while True:
+                response = self.fetch_page(after)
+                for owner in response.get("results", []):
+                    self._index(owner, by_id, by_user_id)
+                after = (response.get("paging") or {}).get("next", {}).get("after")
+                if not after:
+                    break
+        except Exception as e:
+            logger.error(f"Error loading owner directory: {e}")
+            with self._lock:
+                # Keep serving the previous index and retry after the next TTL
+                self._loaded_at = time.monotonic()
+                self._refreshing = False
+            return
+
+        with self._lock:
+            self._by_id = by_id
+            self._by_user_id = by_user_id
+            self._loaded_at = time.monotonic()
+            self._refreshing = False
+        logger.info(f"Loaded owner directory: {len(by_id)} owners")
+
+    def _ensure_fresh(self):
+        with self._lock:
+            loaded_at = self._loaded_at
+            stale = loaded_at is not None and time.monotonic() - loaded_at >= self.ttl_seconds
+            start_refresh = stale and not self._refreshing
+            if start_refresh:
+                self._refreshing = True
+
+        if loaded_at is None:
+            # First use: block until the directory is populated (once, even under concurrency)
+            with self._initial_load_lock:
+                if self._loaded_at is None:
+                    self.load()
+        elif start_refresh:
+            threading.Thread(target=self.load, name="owner-directory-refresh", daemon=True).start()
+
+    def _fetch(self, owner_id, id_property):
+        try:
+            owner = self.fetch_owner(owner_id, id_property)
+        except Exception as e:
+            logger.error(f"Error fetching owner details {owner_id} ({id_property}): {e}")
+            return None
+        if owner is None:
+            return None
+        with self._lock:
+            self._index(owner, self._by_id, self._by_user_id)
+        return owner
+
+    def get_owner(self, owner_id):
+        """
+        Return the owner with the given owner ID, or None if HubSpot has no such owner.
+        """
+        if not owner_id:
+            return None
+        self._ensure_fresh()
+        owner = self._by_id.get(str(owner_id))
+        if owner is None:
+            metrics.count("owner_cache_miss")
+            owner = self._fetch(owner_id, "id")
+        else:
+            metrics.count("owner_cache_hit")
+        return owner
+
+    def get_owner_by_user_id(self, user_id):
+        """
+        Return the owner linked to the given user ID, or None if HubSpot has no such owner.
+        """
+        if not user_id:
+            return None
+        self._ensure_fresh()
+        owner = self._by_user_id.get(str(user_id))
+        if owner is None:
+            metrics.count("owner_cache_miss")
+            owner = self._fetch(user_id, "userId")
+        else:
+            metrics.count("owner_cache_hit")
+        return owner
+
+    def find(self, owner_or_user_id):
+        """
+        Resolve an ID that may be either an owner ID or a user ID.
+        """
+        if not owner_or_user_id:
+            return None
+        self._ensure_fresh()
+        key = str(owner_or_user_id)
+        owner = self._by_id.get(key) or self._by_user_id.get(key)
+        if owner is None:
+            metrics.count("owner_cache_miss")
+            owner = self._fetch(owner_or_user_id, "id") or self._fetch(owner_or_user_id, "userId")
+        else:
+            metrics.count("owner_cache_hit")
+        return owner
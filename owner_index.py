@@ -0,0 +1,303 @@
+import logging
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import closing
+from redis_client import get_redis_client
+from config import (
+    OWNER_INDEX_BACKEND, OWNER_INDEX_DB_PATH, OWNER_INDEX_REDIS_URL, OWNER_INDEX_TTL_SECONDS, OWNER_INDEX_MAX_ENTRIES,
+    CACHE_KEY_PREFIX, RUNNING_ON_CLOUD
+)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# objectTypeId -> the object type key notes are associated under
+OBJECT_TYPE_IDS = {"0-1": "contacts", "0-2": "companies", "0-3": "deals"}
+
+# Legacy (v1) subscription types that carry no objectTypeId
+LEGACY_PROPERTY_CHANGE_TYPES = {
+    "contact.propertyChange": "contacts",
+    "company.propertyChange": "companies",
+    "deal.propertyChange": "deals"
+}
+
+# Expired rows are purged from the SQLite index at most this often
+PURGE_INTERVAL_SECONDS = 300
+
+def owner_change(event):
+    """
+    Read a `hubspot_owner_id` propertyChange webhook event.
+    Returns (object_type, object_id, owner_id, version), with owner_id None
+    when the owner was cleared, or None for any other event.
+    """
+    if event.get('propertyName') != "hubspot_owner_id":
+        return None
+    subscription_type = event.get('subscriptionType')
+    if subscription_type == "object.propertyChange":
+        object_type = OBJECT_TYPE_IDS.get(event.get('objectTypeId'), event.get('objectTypeId'))
+    else:
+        object_type = LEGACY_PROPERTY_CHANGE_TYPES.get(subscription_type)
+    if not object_type or not event.get('objectId'):
+        return None
+    owner_id = event.get('propertyValue') or None
+    return object_type, str(event['objectId']), owner_id, int(event.get('occurredAt') or 0)
+
+class OwnerIndexBackend(ABC):
+    """
+    Storage for the object-ID-to-owner index.
+
+    Entries are (object_type, object_id, owner_id, version, indexed_at).
+    `version` is the millisecond timestamp of the change (or of the API read)
+    the owner came from; an entry is only replaced by a newer version, so
+    out-of-order webhook deliveries cannot roll an owner back.
+    """
+
+    @abstractmethod
+    def get(self, object_refs, min_indexed_at):
+        """
+        Return {(object_type, object_id): owner_id} for the refs indexed at or
+        after `min_indexed_at`.
+        """
+
+    @abstractmethod
+    def put(self, entries, indexed_at):
+        """
+        Upsert (object_type, object_id, owner_id, version) entries.
+        """
+
+class MemoryOwnerIndexBackend(OwnerIndexBackend):
+    """
+    In-process index (lost on cold start, not shared between instances),
+    bounded to `max_entries` least recently used entries. Expired entries
+    are dropped when looked up.
+    """
+
+    def __init__(self, max_entries=OWNER_INDEX_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, object_refs, min_indexed_at):
+        found = {}
+        with self._lock:
+            for ref in object_refs:
+                entry = self._entries.get(ref)
+                if entry is None:
+                    continue
+                if entry[2] < min_indexed_at:
+                    del self._entries[ref]
+                    continue
+                self._entries.move_to_end(ref)
+                found[ref] = entry[0]
+        return found
+
+    def put(self, entries, indexed_at):
+        with self._lock:
+            for object_type, object_id, owner_id, version in entries:
+                ref = (object_type, object_id)
+                current = self._entries.get(ref)
+                if current is None or version >= current[1]:
+                    self._entries[ref] = (owner_id, version, indexed_at)
+                    self._entries.move_to_end(ref)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+class SQLiteOwnerIndexBackend(OwnerIndexBackend):
+    """
+    SQLite-backed index (local runs, or a shared filesystem). Rows indexed
+    more than `ttl_seconds` ago are purged on write, at most every
+    PURGE_INTERVAL_SECONDS.
+    """
+
+    def __init__(self, path, ttl_seconds=OWNER_INDEX_TTL_SECONDS):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._purged_at = 0.0
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS object_owners ("
+                "object_type TEXT NOT NULL, object_id TEXT NOT NULL, owner_id TEXT, "
+                "version INTEGER NOT NULL, indexed_at REAL NOT NULL, "
+                "PRIMARY KEY (object_type, object_id))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS object_owners_indexed_at ON object_owners (indexed_at)")
+
+    def _connect(self):
+        return closing(sqlite3.connect(self.path, timeout=30, isolation_level=None))
+
+    def get(self, object_refs, min_indexed_at):
+        object_refs = list(object_refs)
+        if not object_refs:
+            return {}
+        placeholders = ",".join("(?, ?)" for _ in object_refs)
+        params = [value for ref in object_refs for value in ref]
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT object_type, object_id, owner_id FROM object_owners "
+                f"WHERE indexed_at >= ? AND (object_type, object_id) IN (VALUES {placeholders})",
+                [min_indexed_at] + params
+            ).fetchall()
+        return {(object_type, object_id): owner_id for object_type, object_id, owner_id in rows}
+
+    def put(self, entries, indexed_at):
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT INTO object_owners (object_type, object_id, owner_id, version, indexed_at) "
+                "VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (object_type, object_id) DO UPDATE SET "
+                "owner_id = excluded.owner_id, version = excluded.version, indexed_at = excluded.indexed_at "
+                "WHERE excluded.version >= object_owners.version",
+                [(object_type, object_id, owner_id, version, indexed_at)
+                 for object_type, object_id, owner_id, version in entries]
+            )
+            if indexed_at - self._purged_at >= PURGE_INTERVAL_SECONDS:
+                conn.execute("DELETE FROM object_owners WHERE indexed_at < ?", (indexed_at - self.ttl_seconds,))
+                self._purged_at = indexed_at
+            conn.execute("COMMIT")
+
+class RedisOwnerIndexBackend(OwnerIndexBackend):
+    """
+    Redis-backed index shared by every instance, so an owner change webhook
+    handled by one instance is seen by all of them. Each entry is one key,
+    "version|indexed_at|owner_id", expiring after `ttl_seconds`; a Lua
+    compare-and-set keeps the newest version.
+    """
+
+    PUT_SCRIPT = (
+        "local current = redis.call('get', KEYS[1]) "
+        "if current and tonumber(string.match(current, '^[^|]+')) > tonumber(ARGV[1]) then return 0 end "
+        "redis.call('set', KEYS[1], ARGV[2], 'PX', ARGV[3]) return 1"
+    )
+
+    def __init__(self, url, ttl_seconds=OWNER_INDEX_TTL_SECONDS, prefix=CACHE_KEY_PREFIX):
+        self.client = get_redis_client(url)
+        self.ttl_seconds = ttl_seconds
+        self.prefix = f"{prefix}owner_index:"
+        self._put = self.client.register_script(self.PUT_SCRIPT)
+
+    def _key(self, ref):
+        object_type, object_id = ref
+        return f"{self.prefix}{object_type}:{object_id}"
+
+    def get(self, object_refs, min_indexed_at):
+        object_refs = list(object_refs)
+        if not object_refs:
+            return {}
+        found = {}
+        for ref, value in zip(object_refs, self.client.mget([self._key(ref) for ref in object_refs])):
+            if value is None:
+                continue
+            _, indexed_at, owner_id = value.decode().split("|", 2)
+            if float(indexed_at) >= min_indexed_at:
+                found[ref] = owner_id or None
+        return found
+
+    def put(self, entries, indexed_at):
+        pipeline = self.client.pipeline(transaction=False)
+        for object_type, object_id, owner_id, version in entries:
+            value = f"{version}|{indexed_at}|{owner_id or ''}"
+            self._put(keys=[self._key((object_type, object_id))], args=[version, value, int(self.ttl_seconds * 1000)], client=pipeline)
+        pipeline.execute()
+
+class OwnerIndex:
+    """
+    Object-ID-to-owner index kept current by `hubspot_owner_id` propertyChange
+    webhooks and by owners read from the API on a miss.
+
+    Entries older than `ttl_seconds` are treated as misses, which bounds how
+    stale an owner can get if a propertyChange delivery is lost, and may be
+    evicted by the backend. Backend errors fail open: the owner is read from
+    the API instead. Without a backend the index is off: every lookup misses.
+
+    With a `namespace` (a portal ID), object types are stored prefixed with
+    it, so several portals can share one backend.
+    """
+
+    def __init__(self, ttl_seconds, backend, namespace=""):
+        self.ttl_seconds = ttl_seconds
+        self.backend = backend
+        self.namespace = namespace
+
+    def _stored_type(self, object_type):
+        return f"{self.namespace}:{object_type}" if self.namespace else object_type
+
+    def for_portal(self, portal_id):
+        """
+        The index of one HubSpot portal, on the same backend.
+        """
+        return OwnerIndex(self.ttl_seconds, self.backend, str(portal_id))
+
+    def lookup(self, object_refs):
+        """
+        Return {(object_type, object_id): owner_id} for the indexed refs;
+        owner_id is None for objects known to have no owner.
+        """
+        if self.backend is None:
+            return {}
+        stored = {(self._stored_type(object_type), object_id): (object_type, object_id) for object_type, object_id in object_refs}
+        try:
+            found = self.backend.get(stored, time.time() - self.ttl_seconds)
+        except Exception as e:
+            logger.error(f"Error reading owner index: {e}")
+            return {}
+        return {stored[ref]: owner_id for ref, owner_id in found.items()}
+
+    def update(self, entries):
+        """
+        Record (object_type, object_id, owner_id, version) entries. Changes
+        older than the TTL are ignored: the newer entry that would have
+        rejected them may already have been evicted.
+        """
+        if self.backend is None:
+            return
+        now = time.time()
+        min_version = int((now - self.ttl_seconds) * 1000)
+        entries = [(self._stored_type(object_type), object_id, owner_id, version)
+                   for object_type, object_id, owner_id, version in entries if version >= min_version]
+        if not entries:
+            return
+        try:
+            self.backend.put(entries, now)
+        except Exception as e:
+            logger.error(f"Error writing owner index: {e}")
+
+# Index shared across warm invocations
+_owner_index = None
+_owner_index_lock = threading.Lock()
+
+def get_owner_index():
+    """
+    Return the process-wide owner index for the configured OWNER_INDEX_BACKEND.
+
+    On Cloud Functions / Cloud Run a "memory" index, or a "sqlite" one under
+    /tmp, is not used: it is local to one instance, which would keep serving
+    an owner another instance has seen change. The index is then off and
+    owners are read from the API.
+    """
+    global _owner_index
+    with _owner_index_lock:
+        if _owner_index is None:
+            if OWNER_INDEX_BACKEND == "none":
+                backend = None
+            elif RUNNING_ON_CLOUD and (OWNER_INDEX_BACKEND == "memory" or
+                                       (OWNER_INDEX_BACKEND == "sqlite" and OWNER_INDEX_DB_PATH.startswith("/tmp/"))):
+                logger.warning(
+                    f"OWNER_INDEX_BACKEND={OWNER_INDEX_BACKEND} is local to this instance; the owner index is off. "
+                    "Set OWNER_INDEX_BACKEND=redis to use it"
+                )
+                backend = None
+            elif OWNER_INDEX_BACKEND == "redis":
+                backend = RedisOwnerIndexBackend(OWNER_INDEX_REDIS_URL, OWNER_INDEX_TTL_SECONDS)
+            elif OWNER_INDEX_BACKEND == "sqlite":
+                backend = SQLiteOwnerIndexBackend(OWNER_INDEX_DB_PATH, OWNER_INDEX_TTL_SECONDS)
+            elif OWNER_INDEX_BACKEND == "memory":
+                backend = MemoryOwnerIndexBackend(OWNER_INDEX_MAX_ENTRIES)
+            else:
+                raise ValueError(f"Unknown OWNER_INDEX_BACKEND: {OWNER_INDEX_BACKEND}")
+            _owner_index = OwnerIndex(OWNER_INDEX_TTL_SECONDS, backend)
+        return _owner_index
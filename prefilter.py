@@ -0,0 +1,180 @@
+import base64
+import hashlib
+import hmac
+import logging
+import time
+from urllib.parse import urlsplit, urlunsplit
+from owner_index import owner_change
+from config import (
+    get_client_secrets, client_secret_sources, SIGNATURE_MAX_AGE_SECONDS, WEBHOOK_PUBLIC_URL,
+    HANDLED_SUBSCRIPTION_TYPES, ALLOWED_PORTAL_IDS, RUNNING_ON_CLOUD
+)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Reasons an event is dropped by prefilter_events, in the order they are checked
+DROP_REASONS = ("invalid", "no_object_id", "subscription_type", "portal", "unsigned_portal", "duplicate")
+
+# Percent-encodings HubSpot decodes in the URI before signing
+SIGNATURE_URI_DECODES = {
+    "%3A": ":", "%2F": "/", "%3F": "?", "%40": "@", "%21": "!", "%24": "$",
+    "%27": "'", "%28": "(", "%29": ")", "%2A": "*", "%2C": ",", "%3B": ";"
+}
+
+def check_signature_config():
+    """
+    Refuse to start on Cloud Functions / Cloud Run when signatures are
+    verified but WEBHOOK_PUBLIC_URL is unset. The function only sees an
+    internal URL there (the function name may even be stripped from the
+    path), so every correctly signed request would be rejected.
+    """
+    if RUNNING_ON_CLOUD and client_secret_sources() and not WEBHOOK_PUBLIC_URL:
+        raise ValueError("WEBHOOK_PUBLIC_URL must be set to the URL HubSpot calls when a client secret is configured")
+
+def forwarded_header(request, name):
+    """
+    First value of an X-Forwarded-* header (proxies append theirs after the client's).
+    """
+    value = request.headers.get(name)
+    return value.split(",")[0].strip() if value else None
+
+def signature_uri(request):
+    """
+    The request URI as HubSpot signed it: WEBHOOK_PUBLIC_URL plus the query
+    string when set, otherwise the request URL with the scheme and host the
+    client used (X-Forwarded-Proto / X-Forwarded-Host, set by Google's front
+    end and most proxies).
+    """
+    if WEBHOOK_PUBLIC_URL:
+        query = request.query_string.decode()
+        uri = WEBHOOK_PUBLIC_URL + (f"?{query}" if query else "")
+    else:
+        parts = urlsplit(request.url)
+        uri = urlunsplit((
+            forwarded_header(request, "X-Forwarded-Proto") or parts.scheme,
+            forwarded_header(request, "X-Forwarded-Host") or parts.netloc,
+            parts.path, parts.query, parts.fragment
+        ))
+    for encoded, decoded in SIGNATURE_URI_DECODES.items():
+        uri = uri.replace(encoded, decoded).replace(encoded.lower(), decoded)
+    return uri
+
+def verify_signature(request, secrets=None, now=None):
+    """
+    Check HubSpot's v3 request signature: base64(HMAC-SHA256(client secret,
+    method + URI + body + timestamp)) in X-HubSpot-Signature-v3, with the
+    millisecond timestamp from X-HubSpot-Request-Timestamp no more than
+    SIGNATURE_MAX_AGE_SECONDS old. The body is not parsed.
+
+    `secrets` is {secret: scopes}, as returned by get_client_secrets.
+    Returns (ok, reason, scopes): the scopes of the secret that signed the
+    request, which prefilter_events checks each event's portal against
+    (see signature_scope). Always ok, with scopes None, when no client
+    secret is configured.
+    """
+    secrets = get_client_secrets() if secrets is None else secrets
+    if not secrets:
+        return True, None, None
+    signature = request.headers.get("X-HubSpot-Signature-v3")
+    timestamp = request.headers.get("X-HubSpot-Request-Timestamp")
+    if not signature or not timestamp:
+        return False, "missing signature headers", None
+    try:
+        age_ms = (now if now is not None else time.time()) * 1000 - int(timestamp)
+    except ValueError:
+        return False, "invalid timestamp", None
+    if abs(age_ms) > SIGNATURE_MAX_AGE_SECONDS * 1000:
+        return False, "stale timestamp", None
+
+    message = (request.method + signature_uri(request)).encode() + request.get_data() + timestamp.encode()
+    for secret, scopes in secrets.items():
+        expected = base64.b64encode(hmac.new(secret.encode(), message, hashlib.sha256).digest()).decode()
+        if hmac.compare_digest(expected, signature):
+            return True, None, set(scopes)
+    return False, "signature mismatch", None
+
+def signature_scope(portal_id, own_secret_portals):
+    """
+    The scope whose secret must sign an event of `portal_id`: the portal ID
+    if it is in `own_secret_portals` (portals PORTAL_CONFIG gives their own
+    client secret), otherwise None (the default secret).
+    """
+    if portal_id is not None and str(portal_id) in own_secret_portals:
+        return str(portal_id)
+    return None
+
+def is_handled(event):
+    """
+    True for the events the pipeline acts on: note creations and
+    hubspot_owner_id changes, of a subscription type in HANDLED_SUBSCRIPTION_TYPES.
+    Events without a subscriptionType (manual calls) are treated as note events.
+    """
+    subscription_type = event.get('subscriptionType')
+    if subscription_type is None:
+        return True
+    if subscription_type not in HANDLED_SUBSCRIPTION_TYPES:
+        return False
+    if subscription_type == "object.creation":
+        return event.get('objectTypeId') in (None, "0-4")
+    return owner_change(event) is not None
+
+def dedup_key(event):
+    """
+    Events with the same key in one delivery are handled once: a note, or an
+    object's owner.
+    """
+    change = owner_change(event)
+    if change is not None:
+        return ("owner", str(event.get('portalId')), change[0], change[1])
+    return ("note", str(event.get('portalId')), str(event['objectId']))
+
+def prefilter_events(payload, signed_scopes=None):
+    """
+    Validate and filter a webhook payload in one pass, before any HubSpot call.
+
+    Drops, in order: entries that are not event objects, events without an
+    objectId, events that are not handled (see is_handled), events from a
+    portal outside ALLOWED_PORTAL_IDS (when set), events of a portal whose
+    secret did not sign the request (when `signed_scopes`, from
+    verify_signature, is given), and repeats within the
+    delivery: a repeated note keeps its first event, a repeated owner change
+    its most recent one (by occurredAt).
+
+    Returns (events, dropped): the kept events in delivery order, and the
+    number dropped per reason (every reason in DROP_REASONS is present).
+    """
+    if not isinstance(payload, list):
+        payload = [payload]
+    dropped = dict.fromkeys(DROP_REASONS, 0)
+    own_secret_portals = {scope for scope, _, _ in client_secret_sources() if scope is not None}
+    kept = {}
+    for event in payload:
+        if not isinstance(event, dict):
+            dropped["invalid"] += 1
+            continue
+        if not event.get('objectId'):
+            dropped["no_object_id"] += 1
+            continue
+        if not is_handled(event):
+            dropped["subscription_type"] += 1
+            continue
+        if ALLOWED_PORTAL_IDS and str(event.get('portalId')) not in ALLOWED_PORTAL_IDS:
+            dropped["portal"] += 1
+            continue
+        if signed_scopes is not None and signature_scope(event.get('portalId'), own_secret_portals) not in signed_scopes:
+            dropped["unsigned_portal"] += 1
+            continue
+        key = dedup_key(event)
+        current = kept.get(key)
+        if current is not None:
+            dropped["duplicate"] += 1
+            if key[0] == "owner" and int(event.get('occurredAt') or 0) > int(current.get('occurredAt') or 0):
+                kept[key] = event
+            continue
+        kept[key] = event
+    if any(dropped.values()):
+        logger.info(f"Pre-filter dropped {sum(dropped.values())} of {len(payload)} events: "
+                    f"{ {reason: n for reason, n in dropped.items() if n} }")
+    return list(kept.values()), dropped
@@ -0,0 +1,26 @@
+import logging
+import threading
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# One client (and connection pool) per Redis URL, shared by every backend in the process
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_redis_client(url):
+    """
+    Return the process-wide Redis client for `url`. The cache, idempotency,
+    dead-letter and owner index backends default to the same URL, so they
+    share one connection pool instead of opening one each.
+
+    redis is imported lazily: only deployments using a redis backend need
+    the client library.
+    """
+    with _clients_lock:
+        client = _clients.get(url)
+        if client is None:
+            import redis
+            client = _clients[url] = redis.Redis.from_url(url)
+        return client
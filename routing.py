@@ -0,0 +1,136 @@
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Standard CRM objects: association key -> (objectTypeId, display name, name properties)
+STANDARD_OBJECTS = {
+    "contacts": ("0-1", "Contact", ["firstname", "lastname", "email"]),
+    "companies": ("0-2", "Company", ["name"]),
+    "deals": ("0-3", "Deal", ["dealname"]),
+    "tickets": ("0-5", "Ticket", ["subject"])
+}
+STANDARD_TYPE_IDS = {type_id: key for key, (type_id, _, _) in STANDARD_OBJECTS.items()}
+
+class Route:
+    """
+    Where notes on one object type go: the object type (the association
+    type notes are read with, and the type used for reads), the keys its
+    associations can appear under, the type's display name, the properties
+    its records are named by, and the workflow webhook URL.
+    """
+    __slots__ = ("object_type", "association_keys", "display_name", "name_properties", "webhook_url", "standard")
+
+    def __init__(self, object_type, display_name, name_properties, webhook_url=None, standard=False, association_keys=()):
+        self.object_type = object_type
+        self.association_keys = tuple(dict.fromkeys((object_type,) + tuple(association_keys)))
+        self.display_name = display_name
+        self.name_properties = name_properties
+        self.webhook_url = webhook_url
+        self.standard = standard
+
+    def format_name(self, properties, object_id):
+        """
+        Display name of a record from its name properties.
+        """
+        p = properties or {}
+        if self.object_type == "contacts":
+            fn = p.get("firstname") or ""
+            ln = p.get("lastname") or ""
+            return f"{fn} {ln}".strip() or p.get("email") or "Unnamed Contact"
+        name = p.get(self.name_properties[0]) if self.name_properties else None
+        if name:
+            return name
+        return f"Unnamed {self.display_name}" if self.standard else str(object_id)
+
+def default_route(object_type, webhook_url=None):
+    """
+    Route for an object type with no schema information: standard objects
+    use their built-in names, custom objects are named by "name".
+    """
+    object_type = STANDARD_TYPE_IDS.get(object_type, object_type)
+    if object_type in STANDARD_OBJECTS:
+        type_id, display_name, name_properties = STANDARD_OBJECTS[object_type]
+        return Route(object_type, display_name, list(name_properties), webhook_url, standard=True, association_keys=(type_id,))
+    return Route(object_type, object_type, ["name"], webhook_url)
+
+def find_schema(schemas, object_ref):
+    """
+    The custom object schema matching an objectTypeId, fully qualified name or name.
+    """
+    for schema in schemas:
+        if object_ref in (schema.get("objectTypeId"), schema.get("fullyQualifiedName"), schema.get("name")):
+            return schema
+    return None
+
+class RoutingTable:
+    """
+    Routes for the object types notes are routed to, in priority order (a
+    note associated with several routed types goes to the first).
+    """
+
+    def __init__(self, routes):
+        self.routes = routes
+        self.by_type = {route.object_type: route for route in routes}
+        # Association key -> (priority, route), for every key a route's associations can appear under
+        self.by_association_key = {}
+        for priority, route in enumerate(routes):
+            for key in route.association_keys:
+                self.by_association_key.setdefault(key, (priority, route))
+        # The association types to request for each note
+        self.association_types = [route.object_type for route in routes]
+
+    @classmethod
+    def build(cls, route_configs, schemas):
+        """
+        Build the table from NOTE_ROUTES entries ({"object", "webhook_url",
+        and optional "display_name" / "name_property"}) and the portal's
+        custom object schemas. Configured values win over the schema; routes
+        that cannot be resolved are dropped with an error.
+        """
+        routes = []
+        for config in route_configs:
+            object_ref = str(config["object"])
+            schema = find_schema(schemas, object_ref)
+            if schema is not None:
+                # Single-object reads return associations under the fully qualified name
+                route = Route(
+                    schema["objectTypeId"],
+                    (schema.get("labels") or {}).get("singular") or schema.get("name") or schema["objectTypeId"],
+                    [schema.get("primaryDisplayProperty") or "name"],
+                    association_keys=[key for key in (schema.get("fullyQualifiedName"), schema.get("name")) if key]
+                )
+            elif object_ref in STANDARD_OBJECTS or object_ref in STANDARD_TYPE_IDS or object_ref.startswith("2-"):
+                route = default_route(object_ref)
+            else:
+                logger.error(f"No object schema matches routed object '{object_ref}'; notes on it will not be routed")
+                continue
+            route.webhook_url = config.get("webhook_url")
+            if config.get("display_name"):
+                route.display_name = config["display_name"]
+            if config.get("name_property"):
+                route.name_properties = [config["name_property"]]
+            routes.append(route)
+        return cls(routes)
+
+    def route_for(self, object_type):
+        """
+        The route for an object type, or a default (unrouted) one.
+        """
+        return self.by_type.get(object_type) or default_route(object_type)
+
+    def find_target(self, associations):
+        """
+        Pick the object a note is about from its associations (keyed by
+        association key): one lookup per associated type, the highest
+        priority routed type wins. Returns (route, object_id), or (None, None).
+        """
+        best = None
+        for key, object_ids in associations.items():
+            routed = self.by_association_key.get(key)
+            if routed is not None and object_ids and (best is None or routed[0] < best[0]):
+                best = (routed[0], routed[1], object_ids[0])
+        if best is None:
+            return None, None
+        return best[1], best[2]
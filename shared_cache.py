@@ -0,0 +1,380 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import closing
+import metrics
+from redis_client import get_redis_client
+from config import (
+    CACHE_BACKEND, CACHE_DB_PATH, CACHE_REDIS_URL, CACHE_MAX_ENTRIES, CACHE_KEY_PREFIX,
+    CACHE_LOAD_LOCK_SECONDS, CACHE_LOAD_WAIT_SECONDS
+)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# How often an instance waiting on another's load re-reads the shared tier
+LOAD_POLL_SECONDS = 0.05
+
+class CacheBackend(ABC):
+    """
+    Shared cache tier used by every instance. Values are JSON strings.
+    """
+
+    @abstractmethod
+    def get_many(self, keys):
+        """
+        Return {key: (value, expires_at)} for the keys present and not expired.
+        `expires_at` is a time.time() timestamp.
+        """
+
+    @abstractmethod
+    def set_many(self, items, ttl_seconds):
+        """
+        Store {key: value} entries, each expiring after `ttl_seconds`.
+        """
+
+    def lock_many(self, keys, ttl_seconds):
+        """
+        Take the load lock of each key, held for at most `ttl_seconds`.
+        Returns {key: token} for the locks acquired. Backends without
+        cross-instance locks grant every lock.
+        """
+        return dict.fromkeys(keys)
+
+    def unlock_many(self, locks):
+        """
+        Release locks returned by lock_many.
+        """
+
+class SQLiteCacheBackend(CacheBackend):
+    """
+    SQLite-backed stand-in for a shared cache (local runs, or a shared filesystem).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)")
+
+    def _connect(self):
+        return closing(sqlite3.connect(self.path, timeout=30, isolation_level=None))
+
+    def get_many(self, keys):
+        if not keys:
+            return {}
+        placeholders = ",".join("?" for _ in keys)
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT key, value, expires_at FROM cache WHERE expires_at > ? AND key IN ({placeholders})",
+                [time.time()] + list(keys)
+            ).fetchall()
+        return {key: (value, expires_at) for key, value, expires_at in rows}
+
+    def set_many(self, items, ttl_seconds):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                [(key, value, now + ttl_seconds) for key, value in items.items()]
+            )
+            # Opportunistically drop expired rows so the table stays bounded
+            conn.execute("DELETE FROM cache WHERE expires_at <= ?", (now,))
+            conn.execute("COMMIT")
+
+class RedisCacheBackend(CacheBackend):
+    """
+    Redis (or any Redis-protocol server, e.g. Memorystore) shared cache.
+    Load locks are `SET NX PX` keys next to the cached ones.
+    """
+
+    # Delete a lock only if it still holds our token (it may have expired and been taken over)
+    UNLOCK_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+    def __init__(self, url):
+        self.client = get_redis_client(url)
+        self._unlock = self.client.register_script(self.UNLOCK_SCRIPT)
+
+    def get_many(self, keys):
+        if not keys:
+            return {}
+        pipeline = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipeline.get(key)
+            pipeline.pttl(key)
+        replies = pipeline.execute()
+        now = time.time()
+        found = {}
+        for i, key in enumerate(keys):
+            value, pttl = replies[2 * i], replies[2 * i + 1]
+            if value is not None and pttl > 0:
+                found[key] = (value.decode() if isinstance(value, bytes) else value, now + pttl / 1000)
+        return found
+
+    def set_many(self, items, ttl_seconds):
+        pipeline = self.client.pipeline(transaction=False)
+        for key, value in items.items():
+            pipeline.set(key, value, px=max(1, int(ttl_seconds * 1000)))
+        pipeline.execute()
+
+    def lock_many(self, keys, ttl_seconds):
+        token = uuid.uuid4().hex
+        pipeline = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipeline.set(f"{key}:lock", token, nx=True, px=max(1, int(ttl_seconds * 1000)))
+        return {key: token for key, acquired in zip(keys, pipeline.execute()) if acquired}
+
+    def unlock_many(self, locks):
+        if not locks:
+            return
+        pipeline = self.client.pipeline(transaction=False)
+        for key, token in locks.items():
+            self._unlock(keys=[f"{key}:lock"], args=[token], client=pipeline)
+        pipeline.execute()
+
+class TwoLevelCache:
+    """
+    Read-through cache: an in-process LRU of at most `max_entries` entries in
+    front of an optional shared backend.
+
+    Every entry carries its own TTL. Loaders report "not found" by leaving a
+    key out of their result (or returning None); that is cached too, under
+    the shorter negative TTL, so repeated lookups of a missing record do not
+    reach HubSpot. Concurrent misses on the same key in this process share
+    one load (single flight). With a backend that has load locks (redis),
+    instances also share one load: the instance holding a key's lock loads
+    it, the others wait up to CACHE_LOAD_WAIT_SECONDS for its result in the
+    shared tier. Backend errors fail open to the loader.
+    """
+
+    def __init__(self, max_entries, backend=None, prefix=""):
+        self.max_entries = max_entries
+        self.backend = backend
+        self.prefix = prefix
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def _get_local(self, key, now):
+        # Caller holds self._lock
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        value, expires_at = entry
+        if expires_at <= now:
+            del self._entries[key]
+            return False, None
+        self._entries.move_to_end(key)
+        return True, value
+
+    def _set_local(self, key, value, expires_at):
+        # Caller holds self._lock
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _get_shared(self, keys):
+        if self.backend is None or not keys:
+            return {}
+        try:
+            found = self.backend.get_many([self.prefix + key for key in keys])
+        except Exception as e:
+            logger.error(f"Error reading shared cache: {e}")
+            return {}
+        values = {}
+        with self._lock:
+            for key in keys:
+                if self.prefix + key in found:
+                    raw, expires_at = found[self.prefix + key]
+                    value = json.loads(raw)
+                    self._set_local(key, value, expires_at)
+                    values[key] = value
+        return values
+
+    def set_many(self, items, ttl_seconds, negative_ttl_seconds=None):
+        """
+        Store {key: value} entries; None values use `negative_ttl_seconds`.
+        """
+        now = time.time()
+        by_ttl = {}
+        with self._lock:
+            for key, value in items.items():
+                ttl = negative_ttl_seconds if value is None and negative_ttl_seconds is not None else ttl_seconds
+                self._set_local(key, value, now + ttl)
+                by_ttl.setdefault(ttl, {})[self.prefix + key] = json.dumps(value)
+        if self.backend is None:
+            return
+        for ttl, entries in by_ttl.items():
+            try:
+                self.backend.set_many(entries, ttl)
+            except Exception as e:
+                logger.error(f"Error writing shared cache: {e}")
+
+    def peek_many(self, keys):
+        """
+        Return {key: value} for the cached keys, without loading the rest.
+        """
+        now = time.time()
+        values = {}
+        missing = []
+        with self._lock:
+            for key in keys:
+                hit, value = self._get_local(key, now)
+                if hit:
+                    values[key] = value
+                else:
+                    missing.append(key)
+        values.update(self._get_shared(missing))
+        return values
+
+    def get_many(self, keys, load_many, ttl_seconds, negative_ttl_seconds):
+        """
+        Return {key: value} for `keys`, calling `load_many(missing_keys)` (which
+        returns {key: value}) once for the keys neither tier holds. Keys that
+        another thread is already loading are waited for instead. A key the
+        loader leaves out maps to None.
+        """
+        keys = list(dict.fromkeys(keys))
+        values = {}
+        missing = []
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                hit, value = self._get_local(key, now)
+                if hit:
+                    values[key] = value
+                else:
+                    missing.append(key)
+        metrics.count("cache_hit", len(values))
+        if not missing:
+            return values
+
+        shared = self._get_shared(missing)
+        metrics.count("cache_shared_hit", len(shared))
+        values.update(shared)
+        missing = [key for key in missing if key not in shared]
+        if not missing:
+            return values
+
+        # Claim the keys nobody is loading yet; wait on the others
+        claimed = {}
+        waiting = {}
+        with self._lock:
+            for key in missing:
+                hit, value = self._get_local(key, time.time())
+                if hit:
+                    values[key] = value
+                elif key in self._inflight:
+                    waiting[key] = self._inflight[key]
+                else:
+                    claimed[key] = self._inflight[key] = Future()
+        metrics.count("cache_miss", len(claimed))
+
+        if claimed:
+            try:
+                loaded = self._load_claimed(list(claimed), load_many, ttl_seconds, negative_ttl_seconds)
+            except Exception as e:
+                with self._lock:
+                    for key, future in claimed.items():
+                        del self._inflight[key]
+                        future.set_exception(e)
+                raise
+            with self._lock:
+                for key, future in claimed.items():
+                    del self._inflight[key]
+                    future.set_result(loaded[key])
+            values.update(loaded)
+
+        for key, future in waiting.items():
+            values[key] = future.result()
+        return values
+
+    def _lock_shared(self, keys):
+        # {key: token} for the keys whose load lock this instance holds
+        if self.backend is None:
+            return dict.fromkeys(keys)
+        try:
+            locks = self.backend.lock_many([self.prefix + key for key in keys], CACHE_LOAD_LOCK_SECONDS)
+        except Exception as e:
+            logger.error(f"Error locking shared cache keys: {e}")
+            return dict.fromkeys(keys)
+        return {key: locks[self.prefix + key] for key in keys if self.prefix + key in locks}
+
+    def _unlock_shared(self, locks):
+        if self.backend is None or not locks:
+            return
+        try:
+            self.backend.unlock_many({self.prefix + key: token for key, token in locks.items()})
+        except Exception as e:
+            logger.error(f"Error unlocking shared cache keys: {e}")
+
+    def _load_claimed(self, keys, load_many, ttl_seconds, negative_ttl_seconds):
+        """
+        Load the keys this thread claimed, and cache them. Keys whose load
+        lock another instance holds are read from the shared tier once it has
+        stored them; any still missing after CACHE_LOAD_WAIT_SECONDS are
+        loaded here anyway.
+        """
+        locks = self._lock_shared(keys)
+        try:
+            values = {}
+            others = [key for key in keys if key not in locks]
+            if others:
+                metrics.count("cache_load_wait", len(others))
+                deadline = time.monotonic() + CACHE_LOAD_WAIT_SECONDS
+                while others and time.monotonic() < deadline:
+                    time.sleep(LOAD_POLL_SECONDS)
+                    values.update(self._get_shared(others))
+                    others = [key for key in others if key not in values]
+            to_load = [key for key in keys if key not in values]
+            if to_load:
+                loaded = load_many(to_load) or {}
+                loaded = {key: loaded.get(key) for key in to_load}
+                self.set_many(loaded, ttl_seconds, negative_ttl_seconds)
+                values.update(loaded)
+            return values
+        finally:
+            self._unlock_shared(locks)
+
+    def get(self, key, load, ttl_seconds, negative_ttl_seconds):
+        """
+        Single-key get_many: `load()` returns the value, or None if not found.
+        """
+        return self.get_many([key], lambda keys: {key: load()}, ttl_seconds, negative_ttl_seconds)[key]
+
+    def for_portal(self, portal_id):
+        """
+        A cache for one HubSpot portal: its own LRU, and its own key prefix
+        on the same shared backend.
+        """
+        return TwoLevelCache(self.max_entries, self.backend, f"{self.prefix}{portal_id}:")
+
+# Cache shared across warm invocations
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+def get_shared_cache():
+    """
+    Return the process-wide two-level cache for the configured CACHE_BACKEND.
+    """
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            if CACHE_BACKEND == "redis":
+                backend = RedisCacheBackend(CACHE_REDIS_URL)
+            elif CACHE_BACKEND == "sqlite":
+                backend = SQLiteCacheBackend(CACHE_DB_PATH)
+            elif CACHE_BACKEND == "memory":
+                backend = None
+            else:
+                raise ValueError(f"Unknown CACHE_BACKEND: {CACHE_BACKEND}")
+            _shared_cache = TwoLevelCache(CACHE_MAX_ENTRIES, backend, CACHE_KEY_PREFIX)
+        return _shared_cache
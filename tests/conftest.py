@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Tests run against the flat modules in the repository root, without GCP credentials
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("HUBSPOT_ACCESS_TOKEN", "test-token")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
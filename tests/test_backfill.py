@@ -0,0 +1,31 @@
+from backfill import SEARCH_RESULT_LIMIT, load_checkpoint, next_position
+
+def note(note_id, created_ms):
+    return {"id": str(note_id), "properties": {"hs_createdate": str(created_ms)}}
+
+def page(notes, after=None):
+    return {"results": notes, "paging": {"next": {"after": str(after)}} if after is not None else None}
+
+def test_follows_the_paging_cursor(tmp_path):
+    checkpoint = load_checkpoint(str(tmp_path / "checkpoint.json"), 1000, 2000, False)
+    position = next_position(checkpoint, page([note(1, 1000), note(2, 1001)], after=100), 100)
+    assert (position["cursor_ms"], position["after"], position["boundary_ids"]) == (1000, "100", [])
+    assert next_position(checkpoint, page([note(3, 1002)]), 100) is None
+
+def test_restart_skips_every_note_at_the_last_instant(tmp_path):
+    checkpoint = load_checkpoint(str(tmp_path / "checkpoint.json"), 1000, 2000, False)
+    # Notes at 1500 span the last two pages before the cap
+    checkpoint.update(next_position(checkpoint, page([note(1, 1400), note(2, 1500), note(3, 1500)], after=SEARCH_RESULT_LIMIT - 100), 100))
+    position = next_position(checkpoint, page([note(4, 1500), note(5, 1500)], after=SEARCH_RESULT_LIMIT), 100)
+    assert (position["cursor_ms"], position["after"], position["boundary_ids"]) == (1500, None, ["2", "3", "4", "5"])
+
+def test_restart_at_the_same_instant_keeps_earlier_boundary_notes(tmp_path):
+    checkpoint = load_checkpoint(str(tmp_path / "checkpoint.json"), 1000, 2000, False)
+    checkpoint.update({"cursor_ms": 1500, "after": None, "boundary_ids": ["1", "2"], "max_ms": 1500, "max_ids": ["1", "2"]})
+    position = next_position(checkpoint, page([note(1, 1500), note(2, 1500), note(3, 1500)], after=SEARCH_RESULT_LIMIT), 100)
+    assert (position["cursor_ms"], position["boundary_ids"]) == (1500, ["1", "2", "3"])
+
+def test_checkpoints_without_max_fields_still_resume():
+    checkpoint = {"cursor_ms": 1500, "after": "9900", "boundary_ids": ["1"]}
+    position = next_position(checkpoint, page([note(2, 1500), note(3, 1600)], after=SEARCH_RESULT_LIMIT), 100)
+    assert (position["cursor_ms"], position["boundary_ids"]) == (1600, ["3"])
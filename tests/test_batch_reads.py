@@ -0,0 +1,109 @@
+import pytest
+import hubspot_client
+from fake_hubspot import AUTH_TYPE, EPISODE_TYPE, SCHEMAS, FakeHubSpot
+from http_transport import TokenBucket
+from hubspot_client import HubSpotClient
+from hubspot_rest import HubSpotApiError, HubSpotRestClient
+from routing import RoutingTable
+
+ROUTES = [
+    {"object": "contacts", "webhook_url": "https://hooks/auth"},
+    {"object": EPISODE_TYPE, "webhook_url": "https://hooks/episode"},
+    {"object": AUTH_TYPE, "webhook_url": "https://hooks/auth"},
+]
+
+OBJECTS_BATCH_READ = "/crm/v3/objects/<object_type>/batch/read"
+ASSOCIATIONS_BATCH_READ = "/crm/v4/associations/<from_type>/<to_type>/batch/read"
+
+@pytest.fixture
+def fake():
+    fake = FakeHubSpot().start()
+    yield fake
+    fake.stop()
+
+@pytest.fixture
+def client(fake, monkeypatch):
+    monkeypatch.setattr(hubspot_client, "OBJECT_BATCH_READ_LIMIT", 2)
+    monkeypatch.setattr(hubspot_client, "ASSOCIATION_BATCH_READ_LIMIT", 2)
+    client = HubSpotClient()
+    client.client = HubSpotRestClient("test-token", base_url=fake.base_url, rate_limiter=TokenBucket(1000, 1000))
+    client._routing = RoutingTable.build(ROUTES, SCHEMAS)
+    client._routing_expires_at = float("inf")
+    return client
+
+def test_notes_are_read_in_chunks_and_missing_notes_fail(fake, client):
+    for note_id in range(1, 6):
+        fake.add_note(note_id, 5001, EPISODE_TYPE, 900 + note_id)
+    notes, errors = client.get_notes_batch([1, 2, 3, 4, 5, 6, 2])
+    assert sorted(notes) == ["1", "2", "3", "4", "5"]
+    assert notes["3"]["properties"]["hs_created_by_user_id"] == "5001"
+    assert notes["3"]["associations"] == {EPISODE_TYPE: ["903"]}
+    assert list(errors) == ["6"]
+    assert str(errors["6"]) == "Note not found" and errors["6"].__cause__ is None
+    # Six notes in chunks of two; five found notes in chunks of two for each of three routed types
+    assert fake.calls[OBJECTS_BATCH_READ] == 3
+    assert fake.calls[ASSOCIATIONS_BATCH_READ] == 9
+
+def test_association_failure_drops_only_its_chunk(fake, client, monkeypatch):
+    for note_id in range(1, 6):
+        fake.add_note(note_id, 5001, EPISODE_TYPE, 900 + note_id)
+    read_associations = client.client.batch_read_associations
+    failure = HubSpotApiError(500, "Internal Server Error")
+
+    def flaky(from_type, to_type, note_ids):
+        if to_type == EPISODE_TYPE and "3" in note_ids:
+            raise failure
+        return read_associations(from_type, to_type, note_ids)
+    monkeypatch.setattr(client.client, "batch_read_associations", flaky)
+
+    notes, errors = client.get_notes_batch([1, 2, 3, 4, 5])
+    assert sorted(notes) == ["1", "2", "5"]
+    assert notes["5"]["associations"] == {EPISODE_TYPE: ["905"]}
+    assert sorted(errors) == ["3", "4"]
+    assert str(errors["3"]).startswith("Association read failed") and errors["3"].__cause__ is failure
+
+def test_failed_note_chunk_keeps_its_cause(fake, client, monkeypatch):
+    for note_id in range(1, 4):
+        fake.add_note(note_id, 5001, EPISODE_TYPE, 900 + note_id)
+    read_objects = client.client.batch_read_objects
+    failure = HubSpotApiError(429, "Too Many Requests")
+
+    def flaky(object_type, object_ids, properties):
+        if "3" in object_ids:
+            raise failure
+        return read_objects(object_type, object_ids, properties)
+    monkeypatch.setattr(client.client, "batch_read_objects", flaky)
+
+    notes, errors = client.get_notes_batch([1, 2, 3])
+    assert sorted(notes) == ["1", "2"]
+    assert list(errors) == ["3"] and errors["3"].__cause__ is failure
+
+def test_objects_are_read_in_chunks_per_type(fake, client):
+    for object_id in range(1, 6):
+        fake.add_object(EPISODE_TYPE, object_id, owner_id=1000 + object_id)
+    fake.add_object(AUTH_TYPE, 7, name="Auth 7")
+    refs = [(EPISODE_TYPE, object_id) for object_id in range(1, 6)] + [(AUTH_TYPE, 7), (AUTH_TYPE, 8)]
+    objects, errors = client.get_objects_batch(refs)
+    assert objects[(EPISODE_TYPE, "3")] == {"owner_id": "1003", "name": "Record 3"}
+    assert objects[(AUTH_TYPE, "7")] == {"owner_id": None, "name": "Auth 7"}
+    assert len(objects) == 6
+    # The chunk with the missing record is a 207 partial result: its other record is still read
+    assert list(errors) == [(AUTH_TYPE, "8")]
+    assert str(errors[(AUTH_TYPE, "8")]) == "Object not found" and errors[(AUTH_TYPE, "8")].__cause__ is None
+    assert fake.calls[OBJECTS_BATCH_READ] == 4
+
+def test_failed_object_chunk_keeps_its_cause(fake, client, monkeypatch):
+    fake.add_object(EPISODE_TYPE, 1)
+    fake.add_object(AUTH_TYPE, 2)
+    read_objects = client.client.batch_read_objects
+    failure = HubSpotApiError(503, "Service Unavailable")
+
+    def flaky(object_type, object_ids, properties):
+        if object_type == AUTH_TYPE:
+            raise failure
+        return read_objects(object_type, object_ids, properties)
+    monkeypatch.setattr(client.client, "batch_read_objects", flaky)
+
+    objects, errors = client.get_objects_batch([(EPISODE_TYPE, 1), (AUTH_TYPE, 2)])
+    assert list(objects) == [(EPISODE_TYPE, "1")]
+    assert str(errors[(AUTH_TYPE, "2")]).startswith("Batch read failed") and errors[(AUTH_TYPE, "2")].__cause__ is failure
@@ -0,0 +1,48 @@
+import pytest
+import hubspot_client
+from hubspot_client import ClientPool, portal_key
+
+class FakeClient:
+    def __init__(self, portal_id):
+        self.portal_id = portal_id
+        self.refreshes = 0
+
+    def refresh_access_token(self):
+        self.refreshes += 1
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(hubspot_client.time, "monotonic", lambda: now[0])
+    return now
+
+def test_clients_are_reused_and_refreshed(clock):
+    pool = ClientPool(2, 60, factory=FakeClient)
+    client = pool.get("1")
+    assert pool.get("1") is client
+    assert client.refreshes == 1
+
+def test_least_recently_used_client_is_evicted_when_full(clock):
+    pool = ClientPool(2, 60, factory=FakeClient)
+    first, second = pool.get("1"), pool.get("2")
+    pool.get("1")
+    pool.get("3")
+    assert list(pool._clients) == ["1", "3"]
+    assert pool.get("1") is first
+    assert pool.get("2") is not second
+
+def test_idle_clients_are_dropped(clock):
+    pool = ClientPool(4, 60, factory=FakeClient)
+    idle = pool.get("1")
+    clock[0] += 30
+    pool.get("2")
+    clock[0] += 31
+    pool.get("2")
+    assert list(pool._clients) == ["2"]
+    assert pool.get("1") is not idle
+
+def test_portal_key(monkeypatch):
+    monkeypatch.setattr(hubspot_client, "PORTAL_CONFIG", {"42": {}})
+    assert portal_key(42) == "42"
+    assert portal_key("7") is None
+    assert portal_key(None) is None
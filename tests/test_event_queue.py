@@ -0,0 +1,20 @@
+import pytest
+import event_queue
+from event_queue import SQLiteEventQueue
+
+def test_sqlite_queue_leases_until_acked(tmp_path):
+    queue = SQLiteEventQueue(str(tmp_path / "queue.db"), lease_seconds=60)
+    queue.enqueue([{"objectId": "1"}, {"objectId": "2"}])
+    batch = queue.dequeue(10)
+    assert [event["objectId"] for _, event in batch] == ["1", "2"]
+    # Leased events are not handed out again until the lease expires
+    assert queue.dequeue(10) == []
+    queue.ack([receipt for receipt, _ in batch])
+
+def test_sqlite_queue_is_refused_on_cloud(monkeypatch):
+    monkeypatch.setattr(event_queue, "RUNNING_ON_CLOUD", True)
+    monkeypatch.setattr(event_queue, "EVENT_QUEUE_BACKEND", "sqlite")
+    monkeypatch.setattr(event_queue, "EVENT_QUEUE_PATH", "/tmp/queue.db")
+    monkeypatch.setattr(event_queue, "_event_queue", None)
+    with pytest.raises(ValueError):
+        event_queue.get_event_queue()
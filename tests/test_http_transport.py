@@ -0,0 +1,94 @@
+import pytest
+import requests
+from urllib3.exceptions import MaxRetryError, NewConnectionError, ProtocolError
+import http_transport
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+class FakeSession:
+    """
+    Returns (or raises) the given outcomes in order and records each call.
+    """
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def request(self, method, url, **kwargs):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+class NoLimit:
+    def acquire(self):
+        pass
+
+def connect_refused():
+    return requests.ConnectionError(MaxRetryError(None, "/", NewConnectionError(None, "Connection refused")))
+
+def connection_dropped():
+    return requests.ConnectionError(ProtocolError("Connection aborted.", ConnectionResetError()))
+
+@pytest.fixture
+def session(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(http_transport.time, "sleep", sleeps.append)
+    monkeypatch.setattr(http_transport, "retry_delay", lambda attempt, retry_after=None: retry_after or 0.1)
+
+    def install(*outcomes):
+        fake = FakeSession(outcomes)
+        fake.sleeps = sleeps
+        monkeypatch.setattr(http_transport, "get_session", lambda: fake)
+        return fake
+    return install
+
+def send(method="GET", **kwargs):
+    return http_transport.request_with_retry(method, "https://example.test/x", rate_limiter=NoLimit(), **kwargs)
+
+def test_idempotent_request_retries_5xx_and_timeouts(session):
+    fake = session(FakeResponse(503), requests.ReadTimeout(), FakeResponse(200))
+    assert send("GET").status_code == 200
+    assert fake.calls == 3
+
+def test_post_is_not_retried_once_it_may_have_been_sent(session):
+    fake = session(FakeResponse(502), FakeResponse(200))
+    assert send("POST").status_code == 502
+    assert fake.calls == 1
+
+    fake = session(requests.ReadTimeout(), FakeResponse(200))
+    with pytest.raises(requests.ReadTimeout):
+        send("POST")
+    assert fake.calls == 1
+
+    fake = session(connection_dropped(), FakeResponse(200))
+    with pytest.raises(requests.ConnectionError):
+        send("POST")
+    assert fake.calls == 1
+
+def test_post_is_retried_on_connect_failure_and_429(session):
+    fake = session(connect_refused(), requests.ConnectTimeout(), FakeResponse(429), FakeResponse(200))
+    assert send("POST").status_code == 200
+    assert fake.calls == 4
+
+def test_read_posts_can_opt_in_to_idempotent_retries(session):
+    fake = session(FakeResponse(500), FakeResponse(200))
+    assert send("POST", idempotent=True).status_code == 200
+    assert fake.calls == 2
+
+def test_retries_stop_at_the_time_budget(session, monkeypatch):
+    monkeypatch.setattr(http_transport, "HTTP_RETRY_BUDGET_SECONDS", 5)
+    fake = session(FakeResponse(429, {"Retry-After": "3"}), FakeResponse(429, {"Retry-After": "3"}), FakeResponse(200))
+    assert send("GET").status_code == 429
+    assert fake.calls == 2
+    assert fake.sleeps == [3.0]
+
+def test_is_connect_error():
+    assert http_transport.is_connect_error(connect_refused())
+    assert http_transport.is_connect_error(requests.ConnectTimeout())
+    assert not http_transport.is_connect_error(connection_dropped())
+    assert not http_transport.is_connect_error(requests.ReadTimeout())
@@ -0,0 +1,55 @@
+import time
+from idempotency import IdempotencyStore, RedisIdempotencyBackend, SQLiteIdempotencyBackend
+
+class FakeRedis:
+    """
+    The EXISTS / SET PX subset of a Redis client, with pipelines.
+    """
+
+    def __init__(self):
+        self.values = {}
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.ops = []
+
+    def exists(self, key):
+        self.ops.append(lambda: int(key in self.client.values and self.client.values[key][1] > time.time()))
+
+    def set(self, key, value, px):
+        self.ops.append(lambda: self.client.values.__setitem__(key, (value, time.time() + px / 1000)))
+
+    def execute(self):
+        return [op() for op in self.ops]
+
+def redis_backend():
+    backend = RedisIdempotencyBackend.__new__(RedisIdempotencyBackend)
+    backend.client = FakeRedis()
+    backend.prefix = "test:processed:"
+    return backend
+
+def test_shared_backend_dedupes_across_instances(tmp_path):
+    for backend in (SQLiteIdempotencyBackend(str(tmp_path / "processed.db")), redis_backend()):
+        first = IdempotencyStore(3600, 100, backend)
+        second = IdempotencyStore(3600, 100, backend)
+        event = {"eventId": 1, "objectId": 10, "portalId": 5}
+        first.mark_processed(event)
+        assert second.is_processed(event)
+        # A different event for the same note is a duplicate too
+        assert second.is_processed({"eventId": 2, "objectId": 10, "portalId": 5})
+        assert not second.is_processed({"eventId": 3, "objectId": 11, "portalId": 5})
+
+def test_memory_store_expires_and_evicts():
+    store = IdempotencyStore(3600, 2)
+    store.mark_processed({"eventId": 1})
+    store.mark_processed({"eventId": 2})
+    store.mark_processed({"eventId": 3})
+    assert not store.is_processed({"eventId": 1})
+    assert store.is_processed({"eventId": 3})
+    expired = IdempotencyStore(-1, 10)
+    expired.mark_processed({"eventId": 1})
+    assert not expired.is_processed({"eventId": 1})
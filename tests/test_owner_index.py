@@ -0,0 +1,107 @@
+import time
+import owner_index
+from owner_index import MemoryOwnerIndexBackend, OwnerIndex, RedisOwnerIndexBackend, SQLiteOwnerIndexBackend
+
+def test_memory_backend_evicts_least_recently_used():
+    backend = MemoryOwnerIndexBackend(max_entries=2)
+    backend.put([("deals", "1", "a", 1), ("deals", "2", "b", 1)], 100.0)
+    assert backend.get([("deals", "1")], 0) == {("deals", "1"): "a"}
+    backend.put([("deals", "3", "c", 1)], 100.0)
+    assert backend.get([("deals", "1"), ("deals", "2"), ("deals", "3")], 0) == {("deals", "1"): "a", ("deals", "3"): "c"}
+
+def test_memory_backend_drops_expired_entries():
+    backend = MemoryOwnerIndexBackend()
+    backend.put([("deals", "1", "a", 1)], 100.0)
+    assert backend.get([("deals", "1")], 200.0) == {}
+    assert len(backend._entries) == 0
+
+def test_sqlite_backend_purges_expired_rows(tmp_path):
+    backend = SQLiteOwnerIndexBackend(str(tmp_path / "owners.db"), ttl_seconds=60)
+    backend.put([("deals", "1", "a", 1)], 1000.0)
+    backend.put([("deals", "2", "b", 1)], 2000.0)
+    with backend._connect() as conn:
+        assert [row[0] for row in conn.execute("SELECT object_id FROM object_owners")] == ["2"]
+
+def test_versions_are_never_rolled_back():
+    index = OwnerIndex(3600, MemoryOwnerIndexBackend())
+    now_ms = int(time.time() * 1000)
+    index.update([("deals", "1", "new", now_ms)])
+    index.update([("deals", "1", "old", now_ms - 1000)])
+    assert index.lookup([("deals", "1")]) == {("deals", "1"): "new"}
+
+def test_changes_older_than_the_ttl_are_ignored():
+    index = OwnerIndex(60, MemoryOwnerIndexBackend())
+    index.update([("deals", "1", "a", int((time.time() - 120) * 1000))])
+    assert index.lookup([("deals", "1")]) == {}
+
+def test_portals_are_namespaced():
+    index = OwnerIndex(3600, MemoryOwnerIndexBackend())
+    now_ms = int(time.time() * 1000)
+    index.for_portal(1).update([("deals", "1", "a", now_ms)])
+    assert index.for_portal(1).lookup([("deals", "1")]) == {("deals", "1"): "a"}
+    assert index.for_portal(2).lookup([("deals", "1")]) == {}
+
+class FakeRedis:
+    """
+    The MGET / scripted SET subset of a Redis client used by the owner index, with pipelines.
+    """
+
+    def __init__(self):
+        self.values = {}
+
+    def register_script(self, script):
+        def put(keys, args, client):
+            client.ops.append(lambda: self._put(keys[0], *args))
+        return put
+
+    def _put(self, key, version, value, px):
+        current = self.values.get(key)
+        if current is not None and int(current.split(b"|")[0]) > version:
+            return 0
+        self.values[key] = value.encode()
+        return 1
+
+    def mget(self, keys):
+        return [self.values.get(key) for key in keys]
+
+    def pipeline(self, transaction=True):
+        return FakePipeline()
+
+class FakePipeline:
+    def __init__(self):
+        self.ops = []
+
+    def execute(self):
+        return [op() for op in self.ops]
+
+def redis_backend(ttl_seconds=3600):
+    backend = RedisOwnerIndexBackend.__new__(RedisOwnerIndexBackend)
+    backend.client = FakeRedis()
+    backend.ttl_seconds = ttl_seconds
+    backend.prefix = "test:owner_index:"
+    backend._put = backend.client.register_script(RedisOwnerIndexBackend.PUT_SCRIPT)
+    return backend
+
+def test_redis_backend_keeps_the_newest_version():
+    index = OwnerIndex(3600, redis_backend())
+    now_ms = int(time.time() * 1000)
+    index.update([("deals", "1", "new", now_ms), ("deals", "2", None, now_ms)])
+    index.update([("deals", "1", "old", now_ms - 1000)])
+    assert index.lookup([("deals", "1"), ("deals", "2"), ("deals", "3")]) == {("deals", "1"): "new", ("deals", "2"): None}
+
+def test_redis_backend_treats_old_entries_as_misses():
+    backend = redis_backend()
+    backend.put([("deals", "1", "a", 1)], 100.0)
+    assert backend.get([("deals", "1")], 50.0) == {("deals", "1"): "a"}
+    assert backend.get([("deals", "1")], 200.0) == {}
+
+def test_index_without_a_backend_always_misses():
+    index = OwnerIndex(3600, None)
+    index.update([("deals", "1", "a", int(time.time() * 1000))])
+    assert index.lookup([("deals", "1")]) == {}
+
+def test_local_index_is_off_on_cloud(monkeypatch):
+    monkeypatch.setattr(owner_index, "RUNNING_ON_CLOUD", True)
+    monkeypatch.setattr(owner_index, "OWNER_INDEX_BACKEND", "memory")
+    monkeypatch.setattr(owner_index, "_owner_index", None)
+    assert owner_index.get_owner_index().backend is None
@@ -0,0 +1,97 @@
+import base64
+import hashlib
+import hmac
+import json
+import pytest
+from flask import Flask
+import prefilter
+from prefilter import prefilter_events, verify_signature
+
+SECRET = "client-secret"
+NOW = 1_700_000_000.0
+app = Flask(__name__)
+
+def sign(method, uri, body, timestamp, secret=SECRET):
+    message = (method + uri).encode() + body + str(timestamp).encode()
+    return base64.b64encode(hmac.new(secret.encode(), message, hashlib.sha256).digest()).decode()
+
+def check(signed_uri, path="/hook?a=1", timestamp=int(NOW * 1000), headers=None, secrets=None, signature=None):
+    body = json.dumps([{"objectId": 1}]).encode()
+    headers = dict(headers or {})
+    headers["X-HubSpot-Request-Timestamp"] = str(timestamp)
+    headers["X-HubSpot-Signature-v3"] = signature or sign("POST", signed_uri, body, timestamp)
+    with app.test_request_context(path, method="POST", data=body, headers=headers, base_url="http://internal:8080"):
+        from flask import request
+        return verify_signature(request, secrets={SECRET: {None}} if secrets is None else secrets, now=NOW)
+
+def test_valid_signature():
+    assert check("http://internal:8080/hook?a=1") == (True, None, {None})
+
+def test_signature_uses_forwarded_scheme_and_host():
+    headers = {"X-Forwarded-Proto": "https", "X-Forwarded-Host": "hooks.example.com, internal"}
+    assert check("https://hooks.example.com/hook?a=1", headers=headers) == (True, None, {None})
+
+def test_signature_uses_public_url(monkeypatch):
+    monkeypatch.setattr(prefilter, "WEBHOOK_PUBLIC_URL", "https://us-central1-p.cloudfunctions.net/notifier")
+    assert check("https://us-central1-p.cloudfunctions.net/notifier?a=1", path="/?a=1") == (True, None, {None})
+
+def test_rejected_signatures():
+    assert check("http://internal:8080/hook?a=1", signature="bogus") == (False, "signature mismatch", None)
+    assert check("http://internal:8080/hook?a=1", timestamp=int((NOW - 400) * 1000)) == (False, "stale timestamp", None)
+    assert check("http://internal:8080/hook?a=1", timestamp="soon") == (False, "invalid timestamp", None)
+
+def test_the_signing_secret_gives_its_scopes():
+    assert check("http://internal:8080/hook?a=1", secrets={"other": {None}, SECRET: {"2", "3"}}) == (True, None, {"2", "3"})
+
+def test_no_secret_disables_verification():
+    assert check("http://internal:8080/hook?a=1", secrets={}, signature="bogus") == (True, None, None)
+
+def test_public_url_required_on_cloud(monkeypatch):
+    monkeypatch.setattr(prefilter, "RUNNING_ON_CLOUD", True)
+    monkeypatch.setattr(prefilter, "client_secret_sources", lambda: [(None, "", "HUBSPOT_CLIENT_SECRET")])
+    monkeypatch.setattr(prefilter, "WEBHOOK_PUBLIC_URL", "")
+    with pytest.raises(ValueError):
+        prefilter.check_signature_config()
+    monkeypatch.setattr(prefilter, "WEBHOOK_PUBLIC_URL", "https://hooks.example.com/hook")
+    prefilter.check_signature_config()
+
+def note_event(event_id, note_id, **fields):
+    return {"eventId": event_id, "objectId": note_id, "portalId": 1, "subscriptionType": "object.creation",
+            "objectTypeId": "0-4", **fields}
+
+def owner_event(event_id, object_id, owner_id, occurred_at):
+    return {"eventId": event_id, "objectId": object_id, "portalId": 1, "subscriptionType": "object.propertyChange",
+            "objectTypeId": "0-3", "propertyName": "hubspot_owner_id", "propertyValue": owner_id, "occurredAt": occurred_at}
+
+def test_prefilter_drops_and_dedups(monkeypatch):
+    monkeypatch.setattr(prefilter, "ALLOWED_PORTAL_IDS", {"1"})
+    payload = [
+        note_event(1, 10),
+        note_event(2, 10),
+        note_event(3, 11, portalId=2),
+        note_event(4, 12, objectTypeId="0-1"),
+        note_event(5, None),
+        "junk",
+        owner_event(6, 50, "100", 1000),
+        owner_event(7, 50, "200", 2000),
+        owner_event(8, 50, "300", 1500),
+        {"eventId": 9, "objectId": 51, "portalId": 1, "subscriptionType": "deal.deletion"},
+    ]
+    events, dropped = prefilter_events(payload)
+    assert [event["eventId"] for event in events] == [1, 7]
+    assert dropped == {"invalid": 1, "no_object_id": 1, "subscription_type": 2, "portal": 1, "unsigned_portal": 0, "duplicate": 3}
+
+def test_prefilter_drops_events_their_portal_secret_did_not_sign(monkeypatch):
+    monkeypatch.setattr(prefilter, "client_secret_sources", lambda: [(None, "", "HUBSPOT_CLIENT_SECRET"), ("2", "", "SANDBOX_SECRET")])
+    payload = [note_event(1, 10), note_event(2, 11, portalId=2), note_event(3, 12, portalId=3)]
+    events, dropped = prefilter_events(payload, signed_scopes={"2"})
+    assert [event["eventId"] for event in events] == [2]
+    assert dropped["unsigned_portal"] == 2
+    events, dropped = prefilter_events(payload, signed_scopes={None})
+    assert [event["eventId"] for event in events] == [1, 3]
+    assert dropped["unsigned_portal"] == 1
+
+def test_prefilter_accepts_a_single_event():
+    events, dropped = prefilter_events({"objectId": 5})
+    assert events == [{"objectId": 5}]
+    assert not any(dropped.values())
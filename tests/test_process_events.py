@@ -0,0 +1,164 @@
+import signal
+import pytest
+import requests
+import dead_letter
+import main
+from dead_letter import DeadLetterStore
+from hubspot_client import RecordReadError
+from hubspot_rest import HubSpotApiError
+
+class MemoryDeadLetterStore(DeadLetterStore):
+    def __init__(self):
+        self.entries = []
+
+    def add(self, failures):
+        self.entries.extend(failures)
+
+    def list(self, limit):
+        return self.entries[:limit]
+
+    def remove(self, entry_ids):
+        pass
+
+    def record_failure(self, entry_id, error):
+        pass
+
+def api_error(status):
+    return HubSpotApiError(status, "error", {}, "")
+
+def http_error(status):
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(f"{status} error", response=response)
+
+class ScriptedPipeline:
+    """
+    Stands in for run_pipeline: `errors` maps objectId to the errors the
+    event fails with on successive passes; once they run out it succeeds.
+    """
+
+    def __init__(self, errors):
+        self.errors = {object_id: list(errs) for object_id, errs in errors.items()}
+        self.passes = []
+
+    def __call__(self, client, events, dry_run=False):
+        self.passes.append([event["objectId"] for event in events])
+        outcomes = []
+        for event in events:
+            errs = self.errors.get(event["objectId"])
+            if errs:
+                error, idempotent = errs.pop(0)
+                outcomes.append(main.failed_outcome(event, error, idempotent))
+            else:
+                outcomes.append(main.event_outcome(event, "triggered", "ok"))
+        return outcomes
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    store = MemoryDeadLetterStore()
+    sleeps = []
+    monkeypatch.setattr(main, "get_dead_letter_store", lambda: store)
+    monkeypatch.setattr(main.time, "sleep", sleeps.append)
+    monkeypatch.setattr(main, "retry_delay", lambda attempt, retry_after=None: 0.1)
+    monkeypatch.setattr(main, "EVENT_MAX_RETRIES", 2)
+    monkeypatch.setattr(main, "EVENT_RETRY_BUDGET_SECONDS", 10)
+
+    def install(errors):
+        scripted = ScriptedPipeline(errors)
+        scripted.store = store
+        scripted.sleeps = sleeps
+        monkeypatch.setattr(main, "run_pipeline", scripted)
+        return scripted
+    return install
+
+def events(*object_ids):
+    return [{"eventId": i, "objectId": object_id} for i, object_id in enumerate(object_ids)]
+
+def statuses(outcomes):
+    return [outcome["status"] for outcome in outcomes]
+
+def test_transient_failures_are_retried_alone(pipeline):
+    scripted = pipeline({"2": [(api_error(503), True), (requests.ConnectionError(), True)]})
+    outcomes = main.process_events(None, events("1", "2", "3"))
+    assert statuses(outcomes) == ["triggered"] * 3
+    assert scripted.passes == [["1", "2", "3"], ["2"], ["2"]]
+    assert len(scripted.sleeps) == 2
+    assert scripted.store.entries == []
+
+def test_permanent_failures_are_dead_lettered_without_retry(pipeline):
+    scripted = pipeline({"1": [(RuntimeError("Failed to fetch note 1: Note not found"), True)], "2": [(http_error(400), False)]})
+    outcomes = main.process_events(None, events("1", "2", "3"))
+    assert statuses(outcomes) == ["dead_lettered", "dead_lettered", "triggered"]
+    assert scripted.passes == [["1", "2", "3"]]
+    assert scripted.sleeps == []
+    assert [event["objectId"] for event, _ in scripted.store.entries] == ["1", "2"]
+
+def test_ambiguous_trigger_failures_are_not_resent(pipeline):
+    scripted = pipeline({"1": [(http_error(502), False)], "2": [(requests.ReadTimeout(), False)], "3": [(http_error(429), False)]})
+    outcomes = main.process_events(None, events("1", "2", "3"))
+    assert statuses(outcomes) == ["dead_lettered", "dead_lettered", "triggered"]
+    assert scripted.passes == [["1", "2", "3"], ["3"]]
+
+def test_events_still_failing_after_retries_are_dead_lettered(pipeline):
+    scripted = pipeline({"1": [(api_error(500), True)] * 3})
+    outcomes = main.process_events(None, events("1", "2"))
+    assert statuses(outcomes) == ["dead_lettered", "triggered"]
+    assert scripted.passes == [["1", "2"], ["1"], ["1"]]
+    assert len(scripted.store.entries) == 1
+
+def test_retries_stop_at_the_time_budget(pipeline, monkeypatch):
+    monkeypatch.setattr(main, "EVENT_RETRY_BUDGET_SECONDS", 0.15)
+    scripted = pipeline({"1": [(api_error(500), True)] * 3})
+    outcomes = main.process_events(None, events("1"))
+    assert statuses(outcomes) == ["dead_lettered"]
+    assert scripted.passes == [["1"], ["1"]]
+
+def test_no_dead_lettering_in_dry_run_or_when_disabled(pipeline):
+    scripted = pipeline({"1": [(api_error(404), True)] * 2})
+    assert statuses(main.process_events(None, events("1"), dry_run=True)) == ["failed"]
+    assert statuses(main.process_events(None, events("1"), dead_letter=False)) == ["failed"]
+    assert scripted.store.entries == []
+
+def test_read_errors_keep_their_cause():
+    error = RuntimeError("Failed to fetch note 1")
+    error.__cause__ = RecordReadError("Batch read failed", api_error(429))
+    assert main.failed_outcome({}, error)["retryable"]
+    assert not main.failed_outcome({}, RecordReadError("Note not found"))["retryable"]
+
+def test_local_dead_letter_store_is_disabled_on_cloud(monkeypatch):
+    monkeypatch.setattr(dead_letter, "RUNNING_ON_CLOUD", True)
+    monkeypatch.setattr(dead_letter, "DEAD_LETTER_BACKEND", "sqlite")
+    monkeypatch.setattr(dead_letter, "DEAD_LETTER_PATH", "/tmp/dead_letters.db")
+    monkeypatch.setattr(dead_letter, "_dead_letter_store", None)
+    assert dead_letter.get_dead_letter_store() is None
+
+def test_failures_without_a_store_are_reported_not_raised(pipeline, monkeypatch):
+    monkeypatch.setattr(main, "get_dead_letter_store", lambda: None)
+    pipeline({"1": [(RuntimeError("Failed to fetch note 1: Note not found"), True)]})
+    outcomes = main.process_events(None, events("1", "2"))
+    assert statuses(outcomes) == ["failed", "triggered"]
+    response = main.delivery_response(outcomes)
+    assert (response["status"], response["failed"], response["processed"]) == ("partial", 1, 1)
+
+def test_failures_are_reported_when_the_store_write_fails(pipeline):
+    scripted = pipeline({"1": [(http_error(400), False)]})
+    def unavailable(entries):
+        raise ConnectionError("store down")
+    scripted.store.add = unavailable
+    assert statuses(main.process_events(None, events("1", "2"))) == ["failed", "triggered"]
+
+def test_sigterm_sends_pending_triggers_then_chains(monkeypatch):
+    sent, chained = [], []
+    coalescer = main.TriggerCoalescer(3600, sent.append)
+    coalescer.add({"portal_id": None, "object_type": "deals", "object_id": 1, "note_ids": [10]})
+    monkeypatch.setattr(main, "_trigger_coalescer", coalescer)
+    monkeypatch.setattr(main, "TRIGGER_COALESCING", True)
+    monkeypatch.setattr(main, "TRIGGER_COALESCE_WINDOW_SECONDS", 3600)
+    previous = signal.signal(signal.SIGTERM, lambda signum, frame: chained.append(signum))
+    try:
+        main.flush_triggers_on_sigterm()
+        signal.getsignal(signal.SIGTERM)(signal.SIGTERM, None)
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+    assert [trigger["note_ids"] for trigger in sent] == [[10]]
+    assert chained == [signal.SIGTERM]
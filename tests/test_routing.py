@@ -0,0 +1,53 @@
+from routing import RoutingTable
+
+SCHEMAS = [
+    {"objectTypeId": "2-100", "name": "treatment_episodes", "fullyQualifiedName": "p1_treatment_episodes",
+     "labels": {"singular": "Treatment Episode"}, "primaryDisplayProperty": "episode_name"},
+    {"objectTypeId": "2-200", "name": "insurance_authorizations", "fullyQualifiedName": "p1_insurance_authorizations",
+     "labels": {"singular": "Insurance Authorization"}},
+]
+
+ROUTES = [
+    {"object": "contacts", "webhook_url": "https://hooks/auth", "display_name": "Contact"},
+    {"object": "treatment_episodes", "webhook_url": "https://hooks/episode"},
+    {"object": "2-200", "webhook_url": "https://hooks/auth"},
+]
+
+def table():
+    return RoutingTable.build(ROUTES, SCHEMAS)
+
+def test_build_resolves_routes_from_schemas():
+    routing = table()
+    assert routing.association_types == ["contacts", "2-100", "2-200"]
+    episode = routing.route_for("2-100")
+    assert episode.display_name == "Treatment Episode"
+    assert episode.name_properties == ["episode_name"]
+    assert episode.webhook_url == "https://hooks/episode"
+
+def test_find_target_picks_the_highest_priority_type():
+    routing = table()
+    route, object_id = routing.find_target({"2-200": ["7"], "2-100": ["5", "6"], "contacts": ["1"]})
+    assert (route.object_type, object_id) == ("contacts", "1")
+    route, object_id = routing.find_target({"2-200": ["7"], "2-100": ["5", "6"]})
+    assert (route.object_type, object_id) == ("2-100", "5")
+
+def test_find_target_accepts_every_association_key_of_a_type():
+    routing = table()
+    route, object_id = routing.find_target({"p1_insurance_authorizations": ["7"]})
+    assert (route.object_type, object_id) == ("2-200", "7")
+    route, object_id = routing.find_target({"0-1": ["3"]})
+    assert (route.object_type, object_id) == ("contacts", "3")
+
+def test_find_target_ignores_unrouted_and_empty_associations():
+    routing = table()
+    assert routing.find_target({"deals": ["9"], "2-100": []}) == (None, None)
+    assert routing.find_target({}) == (None, None)
+
+def test_unresolvable_routes_are_dropped():
+    routing = RoutingTable.build([{"object": "no_such_object", "webhook_url": "x"}] + ROUTES, SCHEMAS)
+    assert routing.association_types == ["contacts", "2-100", "2-200"]
+
+def test_routes_without_schemas_fall_back_to_defaults():
+    routing = RoutingTable.build(ROUTES, [])
+    assert routing.association_types == ["contacts", "2-200"]
+    assert routing.route_for("2-200").name_properties == ["name"]
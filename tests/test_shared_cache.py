@@ -0,0 +1,89 @@
+import threading
+import time
+import pytest
+import shared_cache
+from shared_cache import CacheBackend, TwoLevelCache
+
+class LockingBackend(CacheBackend):
+    """
+    In-memory shared tier with load locks, standing in for Redis.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.locks = {}
+
+    def get_many(self, keys):
+        now = time.time()
+        return {key: self.values[key] for key in keys if key in self.values and self.values[key][1] > now}
+
+    def set_many(self, items, ttl_seconds):
+        for key, value in items.items():
+            self.values[key] = (value, time.time() + ttl_seconds)
+
+    def lock_many(self, keys, ttl_seconds):
+        acquired = {}
+        for key in keys:
+            if key not in self.locks:
+                self.locks[key] = acquired[key] = object()
+        return acquired
+
+    def unlock_many(self, locks):
+        for key, token in locks.items():
+            if self.locks.get(key) is token:
+                del self.locks[key]
+
+@pytest.fixture(autouse=True)
+def short_waits(monkeypatch):
+    monkeypatch.setattr(shared_cache, "LOAD_POLL_SECONDS", 0.01)
+    monkeypatch.setattr(shared_cache, "CACHE_LOAD_WAIT_SECONDS", 0.5)
+
+def test_instance_waits_for_the_lock_holder():
+    backend = LockingBackend()
+    first, second = TwoLevelCache(10, backend, "t:"), TwoLevelCache(10, backend, "t:")
+    backend.locks["t:owner:1"] = "held by first"
+    loads = []
+
+    def finish_first_load():
+        time.sleep(0.05)
+        first.set_many({"owner:1": "alice"}, 60)
+        backend.unlock_many({"t:owner:1": "held by first"})
+    threading.Thread(target=finish_first_load).start()
+
+    values = second.get_many(["owner:1", "owner:2"], lambda keys: loads.append(keys) or {key: key for key in keys}, 60, 5)
+    assert values == {"owner:1": "alice", "owner:2": "owner:2"}
+    assert loads == [["owner:2"]]
+    assert backend.locks == {}
+
+def test_lock_holder_that_never_stores_is_loaded_after_the_wait():
+    backend = LockingBackend()
+    backend.locks["owner:1"] = "stuck"
+    cache = TwoLevelCache(10, backend)
+    assert cache.get("owner:1", lambda: "bob", 60, 5) == "bob"
+
+def test_not_found_is_cached_and_shared():
+    backend = LockingBackend()
+    first, second = TwoLevelCache(10, backend), TwoLevelCache(10, backend)
+    assert first.get("owner:9", lambda: None, 60, 5) is None
+    assert second.get("owner:9", lambda: pytest.fail("should come from the shared tier"), 60, 5) is None
+
+def test_concurrent_misses_in_one_process_share_one_load():
+    cache = TwoLevelCache(10)
+    started = threading.Event()
+    calls = []
+
+    def slow_load():
+        calls.append(1)
+        started.set()
+        time.sleep(0.05)
+        return "carol"
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get("owner:1", slow_load, 60, 5))) for _ in range(4)]
+    threads[0].start()
+    started.wait()
+    for thread in threads[1:]:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ["carol"] * 4
+    assert len(calls) == 1